@@ -8,28 +8,33 @@ Check nagios and generate summary report
 """
 import logging
 
-from typing import List, Optional, Union
+import signal
+
+from pathlib import Path
+
+from typing import Callable, Dict, List, Optional, TextIO
 
 import click
 
 from pynagiosreport.config import get_app_settings, LogLevels
 
-from pynagiosreport.nagios.api import NagiosAPI
+from pynagiosreport.exceptions import FilterSyntaxError
 
-from pynagiosreport.nagios.statusfile import StatusFile
+from pynagiosreport.nagios.selection import ReportOrder
 
-from pynagiosreport.email import send as send_email
+from pynagiosreport.grouping import GroupBy
 
-from pynagiosreport.rave import send as send_rave, get_description
+from pynagiosreport.formats import OutputFormat
 
-from pynagiosreport.models import \
-    HostStatus, HostStatusCore, ServiceStatus, ServiceStatusCore
+from pynagiosreport.report import Source, close_source, \
+    compile_expression, drain_outbox, get_source, open_source, \
+    print_summary, refresh_source, report, run_reports, write_report
 
 
 settings = get_app_settings()
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option(
     '--url',
     default=settings.url,
@@ -64,12 +69,111 @@ settings = get_app_settings()
     is_flag=True,
     help='Send report by stdout'
 )
+@click.option(
+    '--summary',
+    is_flag=True,
+    help='Print JSON counts of the critical objects instead of reporting'
+)
+@click.option(
+    '--format', 'output_format',
+    type=click.Choice([v.value for v in OutputFormat]),
+    help='Write the critical objects in this format instead of reporting'
+)
+@click.option(
+    '--output',
+    type=click.File('w'),
+    default='-',
+    help='File written by --format, stdout by default'
+)
+@click.option(
+    '--hostgroup',
+    multiple=True,
+    help='Only report the members of this hostgroup'
+)
+@click.option(
+    '--servicegroup',
+    multiple=True,
+    help='Only report the services of this servicegroup'
+)
+@click.option(
+    '--filter', 'expression',
+    help="Only report the objects matching an expression, "
+    "e.g. \"host_name ~ '^db' and last_state_change < now-15m\""
+)
+@click.option(
+    '--ignore-file',
+    multiple=True,
+    help='File of the hosts/services never reported, one name or re:regex '
+    'per line'
+)
+@click.option(
+    '--order',
+    type=click.Choice([v.value for v in ReportOrder]),
+    help='Order of the hosts/services displayed when over the limits'
+)
+@click.option(
+    '--group-by',
+    type=click.Choice([v.value for v in GroupBy]),
+    help='How identical failures are grouped during alert storms'
+)
+@click.option(
+    '--collapse/--no-collapse',
+    default=None,
+    help='Count the services of critical hosts on the host line'
+)
+@click.option(
+    '--dependencies/--no-dependencies',
+    default=None,
+    help='Do not report objects behind a reported parent or dependency'
+)
+@click.option(
+    '--maintenance-file',
+    help='JSON calendar of maintenance windows not reported'
+)
+@click.option(
+    '--changes-only',
+    type=click.Choice(['email', 'rave']),
+    multiple=True,
+    help='Only report what changed since the last run for those sinks'
+)
+@click.option(
+    '--routing-file',
+    help='JSON rules routing each host/service to its recipients'
+)
+@click.option(
+    '--contacts',
+    is_flag=True,
+    help='Email the contacts of each host/service in objects.cache'
+)
+@click.option(
+    '--reports-file',
+    help='JSON file of reports run from a single fetch, instead of the '
+    'recipients given here'
+)
+@click.option(
+    '--renotify-interval',
+    type=float,
+    help='Seconds before the same critical set is emailed or sent by Rave '
+    'again'
+)
+@click.option(
+    '--watch',
+    is_flag=True,
+    help='Keep running and report every time the status file is rewritten'
+)
+@click.option(
+    '--follow-log',
+    is_flag=True,
+    help='With --watch, maintain the critical state from nagios.log'
+)
 @click.option(
     '--log-level',
     type=click.Choice([v.value for v in LogLevels]),
     help='Verbosity'
 )
+@click.pass_context
 def main(
+    ctx: click.Context,
     url: str,
     apikey: Optional[str],
     status_file: str,
@@ -77,6 +181,25 @@ def main(
     allow_empty_email: bool,
     allow_empty_rave: bool,
     stdout: bool,
+    summary: bool,
+    output_format: Optional[str],
+    output: TextIO,
+    hostgroup: List[str],
+    servicegroup: List[str],
+    expression: Optional[str],
+    ignore_file: List[str],
+    order: Optional[str],
+    group_by: Optional[str],
+    collapse: Optional[bool],
+    dependencies: Optional[bool],
+    maintenance_file: Optional[str],
+    changes_only: List[str],
+    routing_file: Optional[str],
+    contacts: bool,
+    reports_file: Optional[str],
+    renotify_interval: Optional[float],
+    watch: bool,
+    follow_log: bool,
     log_level: str,
 ):
     """
@@ -91,46 +214,120 @@ def main(
         settings.apikey = apikey
     if status_file is not None:
         settings.status_file = status_file
+    if hostgroup:
+        settings.hostgroups = list(hostgroup)
+    if servicegroup:
+        settings.servicegroups = list(servicegroup)
+    if expression is not None:
+        try:
+            compile_expression(expression)
+        except FilterSyntaxError as err:
+            raise click.BadParameter(str(err), param_hint='--filter')
+        settings.filter = expression
+    if ignore_file:
+        settings.ignore_files = list(ignore_file)
+    if order is not None:
+        settings.report_order = ReportOrder(order)
+    if group_by is not None:
+        settings.group_by = GroupBy(group_by)
+    if collapse is not None:
+        settings.collapse_host_services = collapse
+    if dependencies is not None:
+        settings.suppress_dependencies = dependencies
+    if maintenance_file is not None:
+        settings.maintenance_file = maintenance_file
+    if routing_file is not None:
+        settings.routing_file = routing_file
+    if contacts:
+        if not settings.objects_cache_file.exists():
+            raise click.UsageError('--contacts requires objects.cache')
+        settings.route_to_contacts = True
+    if reports_file is not None:
+        settings.reports_file = reports_file
+    if renotify_interval is not None:
+        settings.renotify_interval = renotify_interval
     if log_level is not None:
         settings.log_level = LogLevels[log_level]
     settings.configure_logging()
 
-    # defined the type of the hosts/services structure for typing
-    hosts: Union[List[HostStatus], List[HostStatusCore]]
-    services: Union[List[ServiceStatus], List[ServiceStatusCore]]
+    def run(source: Source) -> None:
+        if summary:
+            print_summary(source)
+        elif output_format:
+            write_report(source, OutputFormat(output_format), output)
+        else:
+            if settings.reports_file:
+                run_reports(source, Path(settings.reports_file))
+            else:
+                report(source, emails, allow_empty_email, allow_empty_rave,
+                       stdout, changes_only)
+            # notifications that failed in previous runs
+            if settings.outbox:
+                drain_outbox()
+
+    if ctx.invoked_subcommand is not None:
+        if follow_log and settings.apikey:
+            raise click.UsageError('--follow-log requires the status file')
+        # the subcommand reports with the options given here
+        ctx.obj = {'run': run, 'follow_log': follow_log}
+        return
+
+    if not watch:
+        run(get_source())
+        return
 
-    # Create api client if the API key is set and get
-    # the failed services/hosts, if not, use the status.dat
     if settings.apikey:
-        api = NagiosAPI(settings.url_api, settings.apikey)
-        hosts = api.get_critical_hosts()
-        services = api.get_critical_services()
-    else:
-        stat = StatusFile(settings.status_file)
-        hosts = stat.get_critical_hosts()
-        services = stat.get_critical_services()
-
-    total_critical = len(hosts) + len(services)
-
-    # No send the reports based on the set parameters
-    if len(emails):
-        logging.info(f'Preparing emailing to {emails}')
-        if not allow_empty_email and total_critical == 0:
-            logging.info('Empty email, do not send')
-        else:
-            logging.info('Sending email')
-            send_email(hosts, services, emails)
-
-    if (
-        settings.rave_url and
-        settings.rave_username and
-        settings.rave_password
-    ):
-        if not allow_empty_rave and total_critical == 0:
-            logging.info('Empty rave, do not send')
-        else:
-            logging.info('Preparing sending by rave')
-            send_rave(hosts, services)
+        raise click.UsageError('--watch requires the status file')
+    from pynagiosreport.watch import StatusFileWatcher
+    source = open_source(follow_log)
+    watcher = StatusFileWatcher(settings.status_file, settings.watch_debounce)
+    try:
+        run(source)
+        for filename in watcher:
+            logging.info(f'New {filename} landed')
+            try:
+                refresh_source(source)
+                run(source)
+            except Exception:
+                logging.exception('Report failed, waiting for next update')
+    finally:
+        watcher.close()
+        close_source(source)
+
+
+@main.command()
+@click.option(
+    '--interval',
+    type=float,
+    help='Seconds between the reports'
+)
+@click.pass_obj
+def daemon(obj: Dict, interval: Optional[float]):
+    """
+    Keep running and report on a schedule instead of cron.
+
+    Settings, compiled templates, HTTP and SMTP connections, the parsed
+    status and the last snapshot are kept between the reports.  The
+    report options are given before the command.
+    """
+    from pynagiosreport.email import close_smtp
+    from pynagiosreport.scheduler import Job, Scheduler
+
+    if interval is not None:
+        settings.daemon_interval = interval
+    settings.smtp_keep_alive = True
+    source = open_source(obj['follow_log'])
+    run: Callable[[Source], None] = obj['run']
+
+    def report_job() -> None:
+        refresh_source(source)
+        run(source)
 
-    if stdout:
-        print(get_description(hosts, services))
+    scheduler = Scheduler()
+    scheduler.add(Job('report', settings.daemon_interval, report_job))
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+    try:
+        scheduler.run()
+    finally:
+        close_source(source)
+        close_smtp()
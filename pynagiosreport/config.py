@@ -1,7 +1,7 @@
 '''
 ..  codeauthor:: Charles Blais <charles.blais@nrcan-rncan.gc.ca>
 '''
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
 
 import logging
 
@@ -9,11 +9,19 @@ from enum import Enum
 
 from pathlib import Path
 
+from contextlib import contextmanager
+
 from functools import lru_cache
 
 from pydantic import BaseSettings, BaseModel
 
-from jinja2 import Template, Environment, FileSystemLoader
+from .nagios.selection import ReportOrder
+
+from .grouping import GroupBy
+
+# jinja2 is only imported when a template is rendered
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
 
 
 class LogLevels(Enum):
@@ -44,20 +52,100 @@ class AppSettings(BaseSettings):
     apikey = ''
 
     status_file = '/usr/local/nagios/var/status.dat'
+    # seconds without change before a rewritten status file is parsed
+    watch_debounce: float = 1.0
 
     templates_dir: str = str(Path(__file__).parent.joinpath(
         'files', 'templates'))
 
+    # template of the email in templates_dir
+    status_template: str = 'status.html.j2'
+
     smtp_server = 'mailhost.seismo.nrcan.gc.ca'
     email_subject = 'Nagios XI Report'
     email_from = 'cnsnopr@seismo.nrcan.gc.ca'
+    smtp_port: int = 0
+    smtp_starttls: bool = False
+    smtp_username: Optional[str] = None
+    smtp_password: Optional[str] = None
+    # seconds each SMTP command of a message can take
+    smtp_timeout: float = 30
+    # connections, and emails sent at the same time
+    smtp_connections: int = 4
+    # recipients per message sent, 0 for no limit
+    smtp_max_recipients: int = 50
+    # keep the SMTP connections open between emails (daemon)
+    smtp_keep_alive: bool = False
+
+    # seconds a sink (email, routed email, rave, stdout) has to send a
+    # report, by sink
+    sink_deadline: float = 120
+    sink_deadlines: Dict[str, float] = {'rave': 30}
 
     rave_url: Optional[str] = None
     rave_username: Optional[str] = None
     rave_password: Optional[str] = None
 
+    # only report the members of those groups, all if empty
+    hostgroups: List[str] = []
+    servicegroups: List[str] = []
+    # only report the objects matching this expression, see
+    # pynagiosreport.nagios.expression
+    filter: Optional[str] = None
+    # files of the hosts and services never reported, see
+    # pynagiosreport.filters.IgnoreList
+    ignore_files: List[str] = []
+    # JSON calendar of maintenance windows, see pynagiosreport.maintenance
+    maintenance_file: Optional[str] = None
+    # seconds the group members queried from the API are cached
+    group_index_ttl: float = 3600
+
     max_report_hosts: int = 20
     max_report_services: int = 20
+    # which hosts/services are displayed when over the limits
+    report_order: ReportOrder = ReportOrder.oldest
+    # above this number of hosts or services, identical failures are
+    # reported as one line per group
+    group_by: Optional[GroupBy] = GroupBy.output
+    group_threshold: int = 100
+    # services of critical hosts are counted on the host line
+    collapse_host_services: bool = True
+    # objects behind a reported host parent or service dependency are not
+    # reported (requires objects.cache)
+    suppress_dependencies: bool = True
+
+    # seconds before the same critical set is notified again by email or
+    # Rave, always notified if None
+    renotify_interval: Optional[float] = None
+    # seconds after the first notification of a set it is notified again,
+    # before the re-notify interval applies
+    reminder_schedule: List[float] = []
+
+    # spool the emails and Rave notices, sent again after a failure
+    outbox: bool = False
+    outbox_max_attempts: int = 10
+    # seconds before the first retry, doubled every attempt
+    outbox_backoff: float = 60
+    outbox_max_backoff: float = 3600
+    # notifications sent at once
+    outbox_batch: int = 50
+
+    # JSON rules routing the objects to their recipients, see
+    # pynagiosreport.routing
+    routing_file: Optional[str] = None
+    # email the contacts of the objects in objects.cache
+    route_to_contacts: bool = False
+    # JSON file of the reports run from a single fetch, see
+    # pynagiosreport.reports
+    reports_file: Optional[str] = None
+    # name of the report being run from the reports file
+    report_name: Optional[str] = None
+
+    # seconds between the reports of the daemon
+    daemon_interval: float = 60
+
+    # Persistent state kept between runs
+    state_dir: str = '/var/tmp/pynagiosreport'
 
     class Config:
         env_file = '.env'
@@ -72,25 +160,107 @@ class AppSettings(BaseSettings):
         return f'{self.url}/{self.path_status}'
 
     @property
-    def j2_templates_env(self) -> Environment:
-        return Environment(
-            loader=FileSystemLoader(self.templates_dir),
-            trim_blocks=True)
+    def snapshot_file(self) -> Path:
+        '''
+        Last critical snapshot used by the --changes-only modes
+        '''
+        if self.report_name:
+            return Path(self.state_dir).joinpath(
+                f'snapshot.{self.report_name}.json')
+        return Path(self.state_dir).joinpath('snapshot.json')
+
+    @property
+    def notified_file(self) -> Path:
+        '''
+        Fingerprint of the critical set last notified to each sink
+        '''
+        if self.report_name:
+            return Path(self.state_dir).joinpath(
+                f'notified.{self.report_name}.json')
+        return Path(self.state_dir).joinpath('notified.json')
+
+    @property
+    def outbox_dir(self) -> Path:
+        '''
+        Spool of the notifications to send
+        '''
+        return Path(self.state_dir).joinpath('outbox')
+
+    @property
+    def nagios_log_file(self) -> Path:
+        '''
+        nagios.log written next to the status file
+        '''
+        return Path(self.status_file).parent.joinpath('nagios.log')
 
     @property
-    def j2_status_template(self) -> Template:
+    def objects_cache_file(self) -> Path:
+        '''
+        objects.cache written next to the status file
+        '''
+        return Path(self.status_file).parent.joinpath('objects.cache')
+
+    @property
+    def objects_index_file(self) -> Path:
+        '''
+        Index of objects.cache kept between runs
+        '''
+        return Path(self.state_dir).joinpath('objects.index.json')
+
+    @property
+    def group_index_file(self) -> Path:
+        '''
+        Index of the group members queried from the API
+        '''
+        return Path(self.state_dir).joinpath('groups.index.json')
+
+    @property
+    def log_checkpoint_file(self) -> Path:
+        '''
+        Position reached in nagios.log by the incremental state
+        '''
+        return Path(self.state_dir).joinpath('nagios.log.checkpoint')
+
+    @property
+    def template_cache_dir(self) -> Path:
+        '''
+        Compiled templates kept between runs
+        '''
+        return Path(self.state_dir).joinpath('templates')
+
+    @property
+    def j2_templates_env(self) -> 'Environment':
+        return get_templates_env(
+            self.templates_dir, str(self.template_cache_dir))
+
+    @property
+    def j2_status_template(self) -> 'Template':
         '''
         Jinja2 status output template
         '''
-        return self.j2_templates_env.get_template('status.html.j2')
+        return self.j2_templates_env.get_template(self.status_template)
 
     @property
-    def j2_fax_template(self) -> Template:
+    def j2_fax_template(self) -> 'Template':
         '''
         Jinja2 status output template
         '''
         return self.j2_templates_env.get_template('schedule_fax.xml.j2')
 
+    @contextmanager
+    def override(self, values: Dict[str, Any]) -> Iterator[None]:
+        '''
+        Change some settings until the end of the block
+        '''
+        previous = {name: getattr(self, name) for name in values}
+        try:
+            for name, value in values.items():
+                setattr(self, name, value)
+            yield
+        finally:
+            for name, value in previous.items():
+                setattr(self, name, value)
+
     def configure_logging(self):
         '''
         Configure logging for app
@@ -107,6 +277,33 @@ class AppSettings(BaseSettings):
             level=level)
 
 
+@lru_cache()
+def get_templates_env(
+    templates_dir: str,
+    cache_dir: Optional[str] = None,
+) -> 'Environment':
+    '''
+    Jinja2 environment shared by the process
+
+    The environment keeps the templates it compiled, and their bytecode
+    is saved in cache_dir so other runs skip the compilation.
+    '''
+    from jinja2 import \
+        Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    bytecode_cache = None
+    if cache_dir is not None:
+        try:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        except OSError as err:
+            logging.warning(f'No template bytecode cache: {err}')
+    return Environment(
+        loader=FileSystemLoader(templates_dir),
+        bytecode_cache=bytecode_cache,
+        trim_blocks=True)
+
+
 @lru_cache()
 def get_app_settings() -> AppSettings:
     return AppSettings()
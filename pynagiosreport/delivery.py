@@ -0,0 +1,207 @@
+'''
+..  codeauthor:: Charles Blais
+
+Delivery of the emails through a pool of SMTP connections
+
+Routed and per-contact reports produce one message per recipient.  The
+messages are sent concurrently by a few threads, each borrowing a
+connection from the pool for the duration of a message, so the
+connection setup (and STARTTLS handshake) is paid once per connection
+instead of once per message.  Recipients are sent in chunks to stay
+under the limit of recipients per message of the server.
+'''
+import logging
+
+import queue
+
+import smtplib
+
+import threading
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from contextlib import contextmanager
+
+from email.message import Message
+
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+
+class SMTPPool:
+    '''
+    Connections to an SMTP server shared by the sending threads
+
+    :param host: SMTP server
+    :param port: SMTP port, 0 for the default
+    :param size: maximum number of connections open
+    :param timeout: seconds each command of a message can take
+    :param starttls: upgrade the connections to TLS
+    :param username: login after connecting, if set
+    :param password: password of the login
+    :param idle: seconds a connection stays unused before it is checked
+        with NOOP
+    '''
+    def __init__(
+        self,
+        host: str,
+        port: int = 0,
+        size: int = 4,
+        timeout: float = 30,
+        starttls: bool = False,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        idle: float = 30,
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+        self.idle = idle
+        # connections not in use with the time they were released
+        self.idle_connections: 'queue.LifoQueue[Tuple[smtplib.SMTP, float]]' \
+            = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or '')
+        logging.debug(f'Connected to {self.host}')
+        return smtp
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            try:
+                smtp, released = self.idle_connections.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            if time.monotonic() - released < self.idle:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            discard(smtp)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        '''
+        Borrow a connection, discarded if the message fails
+        '''
+        with self.slots:
+            smtp = self.acquire()
+            try:
+                yield smtp
+            except BaseException:
+                discard(smtp)
+                raise
+            self.idle_connections.put((smtp, time.monotonic()))
+
+    def close(self) -> None:
+        '''
+        Close the connections not in use
+        '''
+        while True:
+            try:
+                smtp, _ = self.idle_connections.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                discard(smtp)
+
+
+def discard(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.close()
+    except OSError:
+        pass
+
+
+def chunk(recipients: Sequence[str], size: int) -> List[List[str]]:
+    '''
+    Split the recipients in lists of at most size
+    '''
+    if size <= 0:
+        return [list(recipients)]
+    return [
+        list(recipients[start:start + size])
+        for start in range(0, len(recipients), size)]
+
+
+class Delivery:
+    '''
+    Send messages concurrently through a pool
+
+    :param pool: SMTP connections
+    :param concurrency: messages sent at the same time
+    :param max_recipients: recipients per message sent, 0 for no limit
+    '''
+    def __init__(
+        self,
+        pool: SMTPPool,
+        concurrency: int = 4,
+        max_recipients: int = 0,
+    ):
+        self.pool = pool
+        self.concurrency = concurrency
+        self.max_recipients = max_recipients
+
+    def send_one(self, msg: Message, recipients: Sequence[str]) -> None:
+        with self.pool.connection() as smtp:
+            smtp.sendmail(msg['From'], list(recipients), msg.as_string())
+
+    def send_each(
+        self,
+        messages: Sequence[Tuple[Message, Sequence[str]]],
+    ) -> List[Optional[Exception]]:
+        '''
+        Send every message to its recipients, a failing message does not
+        stop the others
+
+        :returns: error of each message, None if it was sent
+        '''
+        jobs = [
+            (index, msg, recipients)
+            for index, (msg, all_recipients) in enumerate(messages)
+            for recipients in chunk(all_recipients, self.max_recipients)]
+        errors: List[Optional[Exception]] = [None] * len(messages)
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.concurrency, len(jobs)))
+        ) as executor:
+            futures = [
+                (index, recipients,
+                 executor.submit(self.send_one, msg, recipients))
+                for index, msg, recipients in jobs]
+            for index, recipients, future in futures:
+                try:
+                    future.result()
+                except Exception as err:
+                    logging.error(f'Email to {recipients} failed: {err}')
+                    errors[index] = errors[index] or err
+        return errors
+
+    def send(
+        self,
+        messages: Sequence[Tuple[Message, Sequence[str]]],
+    ) -> int:
+        '''
+        Send every message to its recipients
+
+        A failing message does not stop the others; once all were tried,
+        the first error is raised.
+
+        :returns: number of messages sent
+        '''
+        errors = [error for error in self.send_each(messages) if error]
+        if errors:
+            raise errors[0]
+        return len(messages)
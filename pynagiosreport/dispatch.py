@@ -0,0 +1,99 @@
+'''
+..  codeauthor:: Charles Blais
+
+Send a report to its sinks concurrently
+
+Each sink (email, Rave, stdout) runs in its own thread with its own
+deadline, so a slow SMTP server does not delay the Rave notice.  A sink
+failing or running late does not affect the others; the time each sink
+took is logged and returned.
+'''
+import logging
+
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+
+class Sink(NamedTuple):
+    name: str
+    send: Callable[[], None]
+    # seconds the sink has to complete
+    deadline: float
+
+
+class SinkResult(NamedTuple):
+    name: str
+    ok: bool
+    # seconds until the sink completed, or the deadline
+    latency: float
+    error: Optional[str] = None
+
+
+def dispatch(sinks: Sequence[Sink]) -> List[SinkResult]:
+    '''
+    Run the sinks concurrently, each until its deadline
+
+    A sink past its deadline is reported as failed and its thread is
+    left to finish in the background: the notification may still be
+    delivered, late.  The caller reports it again (the changes are not
+    saved, the fingerprint is not marked notified) and the outbox
+    replaces a pending notification of the same destination, so a late
+    delivery is at worst sent twice, never lost.  The sinks must not
+    read state the caller changes after the dispatch, such as the
+    overridden settings of a report; the interpreter waits for the late
+    threads before exiting.
+    '''
+    if not sinks:
+        return []
+    start = time.monotonic()
+    finished: Dict[str, float] = {}
+
+    def run(sink: Sink) -> None:
+        try:
+            sink.send()
+        finally:
+            finished[sink.name] = time.monotonic() - start
+
+    executor = ThreadPoolExecutor(max_workers=len(sinks))
+    futures: Dict[Future, Sink] = {
+        executor.submit(run, sink): sink for sink in sinks}
+    pending = set(futures)
+    results: Dict[str, SinkResult] = {}
+    try:
+        while pending:
+            # wait until the next sink completes or the nearest deadline
+            now = time.monotonic() - start
+            nearest = min(futures[f].deadline for f in pending)
+            done, pending = wait(
+                pending, timeout=max(0, nearest - now),
+                return_when='FIRST_COMPLETED')
+            for future in done:
+                sink = futures[future]
+                error = future.exception()
+                results[sink.name] = SinkResult(
+                    sink.name, error is None, finished[sink.name],
+                    None if error is None else repr(error))
+            now = time.monotonic() - start
+            for future in list(pending):
+                sink = futures[future]
+                if now >= sink.deadline:
+                    pending.discard(future)
+                    results[sink.name] = SinkResult(
+                        sink.name, False, now,
+                        f'deadline of {sink.deadline} seconds exceeded')
+    finally:
+        executor.shutdown(wait=False)
+
+    ordered = [results[sink.name] for sink in sinks]
+    for result in ordered:
+        if result.ok:
+            logging.info(
+                f'Sink {result.name} done in {result.latency:.3f} seconds')
+        else:
+            logging.error(
+                f'Sink {result.name} failed after {result.latency:.3f} '
+                f'seconds: {result.error}')
+    return ordered
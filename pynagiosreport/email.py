@@ -13,56 +13,230 @@ https://assets.nagios.com/downloads/nagioscore/docs/nagioscore/3/en/hostchecks.h
 :history: 2018-02-05 Charles
     Major modification to clean up code
 """
-import smtplib
-
 import logging
 
 import datetime
 
+import threading
+
+from email import message_from_string
+
+from email.message import Message
+
 from email.mime.multipart import MIMEMultipart
 
 from email.mime.text import MIMEText
 
-from typing import List, Union
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple, \
+    Union
 
-from .models import \
+from .models import CriticalCounts, \
     HostStatus, HostStatusCore, ServiceStatus, ServiceStatusCore
 
+from .snapshot import SnapshotDiff
+
 from .config import get_app_settings
 
+from .delivery import Delivery, SMTPPool
+
+from .exceptions import SinkError
+
+from .outbox import OutboxEntry, get_outbox
+
+if TYPE_CHECKING:
+    from .config import AppSettings
+
+
+# connections kept open between the emails of a long running process,
+# by SMTP settings
+_deliveries: Dict[Tuple, Delivery] = {}
+# the sinks of a report send their emails from concurrent threads
+_deliveries_lock = threading.Lock()
+
+
+def get_delivery(settings: Optional['AppSettings'] = None) -> Delivery:
+    """
+    Delivery through the SMTP connections of the process
+    """
+    settings = settings or get_app_settings()
+    key = (
+        settings.smtp_server,
+        settings.smtp_port,
+        settings.smtp_connections,
+        settings.smtp_timeout,
+        settings.smtp_starttls,
+        settings.smtp_username,
+        settings.smtp_password,
+        settings.smtp_max_recipients)
+    with _deliveries_lock:
+        delivery = _deliveries.get(key)
+        if delivery is None:
+            delivery = _deliveries[key] = Delivery(
+                SMTPPool(*key[:-1]),
+                settings.smtp_connections,
+                settings.smtp_max_recipients)
+    return delivery
+
+
+def close_smtp() -> None:
+    """
+    Close the connections kept open, if any
+    """
+    with _deliveries_lock:
+        deliveries = list(_deliveries.values())
+    for delivery in deliveries:
+        delivery.pool.close()
+
+
+def deliver(
+    messages: Sequence[Tuple[Message, Sequence[str]]],
+    settings: Optional['AppSettings'] = None,
+    replace: bool = True,
+) -> None:
+    """
+    Send messages to their recipients concurrently
+
+    The connections are kept open for the next emails when
+    smtp_keep_alive is set.  With the outbox, the messages are spooled
+    first and kept until the server accepts them; a message kept for a
+    retry raises SinkError.
+
+    :param settings: settings of the report, those of the process by
+        default
+    :param replace: the messages replace those pending in the outbox for
+        the same recipients; the messages listing changes are all kept
+    """
+    settings = settings or get_app_settings()
+    if settings.outbox:
+        outbox = get_outbox(settings)
+        kind = 'email' if replace else 'email changes'
+        paths = [
+            outbox.put(
+                'email',
+                f'{kind}:{settings.report_name or ""}:'
+                f'{",".join(sorted(recipients))}',
+                {'message': msg.as_string(), 'recipients': list(recipients)},
+                replace,
+                settings.report_name)
+            for msg, recipients in messages]
+        drain(settings)
+        kept = [path for path in paths if not outbox.delivered(path)]
+        if kept:
+            raise SinkError(
+                f'{len(kept)} of {len(paths)} emails kept in the outbox')
+        return
+    logging.info(
+        f'Sending {len(messages)} emails from SMTP: {settings.smtp_server}')
+    try:
+        get_delivery(settings).send(messages)
+    finally:
+        if not settings.smtp_keep_alive:
+            close_smtp()
+
+
+def send_spooled(
+    entries: List[OutboxEntry],
+    settings: Optional['AppSettings'] = None,
+) -> List[Optional[Exception]]:
+    """
+    Send a batch of messages of the outbox concurrently
+    """
+    settings = settings or get_app_settings()
+    try:
+        return get_delivery(settings).send_each([
+            (message_from_string(entry.payload['message']),
+             entry.payload['recipients'])
+            for entry in entries])
+    finally:
+        if not settings.smtp_keep_alive:
+            close_smtp()
+
+
+def drain(settings: Optional['AppSettings'] = None) -> int:
+    """
+    Send the messages of the outbox due for an attempt, those of the
+    report of the settings
+    """
+    settings = settings or get_app_settings()
+    return get_outbox(settings).drain(
+        'email', lambda entries: send_spooled(entries, settings),
+        settings.report_name)
+
 
 def send(
-    hosts: Union[List[HostStatus], List[HostStatusCore]],
-    services: Union[List[ServiceStatus], List[ServiceStatusCore]],
+    hosts: Sequence[Union[HostStatus, HostStatusCore]],
+    services: Sequence[Union[ServiceStatus, ServiceStatusCore]],
     recipients: List[str],
+    changes: Optional[SnapshotDiff] = None,
+    hosts_counts: Optional[CriticalCounts] = None,
+    services_counts: Optional[CriticalCounts] = None,
+    settings: Optional['AppSettings'] = None,
 ) -> None:
     """
     Send an email of the html Nagios summary
 
+    See build_message for the parameters.
+    """
+    logging.info(f'Sending to: {",".join(recipients)}')
+    deliver([(
+        build_message(
+            hosts, services, recipients, changes, hosts_counts,
+            services_counts, settings),
+        recipients)], settings, changes is None)
+
+
+def build_message(
+    hosts: Sequence[Union[HostStatus, HostStatusCore]],
+    services: Sequence[Union[ServiceStatus, ServiceStatusCore]],
+    recipients: List[str],
+    changes: Optional[SnapshotDiff] = None,
+    hosts_counts: Optional[CriticalCounts] = None,
+    services_counts: Optional[CriticalCounts] = None,
+    settings: Optional['AppSettings'] = None,
+) -> MIMEMultipart:
+    """
+    Email of the html Nagios summary
+
     :param html: html format of summary
     :param recipients: list of emails to send email to
+    :param changes: when reporting only changes, list what was resolved
+        or acknowledged since the last report
+    :param hosts_counts: count of all critical hosts when the source
+        only returned those within the report limit
+    :param services_counts: same for the services
+    :param settings: settings of the report, those of the process by
+        default
     """
-    settings = get_app_settings()
+    settings = settings or get_app_settings()
 
     msg = MIMEMultipart('alternative')
     msg['Subject'] = settings.email_subject
     msg['To'] = ",".join(recipients)
     msg['From'] = settings.email_from
 
-    hosts_count = len(hosts)
+    hosts_count = hosts_counts.total if hosts_counts else len(hosts)
     more_host_count = (
         hosts_count - settings.max_report_hosts
         if hosts_count > settings.max_report_hosts
         else 0)
     hosts = hosts[:settings.max_report_hosts]
 
-    services_count = len(services)
+    services_count = (
+        services_counts.total if services_counts else len(services))
     more_service_count = (
         services_count - settings.max_report_services
         if services_count > settings.max_report_services
         else 0)
     services = services[:settings.max_report_services]
 
+    # During alert storms, one line per group of identical failures
+    hosts_groups = (
+        hosts_counts.get_groups(settings.group_threshold)
+        if hosts_counts else [])
+    services_groups = (
+        services_counts.get_groups(settings.group_threshold)
+        if services_counts else [])
+
     msg.attach(MIMEText(settings.j2_status_template.render(
         now=datetime.datetime.utcnow(),
         hosts=hosts,
@@ -70,10 +244,18 @@ def send(
         url_status=settings.url_status,
         more_host_count=more_host_count,
         more_service_count=more_service_count,
+        services_by_host=(
+            hosts_counts.services_by_host if hosts_counts else {}),
+        hosts_suppressed=hosts_counts.suppressed if hosts_counts else {},
+        services_suppressed=(
+            services_counts.suppressed if services_counts else {}),
+        hosts_groups=hosts_groups[:settings.max_report_hosts],
+        services_groups=services_groups[:settings.max_report_services],
+        more_hosts_groups_count=max(
+            0, len(hosts_groups) - settings.max_report_hosts),
+        more_services_groups_count=max(
+            0, len(services_groups) - settings.max_report_services),
+        resolved=changes.resolved_names if changes else [],
+        acknowledged=changes.acknowledged_names if changes else [],
     ), 'html'))
-
-    logging.info(f'Sending email from SMTP: {settings.smtp_server}')
-    smtp = smtplib.SMTP(settings.smtp_server)
-    logging.info(f'Sending to: {msg["To"]}')
-    smtp.sendmail(msg['From'], recipients, msg.as_string())
-    smtp.quit()
+    return msg
@@ -5,3 +5,11 @@
 
 class NagiosAPIException(Exception):
     '''Custom exception for Nagios API'''
+
+
+class FilterSyntaxError(ValueError):
+    '''Invalid filter expression'''
+
+
+class SinkError(Exception):
+    '''A report could not be sent to some of its sinks'''
@@ -0,0 +1,164 @@
+'''
+..  codeauthor:: Charles Blais
+
+Filters restricting the records reported to a scope
+'''
+import logging
+
+import re
+
+from typing import Callable, Iterable, List, Optional, Sequence
+
+from .nagios.objects import ObjectsIndex, service_key
+
+from .nagios.record import Record
+
+from .storage import FileCache
+
+
+# global inline flags at the start of an expression, (?i)
+GLOBAL_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+
+def compile_pattern(pattern: str, origin: str) -> 're.Pattern[str]':
+    '''
+    Compile a regular expression of a configuration file
+
+    Its leading global flags are turned into a scoped group, (?i)^db into
+    (?i:^db), so it can be combined with other expressions.
+
+    :param origin: where the expression is defined, named in the error
+    '''
+    match = GLOBAL_FLAGS.match(pattern)
+    scoped = (
+        f'(?{match.group(1)}:{pattern[match.end():]})' if match
+        else pattern)
+    try:
+        return re.compile(scoped)
+    except re.error as err:
+        raise ValueError(f'Invalid regex {pattern} in {origin}: {err}')
+
+
+def combine_patterns(
+    patterns: Sequence['re.Pattern[str]'],
+) -> Optional[Callable[[str], object]]:
+    '''
+    Search of any of the expressions in a single alternation, None if
+    there is none
+    '''
+    if not patterns:
+        return None
+    try:
+        return re.compile(
+            '|'.join(f'(?:{p.pattern})' for p in patterns)).search
+    except re.error:
+        # named groups or back references can not be combined
+        return lambda name: any(p.search(name) for p in patterns)
+
+
+class GroupMembership:
+    '''
+    Keep only the members of hostgroups and servicegroups
+
+    Hosts are kept if they belong to one of the hostgroups, or with only
+    servicegroups, if one of their services belongs to one of them;
+    services if their host belongs to one of the hostgroups, and if they
+    belong to one of the servicegroups.  The index is inverted (member ->
+    groups) so each record is checked in constant time.
+
+    :param index: index of the group members
+    :param hostgroups: hostgroups reported, all if empty
+    :param servicegroups: servicegroups reported, all if empty
+    '''
+    def __init__(
+        self,
+        index: ObjectsIndex,
+        hostgroups: Iterable[str] = (),
+        servicegroups: Iterable[str] = (),
+    ):
+        self.index = index
+        self.hostgroups = frozenset(hostgroups)
+        self.servicegroups = frozenset(servicegroups)
+        # hosts of the services in the servicegroups
+        self.hosts = frozenset(
+            key.split(';', 1)[0]
+            for key, groups in self.index.servicegroups.items()
+            if not self.servicegroups.isdisjoint(groups))
+
+    def __call__(self, record: Record) -> bool:
+        if self.hostgroups and self.hostgroups.isdisjoint(
+                self.index.hostgroups.get(record.host_name, ())):
+            return False
+        if not self.servicegroups:
+            return True
+        if not record.service_description:
+            return bool(self.hostgroups) or record.host_name in self.hosts
+        return not self.servicegroups.isdisjoint(
+            self.index.servicegroups.get(service_key(
+                record.host_name, record.service_description), ()))
+
+
+class IgnoreList:
+    '''
+    Drop the hosts and services that should never be reported
+
+    Each line of an ignore file is either an exact name, host or
+    host/service, or a regular expression prefixed by re: searched in the
+    name.  The names of an ignored host also match its services.  Exact
+    names are kept in a set and every expression is combined into a
+    single alternation, so each record is tested once whatever the
+    number of patterns.
+
+    :param names: exact names
+    :param patterns: compiled regular expressions
+    '''
+    def __init__(
+        self,
+        names: Iterable[str] = (),
+        patterns: Iterable['re.Pattern[str]'] = (),
+    ):
+        self.names = frozenset(names)
+        self.search = combine_patterns(list(patterns))
+
+    @classmethod
+    def read(cls, filenames: Sequence[str]) -> 'IgnoreList':
+        names: List[str] = []
+        patterns: List['re.Pattern[str]'] = []
+        for filename in filenames:
+            with open(filename) as fp:
+                for number, line in enumerate(fp, 1):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    if line.startswith('re:'):
+                        patterns.append(compile_pattern(
+                            line[3:], f'{filename}:{number}'))
+                    else:
+                        names.append(line)
+        return cls(names, patterns)
+
+    def __call__(self, record: Record) -> bool:
+        if record.host_name in self.names or record.name in self.names:
+            return False
+        return self.search is None or not self.search(record.name)
+
+
+# ignore lists already compiled by this process; unlike the objects
+# index they are not saved in state_dir, a compiled expression can not be
+# saved (pickle compiles it again) and reading the ignore files costs less
+# than that compilation
+_ignore_lists: FileCache[IgnoreList] = FileCache()
+
+
+def load_ignore_list(filenames: Sequence[str]) -> IgnoreList:
+    '''
+    Compile the ignore files, reused while none of the files changes
+    '''
+    def load() -> IgnoreList:
+        ignore_list = IgnoreList.read(filenames)
+        logging.info(
+            f'Compiled {len(ignore_list.names)} names to ignore from '
+            f'{", ".join(filenames)}')
+        return ignore_list
+
+    return _ignore_lists.get(filenames, load)
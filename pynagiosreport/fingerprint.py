@@ -0,0 +1,118 @@
+'''
+..  codeauthor:: Charles Blais
+
+Skip the notifications of a critical set already notified
+
+The fingerprint of the reported objects is the sum of a hash of each
+(host, service, state) tuple, so it does not depend on the order of the
+source and is computed while streaming through the records.  The
+acknowledged objects are not reported, an acknowledgement changes the
+set.  The fingerprint last notified to each sink is kept between runs;
+the same set is only notified again by the reminder schedule or once
+the re-notify interval elapsed.  Once nothing is reported, the sinks
+forget the set notified, so a problem coming back is notified at once.
+'''
+import hashlib
+
+import logging
+
+from pathlib import Path
+
+from typing import Dict, Optional, Sequence
+
+from pydantic import BaseModel
+
+from .nagios.record import Record
+
+from .storage import write_atomic
+
+
+MASK = 2 ** 64 - 1
+
+
+class Fingerprint:
+    '''
+    Order-independent hash of the records, a filter accepting every
+    record; put last, it sees the records reported
+    '''
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+
+    def add(self, record: Record) -> bool:
+        digest = hashlib.blake2b(
+            f'{record.host_name}\0{record.service_description}\0'
+            f'{record.current_state}'.encode(),
+            digest_size=8).digest()
+        self.total = (self.total + int.from_bytes(digest, 'big')) & MASK
+        self.count += 1
+        return True
+
+    @property
+    def value(self) -> str:
+        return f'{self.count}:{self.total:016x}'
+
+
+class Notified(BaseModel):
+    fingerprint: str
+    # epoch the set was first notified
+    first_sent: float
+    # epoch of the last notification
+    last_sent: float
+
+
+class NotifiedState(BaseModel):
+    '''
+    Fingerprint last notified to each sink
+    '''
+    sinks: Dict[str, Notified] = {}
+
+    @classmethod
+    def load(cls, filename: Path) -> 'NotifiedState':
+        if not filename.exists():
+            return cls()
+        try:
+            return cls.parse_file(filename)
+        except ValueError as err:
+            logging.warning(f'Ignoring invalid state {filename}: {err}')
+            return cls()
+
+    def save(self, filename: Path) -> None:
+        write_atomic(filename, self.json())
+
+    def next_notification(
+        self,
+        sink: str,
+        fingerprint: str,
+        renotify_interval: float,
+        reminders: Sequence[float] = (),
+    ) -> Optional[float]:
+        '''
+        Epoch the set can be notified again to a sink, None if it changed
+
+        :param renotify_interval: seconds between the notifications of
+            the same set after the reminders
+        :param reminders: seconds after the first notification of the set
+            it is notified again
+        '''
+        notified = self.sinks.get(sink)
+        if notified is None or notified.fingerprint != fingerprint:
+            return None
+        for reminder in sorted(reminders):
+            if notified.first_sent + reminder > notified.last_sent:
+                return notified.first_sent + reminder
+        return notified.last_sent + renotify_interval
+
+    def forget(self, sink: str) -> None:
+        '''
+        The next set is notified to the sink, even the one last notified
+        '''
+        self.sinks.pop(sink, None)
+
+    def sent(self, sink: str, fingerprint: str, now: float) -> None:
+        notified = self.sinks.get(sink)
+        if notified is None or notified.fingerprint != fingerprint:
+            self.sinks[sink] = Notified(
+                fingerprint=fingerprint, first_sent=now, last_sent=now)
+        else:
+            notified.last_sent = now
@@ -0,0 +1,129 @@
+'''
+..  codeauthor:: Charles Blais
+
+Streaming output of the critical records
+
+Each record is written as soon as it comes out of the source, nothing is
+accumulated, so the memory used does not depend on the number of
+critical objects.
+'''
+import csv
+
+import html
+
+import json
+
+from abc import ABC, abstractmethod
+
+from enum import Enum
+
+from typing import Dict, Iterable, TextIO, Type
+
+from .nagios.record import Record
+
+
+class OutputFormat(Enum):
+    json = 'json'
+    ndjson = 'ndjson'
+    csv = 'csv'
+    html = 'html'
+
+
+class RecordWriter(ABC):
+    '''
+    Write records to a stream
+
+    :param fp: output stream
+    '''
+    def __init__(self, fp: TextIO):
+        self.fp = fp
+        self.count = 0
+
+    def begin(self) -> None:
+        pass
+
+    @abstractmethod
+    def write(self, record: Record) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def write_all(self, records: Iterable[Record]) -> int:
+        '''
+        Write every record between the header and footer of the format
+
+        :returns: number of records written
+        '''
+        self.begin()
+        for record in records:
+            self.write(record)
+            self.count += 1
+        self.end()
+        self.fp.flush()
+        return self.count
+
+
+class NDJSONWriter(RecordWriter):
+    def write(self, record: Record) -> None:
+        self.fp.write(json.dumps(record._asdict()))
+        self.fp.write('\n')
+
+
+class JSONWriter(RecordWriter):
+    def begin(self) -> None:
+        self.fp.write('[')
+
+    def write(self, record: Record) -> None:
+        self.fp.write(',\n' if self.count else '\n')
+        self.fp.write(json.dumps(record._asdict()))
+
+    def end(self) -> None:
+        self.fp.write('\n]\n')
+
+
+class CSVWriter(RecordWriter):
+    def begin(self) -> None:
+        self.writer = csv.writer(self.fp)
+        self.writer.writerow(Record._fields)
+
+    def write(self, record: Record) -> None:
+        self.writer.writerow(record)
+
+
+class HTMLWriter(RecordWriter):
+    def begin(self) -> None:
+        self.fp.write('<table border="1">\n<tr>')
+        for field in Record._fields:
+            self.fp.write(f'<th>{field}</th>')
+        self.fp.write('</tr>\n')
+
+    def write(self, record: Record) -> None:
+        self.fp.write('<tr>')
+        for value in record:
+            self.fp.write(f'<td>{html.escape(str(value))}</td>')
+        self.fp.write('</tr>\n')
+
+    def end(self) -> None:
+        self.fp.write('</table>\n')
+
+
+WRITERS: Dict[OutputFormat, Type[RecordWriter]] = {
+    OutputFormat.json: JSONWriter,
+    OutputFormat.ndjson: NDJSONWriter,
+    OutputFormat.csv: CSVWriter,
+    OutputFormat.html: HTMLWriter,
+}
+
+
+def write_records(
+    records: Iterable[Record],
+    output_format: OutputFormat,
+    fp: TextIO,
+) -> int:
+    '''
+    Write the records in a format
+
+    :returns: number of records written
+    '''
+    return WRITERS[output_format](fp).write_all(records)
@@ -0,0 +1,65 @@
+'''
+..  codeauthor:: Charles Blais
+
+Group identical failures to compress alert storms
+
+During network partitions, thousands of objects fail with the same check
+and almost the same output.  While counting the critical objects, the
+sources also count them by a normalized key so that, above a threshold,
+the report shows one line per group instead of one line per object.
+'''
+import re
+
+from enum import Enum
+
+from typing import List
+
+from pydantic import BaseModel
+
+
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)*')
+
+
+class GroupBy(Enum):
+    host = 'host'
+    check_command = 'check_command'
+    # output with the numbers masked
+    output = 'output'
+
+
+class CriticalGroup(BaseModel):
+    key: str
+    count: int = 0
+    # first object of the group, as host or host/service
+    example: str = ''
+
+
+def normalize_output(output: str) -> str:
+    '''
+    Mask the numbers (times, sizes, addresses...) of a plugin output
+    '''
+    return NUMBER_PATTERN.sub('#', output.strip())
+
+
+def get_group_key(
+    group_by: GroupBy,
+    host_name: str,
+    check_command: str,
+    output: str,
+) -> str:
+    '''
+    Normalized key of the group an object belongs to
+    '''
+    if group_by == GroupBy.host:
+        return host_name
+    if group_by == GroupBy.check_command:
+        # arguments are separated by !
+        return check_command.split('!', 1)[0]
+    return normalize_output(output)
+
+
+def sort_groups(groups: List[CriticalGroup]) -> List[CriticalGroup]:
+    '''
+    Largest groups first
+    '''
+    return sorted(groups, key=lambda group: (-group.count, group.key))
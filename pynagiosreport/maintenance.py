@@ -0,0 +1,121 @@
+'''
+..  codeauthor:: Charles Blais
+
+Calendar of maintenance windows kept outside of Nagios
+
+The calendar is a JSON list of windows::
+
+    [
+        {"host_name": "db1", "start": "2022-04-15T08:00:00-04:00",
+         "end": "2022-04-15T12:00:00-04:00", "comment": "upgrade"},
+        {"hostgroup_name": "routers", "start": ..., "end": ...}
+    ]
+
+The windows of each host and hostgroup are merged into sorted disjoint
+intervals, so whether a time falls in a window is found by bisection in
+O(log n).
+'''
+import bisect
+
+import datetime
+
+import logging
+
+from pathlib import Path
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel, parse_file_as, root_validator
+
+from .storage import FileCache
+
+
+class MaintenanceWindow(BaseModel):
+    host_name: Optional[str] = None
+    hostgroup_name: Optional[str] = None
+    start: datetime.datetime
+    end: datetime.datetime
+    comment: str = ''
+
+    @root_validator(skip_on_failure=True)
+    def check_target(cls, values):
+        if not values.get('host_name') and not values.get('hostgroup_name'):
+            raise ValueError('host_name or hostgroup_name is required')
+        if values['end'] <= values['start']:
+            raise ValueError('end must be after start')
+        return values
+
+
+class Intervals:
+    '''
+    Sorted disjoint intervals, overlapping windows are merged
+    '''
+    def __init__(self, intervals: Iterable[Tuple[float, float]]):
+        self.starts: List[float] = []
+        self.ends: List[float] = []
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, when: float) -> bool:
+        position = bisect.bisect_right(self.starts, when) - 1
+        return position >= 0 and when < self.ends[position]
+
+
+class MaintenanceCalendar:
+    '''
+    Maintenance windows indexed by host and hostgroup
+    '''
+    def __init__(self, windows: Iterable[MaintenanceWindow]):
+        hosts: Dict[str, List[Tuple[float, float]]] = {}
+        hostgroups: Dict[str, List[Tuple[float, float]]] = {}
+        for window in windows:
+            interval = (window.start.timestamp(), window.end.timestamp())
+            if window.host_name:
+                hosts.setdefault(window.host_name, []).append(interval)
+            if window.hostgroup_name:
+                hostgroups.setdefault(
+                    window.hostgroup_name, []).append(interval)
+        self.hosts = {
+            name: Intervals(intervals) for name, intervals in hosts.items()}
+        self.hostgroups = {
+            name: Intervals(intervals)
+            for name, intervals in hostgroups.items()}
+
+    def is_active(
+        self,
+        when: float,
+        host_name: str,
+        hostgroups: Iterable[str] = (),
+    ) -> bool:
+        '''
+        Check if the host is in a maintenance window at a time
+
+        :param when: epoch
+        :param hostgroups: hostgroups of the host
+        '''
+        intervals = self.hosts.get(host_name)
+        if intervals is not None and when in intervals:
+            return True
+        return any(
+            when in self.hostgroups[name]
+            for name in hostgroups if name in self.hostgroups)
+
+
+# calendars already loaded by this process
+_calendars: FileCache[MaintenanceCalendar] = FileCache()
+
+
+def load_calendar(filename: Path) -> MaintenanceCalendar:
+    '''
+    Load the calendar, reused while the file does not change
+    '''
+    def load() -> MaintenanceCalendar:
+        windows = parse_file_as(List[MaintenanceWindow], filename)
+        logging.info(f'Loaded {len(windows)} maintenance windows')
+        return MaintenanceCalendar(windows)
+
+    return _calendars.get([filename], load)
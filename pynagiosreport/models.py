@@ -1,10 +1,16 @@
 '''
 ..  codeauthor:: Charles Blais
 '''
+from typing import Dict, List, Optional, Union
+
 from pydantic import BaseModel
 
 import datetime
 
+from .grouping import CriticalGroup, GroupBy, get_group_key, sort_groups
+
+from .nagios.record import Record
+
 
 class HostStatus(BaseModel):
     acknowledgement_type: int
@@ -261,3 +267,51 @@ class ServiceStatusCore(BaseModel):
     @property
     def status_update_time(self) -> datetime.datetime:
         return self.last_update
+
+
+# Any status object produced by either the API or the status.dat backend
+StatusObject = Union[
+    HostStatus, HostStatusCore, ServiceStatus, ServiceStatusCore]
+
+
+class CriticalCounts(BaseModel):
+    '''
+    Count of the critical objects found by a source, including those
+    past the report limit that were not converted to a status object
+
+    When group_by is set, the objects are also counted by group.
+    '''
+    total: int = 0
+    by_state: Dict[int, int] = {}
+    by_host: Dict[str, int] = {}
+    group_by: Optional[GroupBy] = None
+    by_group: Dict[str, CriticalGroup] = {}
+    # services of critical hosts folded into their host line
+    services_by_host: Dict[str, int] = {}
+    # objects behind an upstream problem already reported, by upstream
+    suppressed: Dict[str, int] = {}
+
+    def add(self, record: Record) -> None:
+        self.total += 1
+        state = record.current_state
+        self.by_state[state] = self.by_state.get(state, 0) + 1
+        self.by_host[record.host_name] = (
+            self.by_host.get(record.host_name, 0) + 1)
+        if self.group_by is None:
+            return
+        key = get_group_key(
+            self.group_by, record.host_name, record.check_command,
+            record.output)
+        group = self.by_group.get(key)
+        if group is None:
+            group = self.by_group[key] = CriticalGroup(
+                key=key, example=record.name)
+        group.count += 1
+
+    def get_groups(self, threshold: int) -> List[CriticalGroup]:
+        '''
+        Groups to report instead of the objects, none under the threshold
+        '''
+        if self.group_by is None or self.total <= threshold:
+            return []
+        return sort_groups(list(self.by_group.values()))
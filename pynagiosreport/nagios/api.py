@@ -4,17 +4,39 @@
 
 import logging
 
-from typing import Dict, List
+from typing import \
+    Dict, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar, Union
 
 import json
 
+import datetime
+
+import time
+
+from pathlib import Path
+
 import requests
 
+from pydantic import BaseModel
+
 from pydantic.error_wrappers import ValidationError
 
 from pynagiosreport.exceptions import NagiosAPIException
 
-from pynagiosreport.models import HostStatus, ServiceStatus
+from pynagiosreport.models import CriticalCounts, HostStatus, ServiceStatus
+
+from pynagiosreport.storage import write_atomic
+
+from .expression import Expression
+
+from .objects import ObjectsIndex
+
+from .record import Record, RecordFilter
+
+from .selection import ReportOrder, select_reported
+
+
+Model = TypeVar('Model', bound=BaseModel)
 
 
 class NagiosAPI(object):
@@ -28,6 +50,9 @@ class NagiosAPI(object):
     ):
         self.url = url[:-1] if url.endswith("/") else url
         self.apikey = apikey
+        self._group_index: Optional[ObjectsIndex] = None
+        # connections are kept alive between the queries
+        self.session = requests.Session()
 
     def query(
         self,
@@ -41,64 +66,183 @@ class NagiosAPI(object):
         :param prop: type of object to query
         """
         params.update({'apikey': self.apikey})
-        response = requests.get(f'{self.url}/objects/{prop}', params=params)
+        response = self.session.get(
+            f'{self.url}/objects/{prop}', params=params)
         return response.json()
 
-    def get_critical_hosts(
+    @staticmethod
+    def _as_list(value: Union[Dict, List[Dict], None]) -> List[Dict]:
+        """
+        Single members are returned as an object instead of a list
+        """
+        if value is None:
+            return []
+        return value if isinstance(value, list) else [value]
+
+    def get_group_index(
         self,
-        unchecked: bool = True,
-    ) -> List[HostStatus]:
+        cache_file: Optional[Path] = None,
+        ttl: float = 3600,
+    ) -> ObjectsIndex:
         """
-        Get all hosts that are critical (include unknown)
+        Index of the hostgroups and servicegroups of each member
 
-        :param bool unchecked: get those that have not been silenced
-            acknowledged, or scheduled a downtime
+        Memberships rarely change, the index is saved with its creation
+        time and only queried again once older than ttl.
+
+        :param cache_file: where the index is saved between runs
+        :param ttl: seconds the index is used before querying it again
         """
-        params = {
-            "current_state": "in:1,2"
-        }
-        if unchecked:
-            params.update({
-                "problem_acknowledged": "0",
-                "notifications_enabled": "1",
-                "scheduled_downtime_depth": "0"
-            })
+        index = self._group_index
+        if index is None and cache_file is not None and cache_file.exists():
+            try:
+                index = ObjectsIndex.parse_file(cache_file)
+            except ValueError as err:
+                logging.warning(f'Ignoring invalid index {cache_file}: {err}')
+        if index is not None and time.time() - index.created < ttl:
+            self._group_index = index
+            return index
+
+        index = ObjectsIndex(created=time.time())
+        response = self.query({}, prop='hostgroupmembers')
+        for group in NagiosAPI._as_list(response.get('hostgroup')):
+            members = group.get('members') or {}
+            for host in NagiosAPI._as_list(members.get('host')):
+                index.add_hostgroup(
+                    host['host_name'], group['hostgroup_name'])
+        response = self.query({}, prop='servicegroupmembers')
+        for group in NagiosAPI._as_list(response.get('servicegroup')):
+            members = group.get('members') or {}
+            for service in NagiosAPI._as_list(members.get('service')):
+                index.add_servicegroup(
+                    service['host_name'], service['service_description'],
+                    group['servicegroup_name'])
+        logging.info(
+            f'Indexed {len(index.hostgroups)} hosts and '
+            f'{len(index.servicegroups)} services in groups')
+
+        if cache_file is not None:
+            write_atomic(cache_file, index.json())
+        self._group_index = index
+        return index
 
-        response = self.query(params, prop='hoststatus')
+    @staticmethod
+    def to_record(obj: Dict) -> Record:
+        """
+        Normalized view of the raw object
+        """
+        try:
+            since = int(datetime.datetime.fromisoformat(
+                str(obj.get('last_state_change', ''))).timestamp())
+        except ValueError:
+            since = 0
+        return Record(
+            host_name=str(obj.get('host_name', '')),
+            service_description=str(obj.get('service_description', '')),
+            current_state=int(obj.get('current_state', 0)),
+            last_state_change=since,
+            check_command=str(obj.get('check_command', '')),
+            output=str(obj.get('output', '')),
+            acknowledged=int(obj.get('problem_has_been_acknowledged', 0)) != 0,
+            downtime=int(obj.get('scheduled_downtime_depth', 0)) != 0,
+            notifications_enabled=(
+                int(obj.get('notifications_enabled', 1)) != 0),
+        )
+
+    def _iter_reported(
+        self,
+        prop: str,
+        params: Dict[str, str],
+    ) -> Iterator[Tuple[Record, Dict]]:
+        """
+        Query the critical objects and iterate over the record and raw
+        content of those that should alert
+        """
+        response = self.query(params, prop=prop)
         if 'error' in response:
             raise NagiosAPIException(json.dumps(response))
         if int(response.get('recordcount', 0)) == 0:
             logging.info(f'No data found in query {json.dumps(params)}')
-            return []
+            return
 
-        # convert the object and return only those that should alert
-        hosts: List[HostStatus] = []
-        for h in response.get('hoststatus', []):
-            try:
-                hoststatus = HostStatus(**h)
-            except ValidationError as err:
-                logging.error(f'Error converting:\n{err}\nDetailed:\n{h}')
-                raise err
+        for h in response.get(prop, []):
             if (
-                hoststatus.current_check_attempt
-                == hoststatus.max_check_attempts
+                int(h.get('current_check_attempt', 0))
+                != int(h.get('max_check_attempts', 0))
             ):
-                hosts.append(hoststatus)
-        logging.info(f'Found {len(hosts)} critical hosts')
-        return hosts
+                continue
+            yield NagiosAPI.to_record(h), h
 
-    def get_critical_services(
+    def _get_critical(
+        self,
+        prop: str,
+        model: Type[Model],
+        params: Dict[str, str],
+        limit: Optional[int],
+        counts: Optional[CriticalCounts],
+        order: ReportOrder,
+        filters: Sequence[RecordFilter],
+    ) -> List[Model]:
+        """
+        Query the critical objects, only those within the limit are
+        converted
+        """
+        # let the server apply what it can of the filter expressions
+        for accept in filters:
+            if isinstance(accept, Expression):
+                params = accept.get_params(prop, params)
+
+        objects = [
+            NagiosAPI._parse(model, h)
+            for h in select_reported(
+                self._iter_reported(prop, params), filters, counts, order,
+                limit)]
+        logging.info(f'Converted {len(objects)} critical {prop}')
+        return objects
+
+    @staticmethod
+    def _parse(model: Type[Model], obj: Dict) -> Model:
+        try:
+            return model.parse_obj(obj)
+        except ValidationError as err:
+            logging.error(f'Error converting:\n{err}\nDetailed:\n{obj}')
+            raise err
+
+    def iter_reported(
         self,
+        prop: str,
         unchecked: bool = True,
-    ) -> List[ServiceStatus]:
+    ) -> Iterator[Tuple[Record, Dict]]:
         """
-        Get all services that are critical
+        Query the critical objects and iterate over the record and raw
+        content of each, none is converted
 
+        :param prop: hoststatus or servicestatus
         :param bool unchecked: get those that have not been silenced
             acknowledged, or scheduled a downtime
         """
+        return self._iter_reported(prop, NagiosAPI._get_params(
+            '1,2' if prop == 'hoststatus' else '2,3', unchecked))
+
+    def convert(
+        self,
+        prop: str,
+        item: Dict,
+    ) -> Union[HostStatus, ServiceStatus]:
+        """
+        Convert the raw content of a critical object of iter_reported
+        """
+        if prop == 'hoststatus':
+            return NagiosAPI._parse(HostStatus, item)
+        return NagiosAPI._parse(ServiceStatus, item)
+
+    @staticmethod
+    def _get_params(states: str, unchecked: bool) -> Dict[str, str]:
+        """
+        Query parameters of the critical objects
+        """
         params = {
-            "current_state": "in:2,3"
+            "current_state": f"in:{states}"
         }
         if unchecked:
             params.update({
@@ -106,26 +250,78 @@ class NagiosAPI(object):
                 "notifications_enabled": "1",
                 "scheduled_downtime_depth": "0"
             })
+        return params
 
-        response = self.query(params, prop='servicestatus')
-        if 'error' in response:
-            raise NagiosAPIException(json.dumps(response))
-        if int(response.get('recordcount', 0)) == 0:
-            logging.info(f'No data found in query {json.dumps(params)}')
-            return []
+    def iter_host_records(self, unchecked: bool = True) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical hosts, none is converted
 
-        # convert the object and return only those that should alert
-        services: List[ServiceStatus] = []
-        for h in response.get('servicestatus', []):
-            try:
-                servicestatus = ServiceStatus(**h)
-            except ValidationError as err:
-                logging.error(f'Error converting:\n{err}\nDetailed:\n{h}')
-                raise err
-            if (
-                servicestatus.current_check_attempt
-                == servicestatus.max_check_attempts
-            ):
-                services.append(servicestatus)
-        logging.info(f'Found {len(services)} critical services')
-        return services
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        for record, _ in self._iter_reported(
+                'hoststatus', NagiosAPI._get_params('1,2', unchecked)):
+            yield record
+
+    def iter_service_records(
+        self,
+        unchecked: bool = True,
+    ) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical services, none is
+        converted
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        for record, _ in self._iter_reported(
+                'servicestatus', NagiosAPI._get_params('2,3', unchecked)):
+            yield record
+
+    def get_critical_hosts(
+        self,
+        unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
+    ) -> List[HostStatus]:
+        """
+        Get all hosts that are critical (include unknown)
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        :param limit: maximum number of hosts returned, the first ones in
+            the report order; the others are only counted
+        :param counts: filled with the count of all critical hosts
+        :param order: report order
+        :param filters: only hosts accepted by every filter are returned
+        """
+        return self._get_critical(
+            'hoststatus', HostStatus, NagiosAPI._get_params('1,2', unchecked),
+            limit, counts, order, filters)
+
+    def get_critical_services(
+        self,
+        unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
+    ) -> List[ServiceStatus]:
+        """
+        Get all services that are critical
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        :param limit: maximum number of services returned, the first ones
+            in the report order; the others are only counted
+        :param counts: filled with the count of all critical services
+        :param order: report order
+        :param filters: only services accepted by every filter are
+            returned
+        """
+        return self._get_critical(
+            'servicestatus', ServiceStatus,
+            NagiosAPI._get_params('2,3', unchecked), limit, counts, order,
+            filters)
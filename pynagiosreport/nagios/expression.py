@@ -0,0 +1,335 @@
+'''
+..  codeauthor:: Charles Blais
+
+Filter expressions on the critical records
+
+An expression compares the fields of :class:`Record`, for example::
+
+    host_name ~ '^db' and current_state == 2 and last_state_change < now-15m
+
+- comparisons: ==, !=, <, <=, >, >=, ~ (regex search), !~
+- combined with and, or, not and parentheses
+- values: 'strings', numbers, true/false and now with an optional offset
+  in seconds, minutes, hours, days or weeks (now-15m)
+
+The expression is parsed once into nested predicates.  The clauses of
+the top level conjunction are also translated into Nagios XI API query
+parameters when possible so the server filters the objects first.
+'''
+import datetime
+
+import operator
+
+import re
+
+import time
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pynagiosreport.exceptions import FilterSyntaxError
+
+from .record import Record
+
+
+TOKEN_PATTERN = re.compile(r'''\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<now>now(?:\s*[-+]\s*\d+[smhdw]?)?)\b
+    |(?P<number>-?\d+)
+    |(?P<op>==|!=|<=|>=|!~|~|<|>|\(|\))
+    |(?P<word>\w+)
+)''', re.VERBOSE)
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+FIELD_TYPES = {
+    'host_name': str,
+    'service_description': str,
+    'check_command': str,
+    'output': str,
+    'current_state': int,
+    'last_state_change': int,
+    'acknowledged': bool,
+    'downtime': bool,
+}
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# XI API operators of the comparisons
+API_OPERATORS = {
+    '!=': 'ne:',
+    '<': 'lt:',
+    '<=': 'lte:',
+    '>': 'gt:',
+    '>=': 'gte:',
+}
+
+# XI API parameters of the fields, when different
+API_FIELDS = {
+    'acknowledged': 'problem_acknowledged',
+    'downtime': 'scheduled_downtime_depth',
+}
+
+# fields with a column in the XI API objects
+API_COLUMNS = {
+    'hoststatus': tuple(
+        field for field in FIELD_TYPES if field != 'service_description'),
+    'servicestatus': tuple(FIELD_TYPES),
+}
+
+Predicate = Callable[[Record], bool]
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+
+
+class Clause(NamedTuple):
+    field: str
+    op: str
+    # offset from now for the now values
+    value: Any
+    relative: bool = False
+
+    def get_value(self) -> Any:
+        if self.relative:
+            return int(time.time()) + self.value
+        return self.value
+
+
+def tokenize(text: str) -> List[Token]:
+    '''
+    Split the expression into tokens
+    '''
+    tokens: List[Token] = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            raise FilterSyntaxError(
+                f'Unexpected character at {position}: {text[position:]}')
+        kind = match.lastgroup
+        assert kind is not None
+        tokens.append(Token(kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def parse_now(text: str) -> int:
+    '''
+    Offset in seconds of a now value
+    '''
+    offset = text[3:].replace(' ', '')
+    if not offset:
+        return 0
+    sign = -1 if offset[0] == '-' else 1
+    unit = offset[-1] if offset[-1] in DURATION_UNITS else 's'
+    amount = int(offset[1:].rstrip(''.join(DURATION_UNITS)))
+    return sign * amount * DURATION_UNITS[unit]
+
+
+class Parser:
+    '''
+    Recursive descent parser of the expression into predicates
+    '''
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+        # clauses of the top level conjunction
+        self.clauses: List[Clause] = []
+
+    def peek(self) -> Optional[Token]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self) -> Token:
+        token = self.peek()
+        if token is None:
+            raise FilterSyntaxError(f'Unexpected end of {self.text}')
+        self.position += 1
+        return token
+
+    def is_keyword(self, keyword: str) -> bool:
+        token = self.peek()
+        return token is not None and token == Token('word', keyword)
+
+    def parse(self) -> Predicate:
+        predicate, clauses = self.parse_or()
+        token = self.peek()
+        if token is not None:
+            raise FilterSyntaxError(f'Unexpected {token.value} in {self.text}')
+        self.clauses = clauses
+        return predicate
+
+    def parse_or(self) -> Tuple[Predicate, List[Clause]]:
+        predicate, clauses = self.parse_and()
+        predicates = [predicate]
+        while self.is_keyword('or'):
+            self.next()
+            predicates.append(self.parse_and()[0])
+        if len(predicates) == 1:
+            return predicate, clauses
+        return (lambda r: any(p(r) for p in predicates)), []
+
+    def parse_and(self) -> Tuple[Predicate, List[Clause]]:
+        predicate, clauses = self.parse_not()
+        predicates = [predicate]
+        while self.is_keyword('and'):
+            self.next()
+            predicate, more = self.parse_not()
+            predicates.append(predicate)
+            clauses = clauses + more
+        if len(predicates) == 1:
+            return predicate, clauses
+        return (lambda r: all(p(r) for p in predicates)), clauses
+
+    def parse_not(self) -> Tuple[Predicate, List[Clause]]:
+        if self.is_keyword('not'):
+            self.next()
+            predicate = self.parse_not()[0]
+            return (lambda r: not predicate(r)), []
+        if self.peek() == Token('op', '('):
+            self.next()
+            predicate, clauses = self.parse_or()
+            if self.next() != Token('op', ')'):
+                raise FilterSyntaxError(f'Missing ) in {self.text}')
+            return predicate, clauses
+        return self.parse_comparison()
+
+    def parse_value(self, field: str) -> Tuple[Any, bool]:
+        token = self.next()
+        field_type = FIELD_TYPES[field]
+        if field_type is str and token.kind == 'string':
+            return re.sub(r'\\(.)', r'\1', token.value[1:-1]), False
+        if field_type is int and token.kind == 'number':
+            return int(token.value), False
+        if field_type is int and token.kind == 'now':
+            return parse_now(token.value), True
+        if field_type is bool and token.value in ('true', 'false'):
+            return token.value == 'true', False
+        raise FilterSyntaxError(
+            f'Invalid value {token.value} for {field} in {self.text}')
+
+    def parse_comparison(self) -> Tuple[Predicate, List[Clause]]:
+        token = self.next()
+        if token.kind != 'word' or token.value not in FIELD_TYPES:
+            raise FilterSyntaxError(
+                f'Unknown field {token.value} in {self.text}, expected one '
+                f'of {", ".join(FIELD_TYPES)}')
+        field = token.value
+        index = Record._fields.index(field)
+        op = self.next()
+        if op.kind != 'op' or op.value in '()':
+            raise FilterSyntaxError(
+                f'Expected comparison after {field} in {self.text}')
+        value, relative = self.parse_value(field)
+        clause = Clause(field, op.value, value, relative)
+
+        if op.value in ('~', '!~'):
+            if FIELD_TYPES[field] is not str:
+                raise FilterSyntaxError(f'{field} is not a string')
+            try:
+                search = re.compile(value).search
+            except re.error as err:
+                raise FilterSyntaxError(f'Invalid regex {value}: {err}')
+            if op.value == '~':
+                return (lambda r: search(r[index]) is not None), [clause]
+            return (lambda r: search(r[index]) is None), [clause]
+
+        compare = OPERATORS[op.value]
+        if relative:
+            return (lambda r: compare(r[index], clause.get_value())), [clause]
+        return (lambda r: compare(r[index], value)), [clause]
+
+
+def get_param(clause: Clause, current: Optional[str]) -> Optional[str]:
+    '''
+    XI API parameter value equivalent to the clause, None if it can not
+    be translated
+
+    :param current: value already set for the parameter
+    '''
+    value = clause.get_value()
+    if clause.field == 'current_state':
+        # narrow the list of the critical states queried
+        if current is None or not current.startswith('in:'):
+            return None
+        states = [
+            state for state in current[3:].split(',')
+            if OPERATORS.get(clause.op, operator.eq)(int(state), value)]
+        return f'in:{",".join(states)}' if states else None
+    if current is not None:
+        return None
+    if clause.field == 'last_state_change':
+        if clause.op == '==':
+            return None
+        return API_OPERATORS[clause.op] + datetime.datetime.fromtimestamp(
+            value).strftime('%Y-%m-%d %H:%M:%S')
+    if clause.field == 'acknowledged':
+        if clause.op not in ('==', '!='):
+            return None
+        return '1' if value == (clause.op == '==') else '0'
+    if clause.field == 'downtime':
+        if clause.op not in ('==', '!='):
+            return None
+        return 'gt:0' if value == (clause.op == '==') else '0'
+    # strings
+    if clause.op == '==':
+        return value
+    if clause.op == '!=':
+        return f'ne:{value}'
+    if clause.op == '~':
+        # the literal part of a regex anchored at most at both ends
+        literal = value.lstrip('^').rstrip('$')
+        if literal and re.escape(literal) == literal:
+            return f'lk:{literal}'
+    return None
+
+
+class Expression:
+    '''
+    Filter of the records matching an expression
+
+    :param text: expression, see the module documentation
+    '''
+    def __init__(self, text: str):
+        self.text = text
+        parser = Parser(text)
+        self.predicate = parser.parse()
+        self.clauses = parser.clauses
+
+    def __call__(self, record: Record) -> bool:
+        return self.predicate(record)
+
+    def __repr__(self) -> str:
+        return f'Expression({self.text!r})'
+
+    def get_params(self, prop: str, params: Dict[str, str]) -> Dict[str, str]:
+        '''
+        Narrow XI API query parameters with the clauses of the top level
+        conjunction; the records are still filtered by the expression
+
+        :param prop: objects queried (hoststatus, servicestatus), only the
+            clauses on their columns are translated
+        :param params: query parameters of the critical objects
+        '''
+        params = dict(params)
+        columns = API_COLUMNS.get(prop, ())
+        for clause in self.clauses:
+            if clause.field not in columns:
+                continue
+            name = API_FIELDS.get(clause.field, clause.field)
+            value = get_param(clause, params.get(name))
+            if value is not None:
+                params[name] = value
+        return params
@@ -0,0 +1,544 @@
+'''
+..  codeauthor:: Charles Blais
+
+Maintain the critical hosts/services incrementally from nagios.log
+
+The state is bootstrapped once from status.dat, then the alert,
+acknowledgement and downtime lines appended to nagios.log are applied to
+the in-memory critical set so an update only costs the number of changes.
+
+Objects that become critical after the bootstrap are only known by their
+key in the log; their complete status is read from status.dat in a single
+batch the next time the critical objects are requested.
+'''
+import logging
+
+import datetime
+
+import re
+
+from pathlib import Path
+
+from typing import (
+    Dict, IO, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar,
+    Union)
+
+from pydantic import BaseModel
+
+from pynagiosreport.models import \
+    CriticalCounts, HostStatusCore, ServiceStatusCore, StatusObject
+
+from pynagiosreport.storage import write_atomic
+
+from .statusfile import StatusFile
+
+from .record import Record, RecordFilter
+
+from .selection import ReportOrder, select_reported
+
+
+Key = Tuple[str, str]
+
+Model = TypeVar('Model', HostStatusCore, ServiceStatusCore)
+
+HOST_STATES = {'UP': 0, 'DOWN': 1, 'UNREACHABLE': 2}
+SERVICE_STATES = {'OK': 0, 'WARNING': 1, 'CRITICAL': 2, 'UNKNOWN': 3}
+
+LINE_PATTERN = re.compile(r'^\[(\d+)\] ([A-Z ]+): (.*)$')
+
+# acknowledgement_type of status.dat
+ACK_NONE = 0
+ACK_NORMAL = 1
+ACK_STICKY = 2
+
+
+class LogCheckpoint(BaseModel):
+    inode: int
+    offset: int
+    # timestamp of the last line read before the offset
+    logged: Optional[int] = None
+
+
+class LogEvent(BaseModel):
+    '''
+    State change of an object read from the log
+    '''
+    timestamp: datetime.datetime
+    current_state: int
+    output: str = ''
+    # the object left the problem state in the log before the event: True
+    # if it recovered, False if it changed to a non-critical problem
+    recovered: Optional[bool] = None
+
+
+class CriticalState:
+    '''
+    Critical hosts/services maintained from status.dat and nagios.log
+
+    It offers the same interface as :class:`StatusFile` and can be used
+    in its place.
+
+    :param status_file: status.dat used to bootstrap the state
+    :param log_file: nagios.log to follow
+    :param checkpoint_file: where the position in the log is saved
+    '''
+    def __init__(
+        self,
+        status_file: str,
+        log_file: str,
+        checkpoint_file: Optional[Path] = None,
+    ):
+        self.status = StatusFile(status_file)
+        self.log_file = Path(log_file)
+        self.checkpoint_file = checkpoint_file
+
+        self.hosts: Dict[Key, HostStatusCore] = {}
+        self.services: Dict[Key, ServiceStatusCore] = {}
+        self.downtimes: Dict[Key, int] = {}
+        # critical objects only known from the log
+        self.pending: Dict[Key, LogEvent] = {}
+        # objects that left the problem state, True if they recovered
+        self.left: Dict[Key, bool] = {}
+
+        self.fp: Optional[IO[str]] = None
+        self.inode: Optional[int] = None
+        # timestamp of the last line read
+        self.logged: Optional[int] = None
+        self.bootstrap()
+
+    def bootstrap(self) -> None:
+        '''
+        Load the state from status.dat and position the log after it
+        '''
+        self.hosts.clear()
+        self.services.clear()
+        self.downtimes.clear()
+        self.pending.clear()
+        self.left.clear()
+
+        created = 0
+        for info in self.status.iter_blocks('info'):
+            created = int(info.get('created', 0))
+
+        for kind in ('hoststatus', 'servicestatus'):
+            for obj in self.status.iter_blocks(kind):
+                depth = int(obj.get('scheduled_downtime_depth', 0))
+                if depth:
+                    self.downtimes[(
+                        obj['host_name'], obj.get('service_description', '')
+                    )] = depth
+        for host in self.status.get_critical_hosts(unchecked=False):
+            self.hosts[(host.host_name, '')] = host
+        for service in self.status.get_critical_services(unchecked=False):
+            key = (service.host_name, service.service_description)
+            self.services[key] = service
+        logging.info(
+            f'Bootstrapped {len(self.hosts)} hosts and '
+            f'{len(self.services)} services from {self.status.filename}')
+
+        # replay what was logged after status.dat was written
+        self._open(self._load_checkpoint(created))
+        self.update(since=created)
+
+    def _load_checkpoint(self, created: int) -> int:
+        '''
+        Offset to resume from, 0 if unknown or the log was rotated
+
+        The lines before the checkpoint are only skipped if they were all
+        logged before status.dat was written, otherwise the state
+        bootstrapped from status.dat misses their changes.
+
+        :param created: timestamp status.dat was written
+        '''
+        if (
+            self.checkpoint_file is None or
+            not self.checkpoint_file.exists()
+        ):
+            return 0
+        try:
+            checkpoint = LogCheckpoint.parse_file(self.checkpoint_file)
+        except ValueError as err:
+            logging.warning(f'Ignoring invalid checkpoint: {err}')
+            return 0
+        stat = self.log_file.stat()
+        if (
+            checkpoint.inode != stat.st_ino or
+            checkpoint.offset > stat.st_size
+        ):
+            logging.info(f'{self.log_file} rotated since checkpoint')
+            return 0
+        if checkpoint.logged is None or checkpoint.logged > created:
+            logging.info(
+                f'{self.status.filename} older than checkpoint, replaying '
+                f'{self.log_file}')
+            return 0
+        self.logged = checkpoint.logged
+        return checkpoint.offset
+
+    def _save_checkpoint(self) -> None:
+        if self.checkpoint_file is None or self.fp is None:
+            return
+        assert self.inode is not None
+        checkpoint = LogCheckpoint(
+            inode=self.inode, offset=self.fp.tell(), logged=self.logged)
+        write_atomic(self.checkpoint_file, checkpoint.json())
+
+    def _open(self, offset: int = 0) -> None:
+        if self.fp is not None:
+            self.fp.close()
+        self.fp = open(self.log_file, errors='replace')
+        self.inode = Path(self.log_file).stat().st_ino
+        self.fp.seek(offset)
+
+    def _rotated(self) -> bool:
+        '''
+        Check if the log file was replaced or truncated
+        '''
+        assert self.fp is not None
+        try:
+            stat = self.log_file.stat()
+        except FileNotFoundError:
+            return False
+        return stat.st_ino != self.inode or stat.st_size < self.fp.tell()
+
+    def update(self, since: int = 0) -> int:
+        '''
+        Apply the lines appended to the log since the last update
+
+        :param since: ignore lines logged up to this timestamp
+        :returns: number of lines applied
+        '''
+        assert self.fp is not None
+        applied = self._read(since)
+        if self._rotated():
+            # finish the rotated file (already done above) then follow the
+            # new one from its start
+            logging.info(f'{self.log_file} rotated, reopening')
+            self._open()
+            applied += self._read(since)
+        self._save_checkpoint()
+        logging.debug(f'Applied {applied} lines from {self.log_file}')
+        return applied
+
+    def _read(self, since: int) -> int:
+        assert self.fp is not None
+        applied = 0
+        while True:
+            position = self.fp.tell()
+            line = self.fp.readline()
+            if not line:
+                break
+            if not line.endswith('\n'):
+                # incomplete line still being written
+                self.fp.seek(position)
+                break
+            match = LINE_PATTERN.match(line)
+            if match is None:
+                continue
+            self.logged = int(match.group(1))
+            if self.logged <= since:
+                continue
+            if self.apply(
+                    int(match.group(1)), match.group(2), match.group(3)):
+                applied += 1
+        return applied
+
+    def apply(self, timestamp: int, kind: str, content: str) -> bool:
+        '''
+        Apply a log line to the state
+
+        :returns: True if the line was relevant
+        '''
+        fields = content.split(';')
+        if kind == 'HOST ALERT' and len(fields) >= 4:
+            state = HOST_STATES.get(fields[1])
+            if state is None or fields[2] != 'HARD':
+                return False
+            self._alert(
+                (fields[0], ''), timestamp, state, state in (1, 2),
+                ';'.join(fields[4:]))
+        elif kind == 'SERVICE ALERT' and len(fields) >= 5:
+            state = SERVICE_STATES.get(fields[2])
+            if state is None or fields[3] != 'HARD':
+                return False
+            self._alert(
+                (fields[0], fields[1]), timestamp, state, state in (2, 3),
+                ';'.join(fields[5:]))
+        elif kind == 'EXTERNAL COMMAND':
+            return self._command(fields)
+        elif kind == 'HOST DOWNTIME ALERT' and len(fields) >= 2:
+            self._downtime((fields[0], ''), fields[1])
+        elif kind == 'SERVICE DOWNTIME ALERT' and len(fields) >= 3:
+            self._downtime((fields[0], fields[1]), fields[2])
+        else:
+            return False
+        return True
+
+    def _objects(
+        self,
+        key: Key,
+    ) -> Union[Dict[Key, HostStatusCore], Dict[Key, ServiceStatusCore]]:
+        return self.services if key[1] else self.hosts
+
+    def _alert(
+        self,
+        key: Key,
+        timestamp: int,
+        state: int,
+        critical: bool,
+        output: str,
+    ) -> None:
+        objects = self._objects(key)
+        if not critical:
+            objects.pop(key, None)
+            self.pending.pop(key, None)
+            self.left[key] = state == 0 or self.left.get(key, False)
+            return
+        event = LogEvent(
+            timestamp=datetime.datetime.fromtimestamp(
+                timestamp, datetime.timezone.utc),
+            current_state=state,
+            output=output)
+        obj = objects.get(key)
+        if obj is None:
+            event.recovered = self.left.pop(key, None)
+            self.pending[key] = event
+            return
+        objects[key] = self._overlay(obj, event)  # type: ignore
+
+    @staticmethod
+    def _overlay(
+        obj: Union[HostStatusCore, ServiceStatusCore],
+        event: LogEvent,
+    ) -> Union[HostStatusCore, ServiceStatusCore]:
+        update = {
+            'plugin_output': event.output,
+            'state_type': 1,
+            'current_attempt': obj.max_attempts,
+            'last_update': event.timestamp,
+        }
+        changed = obj.current_state != event.current_state
+        # status.dat written before the object left the problem state
+        stale = obj.last_update < event.timestamp
+        if event.recovered is not None and stale:
+            changed = True
+        if changed:
+            update['current_state'] = event.current_state
+            update['last_state_change'] = event.timestamp
+            update['last_hard_state_change'] = event.timestamp
+            # Nagios removes the acknowledgements on a state change, except
+            # the sticky ones which last until the object recovers
+            if (
+                obj.acknowledgement_type != ACK_STICKY or
+                (event.recovered and stale)
+            ):
+                update['problem_has_been_acknowledged'] = 0
+                update['acknowledgement_type'] = ACK_NONE
+        return obj.copy(update=update)
+
+    def _command(self, fields: List[str]) -> bool:
+        command = fields[0]
+        if command == 'ACKNOWLEDGE_HOST_PROBLEM' and len(fields) >= 2:
+            self._acknowledge((fields[1], ''), get_ack_type(fields[2:]))
+        elif command == 'ACKNOWLEDGE_SVC_PROBLEM' and len(fields) >= 3:
+            self._acknowledge((fields[1], fields[2]), get_ack_type(fields[3:]))
+        elif command == 'REMOVE_HOST_ACKNOWLEDGEMENT' and len(fields) >= 2:
+            self._acknowledge((fields[1], ''), ACK_NONE)
+        elif command == 'REMOVE_SVC_ACKNOWLEDGEMENT' and len(fields) >= 3:
+            self._acknowledge((fields[1], fields[2]), ACK_NONE)
+        else:
+            return False
+        return True
+
+    def _acknowledge(self, key: Key, ack_type: int) -> None:
+        objects = self._objects(key)
+        obj = objects.get(key)
+        if obj is not None:
+            objects[key] = obj.copy(update={  # type: ignore
+                'problem_has_been_acknowledged': int(ack_type != ACK_NONE),
+                'acknowledgement_type': ack_type})
+
+    def _downtime(self, key: Key, action: str) -> None:
+        depth = self.downtimes.get(key, 0)
+        if action == 'STARTED':
+            depth += 1
+        elif action in ('STOPPED', 'CANCELLED'):
+            depth = max(0, depth - 1)
+        else:
+            return
+        if depth:
+            self.downtimes[key] = depth
+        else:
+            self.downtimes.pop(key, None)
+
+        objects = self._objects(key)
+        obj = objects.get(key)
+        if obj is not None:
+            objects[key] = obj.copy(  # type: ignore
+                update={'scheduled_downtime_depth': depth})
+
+    def _resolve_pending(self) -> None:
+        '''
+        Read the complete status of objects only known from the log
+        '''
+        if not self.pending:
+            return
+        logging.info(f'Reading {len(self.pending)} new objects from status')
+        for kind in ('hoststatus', 'servicestatus'):
+            for raw in self.status.iter_blocks(kind):
+                key = (raw['host_name'], raw.get('service_description', ''))
+                event = self.pending.pop(key, None)
+                if event is None:
+                    continue
+                obj: Union[HostStatusCore, ServiceStatusCore] = (
+                    ServiceStatusCore.parse_obj(raw) if key[1]
+                    else HostStatusCore.parse_obj(raw))
+                obj = self._overlay(obj, event).copy(update={
+                    'scheduled_downtime_depth': self.downtimes.get(key, 0)})
+                self._objects(key)[key] = obj  # type: ignore
+                if not self.pending:
+                    return
+        for key in self.pending:
+            logging.warning(f'{key} not found in {self.status.filename}')
+        self.pending.clear()
+
+    @staticmethod
+    def to_record(obj: StatusObject) -> Record:
+        """
+        Normalized view of the object
+        """
+        return Record(
+            host_name=obj.host_name,
+            service_description=getattr(obj, 'service_description', ''),
+            current_state=obj.current_state,
+            last_state_change=int(obj.last_state_change.timestamp()),
+            check_command=obj.check_command,
+            output=obj.output,
+            acknowledged=bool(obj.problem_has_been_acknowledged),
+            downtime=bool(obj.scheduled_downtime_depth),
+            notifications_enabled=bool(obj.notifications_enabled),
+        )
+
+    @staticmethod
+    def _iter_reported(
+        objects: Iterable[Model],
+        unchecked: bool,
+    ) -> Iterator[Tuple[Record, Model]]:
+        for obj in objects:
+            if unchecked and not StatusFile.is_unchecked(obj):
+                continue
+            yield CriticalState.to_record(obj), obj
+
+    def iter_reported(
+        self,
+        kind: str,
+        unchecked: bool = True,
+    ) -> Iterator[Tuple[Record, StatusObject]]:
+        """
+        Iterate over the record and status of the critical objects of a
+        kind
+
+        :param kind: hoststatus or servicestatus
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        self._resolve_pending()
+        if kind == 'hoststatus':
+            return CriticalState._iter_reported(self.hosts.values(), unchecked)
+        return CriticalState._iter_reported(self.services.values(), unchecked)
+
+    @staticmethod
+    def convert(kind: str, item: StatusObject) -> StatusObject:
+        """
+        Status of a critical object of iter_reported, already converted
+        """
+        return item
+
+    def iter_host_records(self, unchecked: bool = True) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical hosts
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        self._resolve_pending()
+        for record, _ in CriticalState._iter_reported(
+                self.hosts.values(), unchecked):
+            yield record
+
+    def iter_service_records(
+        self,
+        unchecked: bool = True,
+    ) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical services
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        self._resolve_pending()
+        for record, _ in CriticalState._iter_reported(
+                self.services.values(), unchecked):
+            yield record
+
+    def get_critical_hosts(
+        self,
+        unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
+    ) -> List[HostStatusCore]:
+        """
+        Get all hosts that are critical (include unknown)
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        :param limit: maximum number of hosts returned, the first ones in
+            the report order
+        :param counts: filled with the count of all critical hosts
+        :param order: report order
+        :param filters: only hosts accepted by every filter are returned
+        """
+        self._resolve_pending()
+        return select_reported(
+            CriticalState._iter_reported(self.hosts.values(), unchecked),
+            filters, counts, order, limit)
+
+    def get_critical_services(
+        self,
+        unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
+    ) -> List[ServiceStatusCore]:
+        """
+        Get all service that are critical (include unknown)
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        :param limit: maximum number of services returned, the first ones
+            in the report order
+        :param counts: filled with the count of all critical services
+        :param order: report order
+        :param filters: only services accepted by every filter are
+            returned
+        """
+        self._resolve_pending()
+        return select_reported(
+            CriticalState._iter_reported(self.services.values(), unchecked),
+            filters, counts, order, limit)
+
+    def close(self) -> None:
+        if self.fp is not None:
+            self._save_checkpoint()
+            self.fp.close()
+            self.fp = None
+
+
+def get_ack_type(arguments: Sequence[str]) -> int:
+    '''
+    Acknowledgement type from the sticky argument of the command
+    '''
+    return ACK_STICKY if arguments and arguments[0] == '2' else ACK_NORMAL
@@ -0,0 +1,251 @@
+'''
+..  codeauthor:: Charles Blais
+
+Index of the object definitions written by Nagios in objects.cache
+
+objects.cache holds the resolved configuration (host parents, service
+dependencies, contacts, ...).  It only changes when Nagios reloads its
+configuration, so the indexes built from it are kept in memory and saved
+on disk along with the size and modification time of the file; they are
+only rebuilt when objects.cache changes.
+'''
+import logging
+
+import re
+
+from pathlib import Path
+
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from pynagiosreport.storage import FileCache, write_atomic
+
+
+DEFINE_PATTERN = re.compile(r'^\s*define\s+(\w+)\s*{')
+END_PATTERN = re.compile(r'^\s*}')
+ATTR_PATTERN = re.compile(r'^\s*(\w+)\s+(.*)$')
+
+# indexes saved by older versions are rebuilt
+INDEX_VERSION = 1
+
+
+def service_key(host_name: str, service_description: str) -> str:
+    '''
+    Key of a service in the index (JSON keys must be strings)
+    '''
+    return f'{host_name};{service_description}'
+
+
+def split_list(value: str) -> List[str]:
+    '''
+    Split a comma separated list of object names
+    '''
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def iter_definitions(filename: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+    '''
+    Iterate over the object definitions of objects.cache
+
+    :returns: type of object and its attributes
+    '''
+    with open(filename) as fp:
+        kind: Optional[str] = None
+        obj: Dict[str, str] = {}
+        for line in fp:
+            if line.startswith('#'):
+                continue
+            match_define = DEFINE_PATTERN.match(line)
+            if match_define:
+                kind = match_define.group(1)
+                obj = {}
+            elif kind is None:
+                continue
+            elif END_PATTERN.match(line):
+                yield kind, obj
+                kind = None
+            else:
+                match_attr = ATTR_PATTERN.match(line)
+                if match_attr:
+                    obj[match_attr.group(1)] = match_attr.group(2).strip()
+
+
+class Contacts:
+    '''
+    Emails of the contacts of each host and service
+
+    Contacts and contact groups can be defined after the objects using
+    them, so they are collected first and resolved at the end.
+    '''
+    def __init__(self) -> None:
+        self.emails: Dict[str, str] = {}
+        self.contactgroups: Dict[str, List[str]] = {}
+        self.subgroups: Dict[str, List[str]] = {}
+        # object key -> contacts and contact groups
+        self.objects: Dict[str, Tuple[List[str], List[str]]] = {}
+
+    def add(self, kind: str, obj: Dict[str, str]) -> None:
+        if kind == 'contact' and obj.get('email'):
+            self.emails[obj['contact_name']] = obj['email']
+        elif kind == 'contactgroup':
+            name = obj['contactgroup_name']
+            self.contactgroups[name] = split_list(obj.get('members', ''))
+            self.subgroups[name] = split_list(
+                obj.get('contactgroup_members', ''))
+        elif kind in ('host', 'service') and (
+                obj.get('contacts') or obj.get('contact_groups')):
+            key = (
+                obj['host_name'] if kind == 'host'
+                else service_key(obj['host_name'], obj['service_description']))
+            self.objects[key] = (
+                split_list(obj.get('contacts', '')),
+                split_list(obj.get('contact_groups', '')))
+
+    def _members(self, group: str, seen: Set[str]) -> Iterator[str]:
+        if group in seen:
+            return
+        seen.add(group)
+        yield from self.contactgroups.get(group, ())
+        for subgroup in self.subgroups.get(group, ()):
+            yield from self._members(subgroup, seen)
+
+    def resolve(self) -> Dict[str, List[str]]:
+        '''
+        Emails of the contacts of each object
+        '''
+        group_emails: Dict[str, List[str]] = {}
+        resolved: Dict[str, List[str]] = {}
+        for key, (contacts, groups) in self.objects.items():
+            emails = {
+                self.emails[name] for name in contacts if name in self.emails}
+            for group in groups:
+                if group not in group_emails:
+                    group_emails[group] = [
+                        self.emails[name]
+                        for name in self._members(group, set())
+                        if name in self.emails]
+                emails.update(group_emails[group])
+            if emails:
+                resolved[key] = sorted(emails)
+        return resolved
+
+
+class ObjectsIndex(BaseModel):
+    version: int = 0
+    # identity of the objects.cache the index was built from
+    mtime_ns: int = 0
+    size: int = 0
+    # epoch the index was built, for the sources without objects.cache
+    created: float = 0
+
+    # host -> its parents
+    parents: Dict[str, List[str]] = {}
+    # service key -> service keys it depends on
+    service_dependencies: Dict[str, List[str]] = {}
+    # host -> its hostgroups
+    hostgroups: Dict[str, List[str]] = {}
+    # service key -> its servicegroups
+    servicegroups: Dict[str, List[str]] = {}
+    # host or service key -> emails of its contacts
+    contacts: Dict[str, List[str]] = {}
+
+    def is_current(self, filename: Path) -> bool:
+        stat = filename.stat()
+        return (
+            self.version == INDEX_VERSION and
+            self.mtime_ns == stat.st_mtime_ns and
+            self.size == stat.st_size)
+
+    @classmethod
+    def build(cls, filename: Path) -> 'ObjectsIndex':
+        '''
+        Build the indexes from objects.cache
+        '''
+        stat = filename.stat()
+        index = cls(
+            version=INDEX_VERSION, mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size)
+        contacts = Contacts()
+        for kind, obj in iter_definitions(str(filename)):
+            index.add(kind, obj)
+            contacts.add(kind, obj)
+        index.contacts = contacts.resolve()
+        logging.info(
+            f'Indexed {filename}: {len(index.parents)} hosts with parents, '
+            f'{len(index.service_dependencies)} dependent services')
+        return index
+
+    def add(self, kind: str, obj: Dict[str, str]) -> None:
+        '''
+        Add an object definition to the indexes
+        '''
+        if kind == 'host' and obj.get('parents'):
+            self.parents[obj['host_name']] = split_list(obj['parents'])
+        elif kind == 'hostgroup':
+            for host_name in split_list(obj.get('members', '')):
+                self.add_hostgroup(host_name, obj['hostgroup_name'])
+        elif kind == 'servicegroup':
+            # members are host,service pairs
+            members = split_list(obj.get('members', ''))
+            for host_name, service_description in zip(
+                    members[::2], members[1::2]):
+                self.add_servicegroup(
+                    host_name, service_description, obj['servicegroup_name'])
+        elif kind == 'servicedependency':
+            masters = split_list(obj.get('host_name', ''))
+            dependents = split_list(
+                obj.get('dependent_host_name', '')) or masters
+            master_service = obj.get('service_description', '')
+            dependent_service = obj.get('dependent_service_description', '')
+            if not master_service or not dependent_service:
+                return
+            for dependent in dependents:
+                key = service_key(dependent, dependent_service)
+                self.service_dependencies.setdefault(key, []).extend(
+                    service_key(master, master_service)
+                    for master in masters)
+
+    def add_hostgroup(self, host_name: str, hostgroup_name: str) -> None:
+        self.hostgroups.setdefault(host_name, []).append(hostgroup_name)
+
+    def add_servicegroup(
+        self,
+        host_name: str,
+        service_description: str,
+        servicegroup_name: str,
+    ) -> None:
+        self.servicegroups.setdefault(
+            service_key(host_name, service_description), []
+        ).append(servicegroup_name)
+
+
+# indexes already loaded by this process
+_indexes: FileCache[ObjectsIndex] = FileCache()
+
+
+def load_index(
+    filename: Path,
+    cache_file: Optional[Path] = None,
+) -> ObjectsIndex:
+    '''
+    Get the index of objects.cache, rebuilt only if the file changed
+
+    :param filename: objects.cache
+    :param cache_file: where the index is saved between runs
+    '''
+    def load() -> ObjectsIndex:
+        index = None
+        if cache_file is not None and cache_file.exists():
+            try:
+                index = ObjectsIndex.parse_file(cache_file)
+            except ValueError as err:
+                logging.warning(
+                    f'Ignoring invalid index {cache_file}: {err}')
+        if index is None or not index.is_current(filename):
+            index = ObjectsIndex.build(filename)
+            if cache_file is not None:
+                write_atomic(cache_file, index.json())
+        return index
+
+    return _indexes.get([filename], load)
@@ -0,0 +1,44 @@
+'''
+..  codeauthor:: Charles Blais
+
+Normalized view of a critical object
+
+Each source decodes objects differently (status.dat attributes, API JSON
+or status models).  The few fields needed to filter, count, group and
+order the critical objects are extracted into a :class:`Record` so those
+stages work the same way with every source without converting objects
+that will not be displayed.
+'''
+from typing import Callable, NamedTuple
+
+
+class Record(NamedTuple):
+    host_name: str
+    service_description: str
+    current_state: int
+    # epoch of the last state change
+    last_state_change: int
+    check_command: str
+    output: str
+    acknowledged: bool
+    downtime: bool
+    notifications_enabled: bool = True
+
+    @property
+    def silenced(self) -> bool:
+        '''
+        Acknowledged, in downtime or without notifications
+        '''
+        return (
+            self.acknowledged or self.downtime or
+            not self.notifications_enabled)
+
+    @property
+    def name(self) -> str:
+        if self.service_description:
+            return f'{self.host_name}/{self.service_description}'
+        return self.host_name
+
+
+# A filter returns False for records that should not be reported
+RecordFilter = Callable[[Record], bool]
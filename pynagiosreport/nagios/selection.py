@@ -0,0 +1,166 @@
+'''
+..  codeauthor:: Charles Blais
+
+Selection of the critical objects to convert and report
+
+Sources only convert the objects that will be displayed; the others are
+counted.  The displayed objects are the first ones in the report order,
+regardless of the order of the source.  They are picked while streaming
+through the candidates with a heap bounded to the report limit, so
+selecting k objects out of n costs O(n log k) instead of sorting them.
+'''
+import heapq
+
+import itertools
+
+from enum import Enum
+
+from typing import \
+    Any, Callable, Generic, Iterable, Iterator, List, Optional, Sequence, \
+    Tuple, TypeVar
+
+from pynagiosreport.models import CriticalCounts
+
+from .record import Record, RecordFilter
+
+
+T = TypeVar('T')
+
+
+class ReportOrder(Enum):
+    # longest critical first
+    oldest = 'oldest'
+    # most recent problems first
+    newest = 'newest'
+    # DOWN before UNREACHABLE, CRITICAL before UNKNOWN, then oldest
+    state = 'state'
+    # by host and service name
+    name = 'name'
+
+
+def rank_key(order: ReportOrder) -> Callable[[Record], Tuple]:
+    '''
+    Sort key of the records for an order
+    '''
+    if order == ReportOrder.newest:
+        return lambda r: (
+            -r.last_state_change, r.host_name, r.service_description)
+    if order == ReportOrder.state:
+        return lambda r: (
+            r.current_state, r.last_state_change, r.host_name,
+            r.service_description)
+    if order == ReportOrder.name:
+        return lambda r: (r.host_name, r.service_description)
+    return lambda r: (
+        r.last_state_change, r.host_name, r.service_description)
+
+
+def select(
+    candidates: Iterable[Tuple[Record, T]],
+    order: ReportOrder = ReportOrder.oldest,
+    limit: Optional[int] = None,
+) -> List[T]:
+    '''
+    Keep the first candidates in the report order
+
+    :param candidates: record of the objects matching the criteria with
+        what is needed to convert them, preferably a generator so they are
+        never all held in memory
+    :param order: report order
+    :param limit: maximum number of candidates kept, None for all
+    '''
+    key = rank_key(order)
+
+    def candidate_key(candidate: Tuple[Record, T]) -> Any:
+        return key(candidate[0])
+
+    if limit is None:
+        selected = sorted(candidates, key=candidate_key)
+    elif limit <= 0:
+        # the candidates are still consumed for the counts
+        for _ in candidates:
+            pass
+        selected = []
+    else:
+        selected = heapq.nsmallest(limit, candidates, key=candidate_key)
+    return [item for _, item in selected]
+
+
+class _Last:
+    '''
+    Sort key reversed, the root of the heap is the last item kept
+    '''
+    __slots__ = ('key',)
+
+    def __init__(self, key: Tuple):
+        self.key = key
+
+    def __lt__(self, other: '_Last') -> bool:
+        return other.key < self.key
+
+
+class Selection(Generic[T]):
+    '''
+    First items in the report order, kept while they are added one by one
+
+    Like select, for items that can not be streamed through a single
+    iterator: the heap holds at most limit items whatever the number
+    added.
+
+    :param order: report order
+    :param limit: maximum number of items kept, None for all
+    '''
+    def __init__(
+        self,
+        order: ReportOrder = ReportOrder.oldest,
+        limit: Optional[int] = None,
+    ):
+        self.key = rank_key(order)
+        self.limit = limit
+        self.heap: List[Tuple[_Last, int, T]] = []
+        self.counter = itertools.count()
+
+    def add(self, record: Record, item: T) -> None:
+        entry = (_Last(self.key(record)), next(self.counter), item)
+        if self.limit is None or len(self.heap) < self.limit:
+            heapq.heappush(self.heap, entry)
+        elif self.heap and self.heap[0][0] < entry[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    @property
+    def items(self) -> List[T]:
+        '''
+        Items kept, in the report order
+        '''
+        return [item for _, _, item in sorted(self.heap, reverse=True)]
+
+
+def select_reported(
+    reported: Iterable[Tuple[Record, T]],
+    filters: Sequence[RecordFilter] = (),
+    counts: Optional[CriticalCounts] = None,
+    order: ReportOrder = ReportOrder.oldest,
+    limit: Optional[int] = None,
+) -> List[T]:
+    '''
+    Keep the first reported objects accepted by the filters
+
+    Every object accepted is counted, only the first ones in the report
+    order are kept.
+
+    :param reported: record of the reported objects of a source with what
+        is needed to convert them
+    :param filters: only objects accepted by every filter are kept
+    :param counts: filled with the count of all objects accepted
+    :param order: report order
+    :param limit: maximum number of objects kept, None for all
+    '''
+    def candidates() -> Iterator[Tuple[Record, T]]:
+        for record, item in reported:
+            if not all(accept(record) for accept in filters):
+                continue
+            if counts is not None:
+                counts.add(record)
+            yield record, item
+
+    return select(candidates(), order, limit)
@@ -0,0 +1,153 @@
+'''
+..  codeauthor:: Charles Blais
+
+Critical objects fetched once and shared by several reports
+
+The critical hosts and services, silenced included, are read from the
+source a single time; every report then filters, counts and selects from
+the same snapshot in memory instead of querying the API or parsing the
+status file again.  The snapshot holds the records with the raw content
+of the source, an object is only converted once a report selects it.
+'''
+from typing import \
+    TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple, \
+    Union
+
+from pynagiosreport.models import \
+    CriticalCounts, HostStatus, HostStatusCore, ServiceStatus, \
+    ServiceStatusCore, StatusObject
+
+from .logfile import CriticalState
+
+from .record import Record, RecordFilter
+
+from .selection import ReportOrder, select_reported
+
+from .statusfile import StatusFile
+
+if TYPE_CHECKING:
+    from .api import NagiosAPI
+
+Host = Union[HostStatus, HostStatusCore]
+Service = Union[ServiceStatus, ServiceStatusCore]
+
+
+class SharedSource:
+    '''
+    Snapshot of the critical objects of another source
+
+    :param source: NagiosAPI, StatusFile or CriticalState read once
+    '''
+    def __init__(
+        self,
+        source: Union['NagiosAPI', StatusFile, CriticalState],
+    ):
+        self.source = source
+        # record and raw content of the source, by kind
+        self.objects: Dict[str, List[Tuple[Record, Any]]] = {
+            kind: list(source.iter_reported(kind, unchecked=False))
+            for kind in ('hoststatus', 'servicestatus')}
+        # objects already converted for a report
+        self.converted: Dict[Tuple[str, str], StatusObject] = {}
+
+    def _iter_reported(
+        self,
+        kind: str,
+        unchecked: bool,
+    ) -> Iterator[Tuple[Record, Tuple[Record, Any]]]:
+        for record, item in self.objects[kind]:
+            if unchecked and record.silenced:
+                continue
+            yield record, (record, item)
+
+    def _get_critical(
+        self,
+        kind: str,
+        unchecked: bool,
+        limit: Optional[int],
+        counts: Optional[CriticalCounts],
+        order: ReportOrder,
+        filters: Sequence[RecordFilter],
+    ) -> List[Any]:
+        """
+        Select the critical objects of a kind, converting those selected
+        for the first time
+        """
+        selected = []
+        for record, item in select_reported(
+                self._iter_reported(kind, unchecked), filters, counts, order,
+                limit):
+            key = (record.host_name, record.service_description)
+            obj = self.converted.get(key)
+            if obj is None:
+                obj = self.converted[key] = self.source.convert(kind, item)
+            selected.append(obj)
+        return selected
+
+    def iter_host_records(self, unchecked: bool = True) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical hosts
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        for record, _ in self._iter_reported('hoststatus', unchecked):
+            yield record
+
+    def iter_service_records(
+        self,
+        unchecked: bool = True,
+    ) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical services
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        for record, _ in self._iter_reported('servicestatus', unchecked):
+            yield record
+
+    def get_critical_hosts(
+        self,
+        unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
+    ) -> List[Host]:
+        """
+        Get all hosts that are critical (include unknown)
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        :param limit: maximum number of hosts returned, the first ones in
+            the report order
+        :param counts: filled with the count of all critical hosts
+        :param order: report order
+        :param filters: only hosts accepted by every filter are returned
+        """
+        return self._get_critical(
+            'hoststatus', unchecked, limit, counts, order, filters)
+
+    def get_critical_services(
+        self,
+        unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
+    ) -> List[Service]:
+        """
+        Get all service that are critical (include unknown)
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        :param limit: maximum number of services returned, the first ones
+            in the report order
+        :param counts: filled with the count of all critical services
+        :param order: report order
+        :param filters: only services accepted by every filter are
+            returned
+        """
+        return self._get_critical(
+            'servicestatus', unchecked, limit, counts, order, filters)
@@ -3,23 +3,58 @@
 '''
 import logging
 
-from typing import List, Dict, Union
+from typing import \
+    Iterator, List, Dict, Optional, Sequence, Tuple, Type, TypeVar
 
 import re
 
-from pynagiosreport.models import HostStatusCore, ServiceStatusCore
+import hashlib
+
+from pydantic import BaseModel
+
+from pynagiosreport.models import \
+    CriticalCounts, HostStatusCore, ServiceStatusCore, StatusObject
+
+from .record import Record, RecordFilter
+
+from .selection import ReportOrder, select_reported
 
 from pathlib import Path
 
 
+Model = TypeVar('Model', bound=BaseModel)
+
+# Attributes updated by every check even if nothing else changed, they
+# are ignored when deciding if a cached block can be reused and decoded
+# again into the reused block
+VOLATILE_ATTRIBUTES = (
+    'last_check',
+    'next_check',
+    'last_update',
+    'check_execution_time',
+    'check_latency',
+    'performance_data',
+)
+
+VOLATILE_PREFIXES = tuple(f'{name}=' for name in VOLATILE_ATTRIBUTES)
+
+
 class StatusFile:
     '''
     Handler of status.dat file parsing
+
+    :param filename: status.dat file
+    :param cache: keep the decoded blocks and their objects between
+        parses, only blocks that changed (volatile attributes excluded)
+        are decoded again
     '''
-    def __init__(self, filename):
+    def __init__(self, filename, cache: bool = False):
         self.filename = filename
         if not Path(self.filename).exists():
             raise FileNotFoundError(f'{self.filename} not found')
+        self.cache = cache
+        self._blocks: Dict[str, Dict[bytes, Dict[str, str]]] = {}
+        self._objects: Dict[str, Dict[bytes, BaseModel]] = {}
 
     @staticmethod
     def is_critical_host(host: HostStatusCore) -> bool:
@@ -36,9 +71,7 @@ class StatusFile:
         return service.current_state in [2, 3]
 
     @staticmethod
-    def is_unchecked(
-        obj: Union[HostStatusCore, ServiceStatusCore]
-    ) -> bool:
+    def is_unchecked(obj: StatusObject) -> bool:
         '''
         Check if has to be alarmed
         '''
@@ -54,149 +87,338 @@ class StatusFile:
         return True
 
     @staticmethod
-    def _add_object_to_host(
+    def _is_reported_block(
         obj: Dict[str, str],
+        critical_states: List[int],
         unchecked: bool,
-        result: List[HostStatusCore],
-    ) -> List[HostStatusCore]:
-        '''
-        Check the content an determine if needs ot be added
+    ) -> bool:
         '''
-        if len(obj.keys()) == 0:  # empty object
-            logging.debug('empty object, continue')
-            return result
+        Check the raw content an determine if needs ot be reported
 
-        host = HostStatusCore(**obj)
-        if not StatusFile.is_critical_host(host):
-            logging.debug(f'[host] {host.host_name} not critical')
-            return result
+        The check is done on the raw attributes so that objects which are
+        not reported are never converted.
+        '''
+        name = obj.get('service_description', obj.get('host_name'))
+        if int(obj.get('current_state', 0)) not in critical_states:
+            logging.debug(f'{name} not critical')
+            return False
 
-        if host.current_attempt != host.max_attempts:
-            logging.debug('[host]check attempt not completed')
-            return result
+        if obj.get('current_attempt') != obj.get('max_attempts'):
+            logging.debug(f'{name} check attempt not completed')
+            return False
 
-        logging.info(f'[host] {host.host_name} critical')
+        logging.info(f'{name} critical')
 
-        if unchecked and not StatusFile.is_unchecked(host):
-            logging.debug(f'[host] {host.host_name} checked')
-            return result
+        if unchecked and (
+            obj.get('notifications_enabled') == '0' or
+            obj.get('problem_has_been_acknowledged', '0') != '0' or
+            obj.get('scheduled_downtime_depth', '0') != '0'
+        ):
+            logging.debug(f'{name} checked')
+            return False
 
-        result.append(host)
-        return result
+        return True
 
-    def get_critical_hosts(
-        self,
-        unchecked: bool = True,
-    ) -> List[HostStatusCore]:
+    @staticmethod
+    def to_record(obj: Dict[str, str]) -> Record:
+        '''
+        Normalized view of the raw object
+        '''
+        return Record(
+            host_name=obj.get('host_name', ''),
+            service_description=obj.get('service_description', ''),
+            current_state=int(obj.get('current_state', 0)),
+            last_state_change=int(obj.get('last_state_change', 0)),
+            check_command=obj.get('check_command', ''),
+            output=obj.get('plugin_output', ''),
+            acknowledged=obj.get('problem_has_been_acknowledged', '0') != '0',
+            downtime=obj.get('scheduled_downtime_depth', '0') != '0',
+            notifications_enabled=obj.get('notifications_enabled') != '0',
+        )
+
+    def _iter_raw_blocks(self, kind: str) -> Iterator[List[str]]:
         """
-        Get all hosts that are critical (include unknown)
-
-        :param bool unchecked: get those that have not been silenced
-            acknowledged, or scheduled a downtime
+        Iterate over the lines of every non empty block of a kind
         """
-        host_pattern_start = re.compile(r'^\s*hoststatus\s*{')
-        host_pattern_end = re.compile(r'^\s*}')
-        attr_pattern = re.compile(r'\s*(\w+)(?:=|\s+)(.*)')
-
-        result: List[HostStatusCore] = []
+        pattern_start = re.compile(r'^\s*' + kind + r'\s*{')
+        pattern_end = re.compile(r'^\s*}')
 
         with open(self.filename) as fp:
-            obj: Dict[str, str] = {}
+            lines: List[str] = []
             in_block = False
             for line in fp:
                 logging.debug(f'processing line: {line}')
-                match_host = host_pattern_start.match(line)
-                match_attr = attr_pattern.match(line)
-                match_end = host_pattern_end.match(line)
                 if line.startswith('#'):
                     continue
-                elif match_host:
+                elif pattern_start.match(line):
                     logging.debug('found start')
                     in_block = True
-                elif match_end:
+                elif not in_block:
+                    continue
+                elif pattern_end.match(line):
                     logging.debug('found end')
                     in_block = False
-                    StatusFile._add_object_to_host(
-                        obj, unchecked, result)
-                    obj = {}
-                elif in_block and match_attr:
-                    attribute = match_attr.group(1)
-                    value = match_attr.group(2).strip()
-                    logging.debug(f'decoded {attribute}:{value}')
-                    obj[attribute] = value
-        return result
+                    if lines:
+                        yield lines
+                    else:
+                        logging.debug('empty object, continue')
+                    lines = []
+                else:
+                    lines.append(line)
 
     @staticmethod
-    def _add_object_to_service(
+    def _decode_block(lines: List[str]) -> Dict[str, str]:
+        """
+        Decode the attributes of a block
+        """
+        attr_pattern = re.compile(r'\s*(\w+)(?:=|\s+)(.*)')
+
+        obj: Dict[str, str] = {}
+        for line in lines:
+            match_attr = attr_pattern.match(line)
+            if match_attr:
+                attribute = match_attr.group(1)
+                value = match_attr.group(2).strip()
+                logging.debug(f'decoded {attribute}:{value}')
+                obj[attribute] = value
+        return obj
+
+    def _iter_decoded(
+        self,
+        kind: str,
+    ) -> Iterator[Tuple[Optional[bytes], Dict[str, str]]]:
+        """
+        Iterate over the decoded attributes of every block of a kind
+
+        When the cache is enabled, the body of each block is hashed and
+        the attributes decoded during the previous parse are reused if
+        the body did not change.  Volatile attributes are not part of the
+        hash, only them are decoded again for a reused block.
+
+        :returns: hash of the block (None without cache) and attributes
+        """
+        if not self.cache:
+            for lines in self._iter_raw_blocks(kind):
+                yield None, StatusFile._decode_block(lines)
+            return
+
+        previous = self._blocks.get(kind, {})
+        current: Dict[bytes, Dict[str, str]] = {}
+        for lines in self._iter_raw_blocks(kind):
+            stable: List[str] = []
+            volatile: List[str] = []
+            for line in lines:
+                if line.lstrip().startswith(VOLATILE_PREFIXES):
+                    volatile.append(line)
+                else:
+                    stable.append(line)
+            digest = hashlib.blake2b(
+                ''.join(stable).encode(), digest_size=16).digest()
+            obj = previous.get(digest)
+            if obj is None:
+                obj = StatusFile._decode_block(lines)
+            else:
+                obj = {**obj, **StatusFile._decode_block(volatile)}
+            current[digest] = obj
+            yield digest, obj
+        logging.info(
+            f'Decoded {len(current.keys() - previous.keys())} of '
+            f'{len(current)} {kind} blocks')
+        self._blocks[kind] = current
+        # forget the objects of blocks that changed
+        objects = self._objects.get(kind, {})
+        self._objects[kind] = {
+            digest: obj for digest, obj in objects.items()
+            if digest in current}
+
+    def _convert(
+        self,
+        kind: str,
+        digest: Optional[bytes],
         obj: Dict[str, str],
+        model: Type[Model],
+    ) -> Model:
+        """
+        Convert the attributes of a block, reusing the cached object with
+        its volatile attributes refreshed
+        """
+        if digest is None:
+            return model.parse_obj(obj)
+        objects = self._objects.setdefault(kind, {})
+        converted = objects.get(digest)
+        if converted is None:
+            converted = model.parse_obj(obj)
+        else:
+            converted = StatusFile._refresh(converted, obj)
+        objects[digest] = converted
+        return converted  # type: ignore
+
+    @staticmethod
+    def _refresh(converted: BaseModel, obj: Dict[str, str]) -> BaseModel:
+        """
+        Copy of the object with the current volatile attributes, the
+        object itself if they did not change
+        """
+        update = {}
+        for name in VOLATILE_ATTRIBUTES:
+            field = converted.__fields__.get(name)
+            if field is None or name not in obj:
+                continue
+            value, error = field.validate(obj[name], {}, loc=name)
+            if error is None and value != getattr(converted, name):
+                update[name] = value
+        return converted.copy(update=update) if update else converted
+
+    def iter_blocks(self, kind: str) -> Iterator[Dict[str, str]]:
+        """
+        Iterate over the raw attributes of every block of a kind
+
+        :param kind: block type (info, hoststatus, servicestatus, ...)
+        """
+        for _, obj in self._iter_decoded(kind):
+            yield obj
+
+    def iter_objects(self, kind: str, model: Type[Model]) -> Iterator[Model]:
+        """
+        Iterate over the converted objects of every block of a kind
+
+        :param kind: block type (hoststatus, servicestatus)
+        :param model: model used to convert the block
+        """
+        for digest, obj in self._iter_decoded(kind):
+            yield self._convert(kind, digest, obj, model)
+
+    def _iter_reported(
+        self,
+        kind: str,
+        critical_states: List[int],
         unchecked: bool,
-        result: List[ServiceStatusCore],
-    ) -> List[ServiceStatusCore]:
-        '''
-        Check the content an determine if needs ot be added
-        '''
-        if len(obj.keys()) == 0:  # empty object
-            logging.debug('empty object, continue')
-            return result
+    ) -> Iterator[Tuple[Record, Tuple[Optional[bytes], Dict[str, str]]]]:
+        """
+        Iterate over the record and attributes of the reported blocks
+        """
+        for digest, obj in self._iter_decoded(kind):
+            if StatusFile._is_reported_block(obj, critical_states, unchecked):
+                yield StatusFile.to_record(obj), (digest, obj)
+
+    def iter_reported(
+        self,
+        kind: str,
+        unchecked: bool = True,
+    ) -> Iterator[Tuple[Record, Tuple[Optional[bytes], Dict[str, str]]]]:
+        """
+        Iterate over the record and attributes of the critical objects of
+        a kind, none is converted
+
+        :param kind: hoststatus or servicestatus
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        return self._iter_reported(
+            kind, [1, 2] if kind == 'hoststatus' else [2, 3], unchecked)
 
-        service = ServiceStatusCore(**obj)
-        if not StatusFile.is_critical_service(service):
-            logging.debug(
-                f'[service] {service.service_description} not critical')
-            return result
+    def convert(
+        self,
+        kind: str,
+        item: Tuple[Optional[bytes], Dict[str, str]],
+    ) -> StatusObject:
+        """
+        Convert the attributes of a critical object of iter_reported
+        """
+        digest, obj = item
+        if kind == 'hoststatus':
+            return self._convert(kind, digest, obj, HostStatusCore)
+        return self._convert(kind, digest, obj, ServiceStatusCore)
+
+    def _get_critical(
+        self,
+        kind: str,
+        model: Type[Model],
+        critical_states: List[int],
+        unchecked: bool,
+        limit: Optional[int],
+        counts: Optional[CriticalCounts],
+        order: ReportOrder,
+        filters: Sequence[RecordFilter],
+    ) -> List[Model]:
+        """
+        Get the critical objects of a kind, only those within the limit
+        are converted
+        """
+        return [
+            self._convert(kind, digest, obj, model)
+            for digest, obj in select_reported(
+                self._iter_reported(kind, critical_states, unchecked),
+                filters, counts, order, limit)]
+
+    def iter_host_records(self, unchecked: bool = True) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical hosts, none is converted
+
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        for record, _ in self._iter_reported('hoststatus', [1, 2], unchecked):
+            yield record
 
-        if service.current_attempt != service.max_attempts:
-            logging.debug('[service] check attempt not completed')
-            return result
+    def iter_service_records(
+        self,
+        unchecked: bool = True,
+    ) -> Iterator[Record]:
+        """
+        Iterate over the records of the critical services, none is
+        converted
 
-        logging.info(f'[service] {service.service_description} critical')
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        """
+        for record, _ in self._iter_reported(
+                'servicestatus', [2, 3], unchecked):
+            yield record
 
-        if unchecked and not StatusFile.is_unchecked(service):
-            logging.info(
-                f'[service] {service.service_description} checked')
-            return result
+    def get_critical_hosts(
+        self,
+        unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
+    ) -> List[HostStatusCore]:
+        """
+        Get all hosts that are critical (include unknown)
 
-        result.append(service)
-        return result
+        :param bool unchecked: get those that have not been silenced
+            acknowledged, or scheduled a downtime
+        :param limit: maximum number of hosts returned, the first ones in
+            the report order; the others are only counted
+        :param counts: filled with the count of all critical hosts
+        :param order: report order
+        :param filters: only hosts accepted by every filter are returned
+        """
+        return self._get_critical(
+            'hoststatus', HostStatusCore, [1, 2], unchecked, limit, counts,
+            order, filters)
 
     def get_critical_services(
         self,
         unchecked: bool = True,
+        limit: Optional[int] = None,
+        counts: Optional[CriticalCounts] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        filters: Sequence[RecordFilter] = (),
     ) -> List[ServiceStatusCore]:
         """
         Get all service that are critical (include unknown)
 
         :param bool unchecked: get those that have not been silenced
             acknowledged, or scheduled a downtime
+        :param limit: maximum number of services returned, the first ones
+            in the report order; the others are only counted
+        :param counts: filled with the count of all critical services
+        :param order: report order
+        :param filters: only services accepted by every filter are
+            returned
         """
-        service_pattern_start = re.compile(r'^\s*servicestatus\s*{')
-        service_pattern_end = re.compile(r'^\s*}')
-        attr_pattern = re.compile(r'\s*(\w+)(?:=|\s+)(.*)')
-
-        result: List[ServiceStatusCore] = []
-
-        with open(self.filename) as fp:
-            obj: Dict[str, str] = {}
-            in_block = False
-            for line in fp:
-                logging.debug(f'processing line: {line}')
-                match_service = service_pattern_start.match(line)
-                match_attr = attr_pattern.match(line)
-                match_end = service_pattern_end.match(line)
-                if line.startswith('#'):
-                    continue
-                elif match_service:
-                    logging.debug('found start')
-                    in_block = True
-                elif match_end:
-                    logging.debug('found end')
-                    in_block = False
-                    StatusFile._add_object_to_service(
-                        obj, unchecked, result)
-                    obj = {}
-                elif in_block and match_attr:
-                    attribute = match_attr.group(1)
-                    value = match_attr.group(2).strip()
-                    logging.debug(f'decoded {attribute}:{value}')
-                    obj[attribute] = value
-        return result
+        return self._get_critical(
+            'servicestatus', ServiceStatusCore, [2, 3], unchecked, limit,
+            counts, order, filters)
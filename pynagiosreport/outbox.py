@@ -0,0 +1,239 @@
+'''
+..  codeauthor:: Charles Blais
+
+Durable outbox of the notifications
+
+Rendered notifications are spooled to a directory before being sent, so
+a Rave or SMTP outage does not lose them; they are sent again with an
+exponential backoff.  Each notification is written to a temporary file
+then renamed in the outbox, so a notification is either complete or
+absent.
+
+A notification has a deduplication key (the sink, the report and the
+destination).  Spooling a notification removes the pending ones with
+the same key: after an outage, only the latest report of each
+destination is sent instead of every report missed.  The notifications
+of the changes are kept, each one lists what changed since the previous
+one; they have their own keys and replace no other notification.
+
+A notification records the report it belongs to; it is only sent again
+with the settings (SMTP server, Rave credentials) of that report.
+'''
+import fcntl
+
+import itertools
+
+import logging
+
+import os
+
+import time
+
+from contextlib import contextmanager
+
+from functools import lru_cache
+
+from pathlib import Path
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, \
+    Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from .config import get_app_settings
+
+if TYPE_CHECKING:
+    from .config import AppSettings
+
+
+class OutboxEntry(BaseModel):
+    sink: str
+    key: str
+    # name of the report, None outside a report definition
+    report: Optional[str] = None
+    created: float
+    attempts: int = 0
+    # epoch of the next attempt
+    next_attempt: float = 0
+    payload: Dict[str, Any]
+
+
+# sends a batch of entries of a sink, the error of each entry or None
+BatchSender = Callable[[List[OutboxEntry]], List[Optional[Exception]]]
+
+
+_counter = itertools.count()
+
+
+class Outbox:
+    '''
+    Spool directory of the notifications to send
+
+    :param directory: spool directory
+    :param max_attempts: attempts before a notification is moved to the
+        failed directory
+    :param backoff: seconds before the first retry, doubled every attempt
+    :param max_backoff: maximum seconds between two attempts
+    :param batch: maximum notifications sent at once
+    '''
+    def __init__(
+        self,
+        directory: Path,
+        max_attempts: int = 10,
+        backoff: float = 60,
+        max_backoff: float = 3600,
+        batch: int = 50,
+    ):
+        self.directory = directory
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.batch = batch
+        self.tmp_dir = directory.joinpath('tmp')
+        self.failed_dir = directory.joinpath('failed')
+        for path in (self.directory, self.tmp_dir, self.failed_dir):
+            path.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def lock(self, sink: str) -> Iterator[None]:
+        '''
+        Only one process or thread handles the notifications of a sink
+        '''
+        with open(self.directory.joinpath(f'.{sink}.lock'), 'w') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def write(self, path: Path, entry: OutboxEntry) -> None:
+        tmp = self.tmp_dir.joinpath(path.name)
+        tmp.write_text(entry.json())
+        os.replace(tmp, path)
+
+    def entries(self, sink: str) -> List[Tuple[Path, OutboxEntry]]:
+        '''
+        Pending notifications of a sink, oldest first
+        '''
+        entries = []
+        for path in sorted(self.directory.glob(f'{sink}-*.json')):
+            try:
+                entries.append((path, OutboxEntry.parse_file(path)))
+            except ValueError as err:
+                logging.error(f'Invalid notification {path}: {err}')
+                os.replace(path, self.failed_dir.joinpath(path.name))
+        return entries
+
+    def put(
+        self,
+        sink: str,
+        key: str,
+        payload: Dict[str, Any],
+        replace: bool = True,
+        report: Optional[str] = None,
+    ) -> Path:
+        '''
+        Spool a notification
+
+        :param replace: remove the notifications pending with the same key
+        :param report: name of the report of the notification
+        '''
+        now = time.time()
+        path = self.directory.joinpath(
+            f'{sink}-{time.time_ns():020d}-{os.getpid()}-'
+            f'{next(_counter)}.json')
+        with self.lock(sink):
+            for pending_path, pending in self.entries(sink):
+                if replace and pending.key == key:
+                    logging.info(f'Replacing pending notification {key}')
+                    pending_path.unlink()
+            self.write(path, OutboxEntry(
+                sink=sink, key=key, report=report, created=now,
+                payload=payload))
+        return path
+
+    def reports(self, sink: str) -> Set[Optional[str]]:
+        '''
+        Reports of the notifications pending for a sink
+        '''
+        return {entry.report for _, entry in self.entries(sink)}
+
+    def delivered(self, path: Path) -> bool:
+        '''
+        Check if a notification spooled was sent
+        '''
+        return not (
+            path.exists() or self.failed_dir.joinpath(path.name).exists())
+
+    def drain(
+        self,
+        sink: str,
+        send: BatchSender,
+        report: Optional[str] = None,
+    ) -> int:
+        '''
+        Send the notifications of a sink and a report due for an attempt,
+        in batches
+
+        :param send: sends with the settings of the report
+        :param report: name of the report of the notifications
+        :returns: number of notifications sent
+        '''
+        sent = 0
+        with self.lock(sink):
+            now = time.time()
+            due = [
+                (path, entry) for path, entry in self.entries(sink)
+                if entry.report == report and entry.next_attempt <= now]
+            for start in range(0, len(due), self.batch):
+                batch = due[start:start + self.batch]
+                errors = send([entry for _, entry in batch])
+                for (path, entry), error in zip(batch, errors):
+                    if error is None:
+                        path.unlink()
+                        sent += 1
+                    else:
+                        self.retry(path, entry, error)
+        if sent:
+            logging.info(f'Sent {sent} {sink} notifications from outbox')
+        return sent
+
+    def retry(self, path: Path, entry: OutboxEntry, error: Exception) -> None:
+        entry.attempts += 1
+        if entry.attempts >= self.max_attempts:
+            logging.error(
+                f'Giving up {entry.key} after {entry.attempts} attempts: '
+                f'{error}')
+            os.replace(path, self.failed_dir.joinpath(path.name))
+            return
+        delay = min(
+            self.backoff * 2 ** (entry.attempts - 1), self.max_backoff)
+        entry.next_attempt = time.time() + delay
+        logging.warning(
+            f'Sending {entry.key} failed ({error}), retrying in '
+            f'{delay:.0f} seconds')
+        self.write(path, entry)
+
+
+@lru_cache()
+def open_outbox(
+    directory: Path,
+    max_attempts: int,
+    backoff: float,
+    max_backoff: float,
+    batch: int,
+) -> Outbox:
+    return Outbox(directory, max_attempts, backoff, max_backoff, batch)
+
+
+def get_outbox(settings: Optional['AppSettings'] = None) -> Outbox:
+    '''
+    Outbox of the settings, those of the process by default
+    '''
+    settings = settings or get_app_settings()
+    return open_outbox(
+        settings.outbox_dir,
+        settings.outbox_max_attempts,
+        settings.outbox_backoff,
+        settings.outbox_max_backoff,
+        settings.outbox_batch)
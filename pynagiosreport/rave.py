@@ -1,57 +1,130 @@
 '''
 ..  codeauthor:: Charles Blais
 '''
-from typing import List, Union
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Union
 
-from .models import \
+from .models import CriticalCounts, \
     HostStatus, HostStatusCore, ServiceStatus, ServiceStatusCore
 
-from pyravealert.inbound import \
-    generate, Status, Category, Parameter, send as send_rave
+from .snapshot import SnapshotDiff
+
+from .grouping import CriticalGroup
 
 from .config import get_app_settings
 
+from .exceptions import SinkError
+
+from .outbox import OutboxEntry, get_outbox
+
+if TYPE_CHECKING:
+    from .config import AppSettings
+
+
+def get_groups_description(
+    groups: List[CriticalGroup],
+    limit: int,
+) -> str:
+    '''
+    Generate description lines of the groups of identical failures
+    '''
+    description = ''
+    for group in groups[:limit]:
+        description += (
+            f'- {group.count} x {group.key} (e.g. {group.example})\n')
+    if len(groups) > limit:
+        description += f'... {len(groups) - limit} more groups\n'
+    return description
+
+
+def get_suppressed_description(
+    counts: Optional[CriticalCounts],
+    kind: str,
+) -> str:
+    '''
+    Generate description lines of the objects behind upstream problems
+    '''
+    if not counts:
+        return ''
+    description = ''
+    for upstream, count in sorted(counts.suppressed.items()):
+        description += f'... {count} {kind} suppressed behind {upstream}\n'
+    return description
+
 
 def get_description(
-    hosts: Union[List[HostStatus], List[HostStatusCore]],
-    services: Union[List[ServiceStatus], List[ServiceStatusCore]],
+    hosts: Sequence[Union[HostStatus, HostStatusCore]],
+    services: Sequence[Union[ServiceStatus, ServiceStatusCore]],
+    changes: Optional[SnapshotDiff] = None,
+    hosts_counts: Optional[CriticalCounts] = None,
+    services_counts: Optional[CriticalCounts] = None,
+    settings: Optional['AppSettings'] = None,
 ) -> str:
     '''
     Generate description based on hosts/services
+
+    :param changes: when reporting only changes, list what was resolved
+        or acknowledged since the last report
+    :param hosts_counts: count of all critical hosts when the source
+        only returned those within the report limit
+    :param services_counts: same for the services
+    :param settings: settings of the report, those of the process by
+        default
     '''
-    settings = get_app_settings()
+    settings = settings or get_app_settings()
 
-    hosts_count = len(hosts)
+    hosts_count = hosts_counts.total if hosts_counts else len(hosts)
     more_host_count = (
         hosts_count - settings.max_report_hosts
         if hosts_count > settings.max_report_hosts
         else 0)
     hosts_min = hosts[:settings.max_report_hosts]
 
-    services_count = len(services)
+    services_count = (
+        services_counts.total if services_counts else len(services))
     more_service_count = (
         services_count - settings.max_report_services
         if services_count > settings.max_report_services
         else 0)
     services_min = services[:settings.max_report_services]
 
+    # During alert storms, one line per group of identical failures
+    hosts_groups = (
+        hosts_counts.get_groups(settings.group_threshold)
+        if hosts_counts else [])
+    services_groups = (
+        services_counts.get_groups(settings.group_threshold)
+        if services_counts else [])
+
     # Start description for hosts
     description = 'The following hosts are critical:\n'
     if hosts_count == 0:
         description += '- No hosts are critical\n'
+    elif hosts_groups:
+        description += get_groups_description(
+            hosts_groups, settings.max_report_hosts)
     else:
+        services_by_host = (
+            hosts_counts.services_by_host if hosts_counts else {})
         for host in hosts_min:
             description += (
                 f'- {host.host_name} since '
-                f'{host.last_time_up.strftime("%Y-%m-%d %H:%M")}\n'
+                f'{host.last_time_up.strftime("%Y-%m-%d %H:%M")}'
             )
+            if host.host_name in services_by_host:
+                description += (
+                    f' ({services_by_host[host.host_name]} services)')
+            description += '\n'
         if more_host_count:
             description += f'... {more_host_count} more hosts critical\n'
+    description += get_suppressed_description(hosts_counts, 'hosts')
 
     # Start description for services
     description += '\nThe following services are critical:\n'
     if services_count == 0:
         description += '- No services are critical'
+    elif services_groups:
+        description += get_groups_description(
+            services_groups, settings.max_report_services)
     else:
         for service in services_min:
             description += (
@@ -60,35 +133,73 @@ def get_description(
             )
         if more_service_count:
             description += f'... {more_service_count} more services critical\n'
+    description += get_suppressed_description(services_counts, 'services')
+
+    if changes is not None:
+        if changes.resolved:
+            description += '\nResolved since last report:\n'
+            for name in changes.resolved_names:
+                description += f'- {name}\n'
+        if changes.acknowledged:
+            description += '\nAcknowledged since last report:\n'
+            for name in changes.acknowledged_names:
+                description += f'- {name}\n'
     return description
 
 
-def send(
-    hosts: Union[List[HostStatus], List[HostStatusCore]],
-    services: Union[List[ServiceStatus], List[ServiceStatusCore]],
-) -> None:
+def build_notice(
+    hosts: Sequence[Union[HostStatus, HostStatusCore]],
+    services: Sequence[Union[ServiceStatus, ServiceStatusCore]],
+    changes: Optional[SnapshotDiff] = None,
+    hosts_counts: Optional[CriticalCounts] = None,
+    services_counts: Optional[CriticalCounts] = None,
+    settings: Optional['AppSettings'] = None,
+) -> Dict[str, str]:
     '''
-    Prepare nagios update by Rave
+    Text of the Rave notice, see get_description for the parameters
     '''
-    settings = get_app_settings()
+    settings = settings or get_app_settings()
 
-    hosts_count = len(hosts)
-    services_count = len(services)
+    hosts_count = hosts_counts.total if hosts_counts else len(hosts)
+    services_count = (
+        services_counts.total if services_counts else len(services))
 
-    # Start description for hosts
-    description = get_description(hosts, services)
-    instruction = f'Check {settings.url} for details'
+    return {
+        'headline': (
+            f'Nagios XI Notification - {hosts_count} '
+            f'hosts, {services_count} services'
+        ),
+        # Start description for hosts
+        'description': get_description(
+            hosts, services, changes, hosts_counts, services_counts,
+            settings),
+        'instruction': f'Check {settings.url} for details',
+    }
+
+
+def send_notice(
+    notice: Dict[str, str],
+    rave_url: Optional[str] = None,
+    settings: Optional['AppSettings'] = None,
+) -> None:
+    '''
+    Send a notice by Rave
+
+    :param rave_url: Rave of the notice, the one of the settings by
+        default
+    '''
+    from pyravealert.inbound import \
+        generate, Status, Category, Parameter, send as send_rave
+
+    settings = settings or get_app_settings()
 
     alert = generate(
         status=Status.actual,
         event='Nagios XI Notification',
         category=Category.infra,
-        headline=(
-            f'Nagios XI Notification - {hosts_count} '
-            f'hosts, {services_count} services'
-        ),
-        description=description,
-        instruction=instruction,
+        headline=notice['headline'],
+        description=notice['description'],
+        instruction=notice['instruction'],
         parameter=[Parameter(
             valueName='layer:CHIS:source',
             value='nagios',
@@ -97,6 +208,70 @@ def send(
     )
     send_rave(
         alert,
-        settings.rave_url,
+        rave_url or settings.rave_url,
         settings.rave_username,
         settings.rave_password)
+
+
+def send_spooled(
+    entries: List[OutboxEntry],
+    settings: Optional['AppSettings'] = None,
+) -> List[Optional[Exception]]:
+    '''
+    Send the notices of the outbox one after the other
+    '''
+    errors: List[Optional[Exception]] = []
+    for entry in entries:
+        try:
+            send_notice(
+                entry.payload['notice'], entry.payload['rave_url'],
+                settings)
+            errors.append(None)
+        except Exception as err:
+            errors.append(err)
+    return errors
+
+
+def drain(settings: Optional['AppSettings'] = None) -> int:
+    '''
+    Send the notices of the outbox due for an attempt, those of the report
+    of the settings
+    '''
+    settings = settings or get_app_settings()
+    return get_outbox(settings).drain(
+        'rave', lambda entries: send_spooled(entries, settings),
+        settings.report_name)
+
+
+def send(
+    hosts: Sequence[Union[HostStatus, HostStatusCore]],
+    services: Sequence[Union[ServiceStatus, ServiceStatusCore]],
+    changes: Optional[SnapshotDiff] = None,
+    hosts_counts: Optional[CriticalCounts] = None,
+    services_counts: Optional[CriticalCounts] = None,
+    settings: Optional['AppSettings'] = None,
+) -> None:
+    '''
+    Prepare nagios update by Rave
+
+    With the outbox, the notice is spooled first and kept until Rave
+    accepts it.  It replaces the notice pending for the same Rave; the
+    notices listing changes are all kept.  A notice kept for a retry
+    raises SinkError.
+    '''
+    settings = settings or get_app_settings()
+    notice = build_notice(
+        hosts, services, changes, hosts_counts, services_counts, settings)
+    if not settings.outbox:
+        send_notice(notice, settings=settings)
+        return
+    kind = 'rave' if changes is None else 'rave changes'
+    outbox = get_outbox(settings)
+    path = outbox.put(
+        'rave', f'{kind}:{settings.report_name or ""}:{settings.rave_url}',
+        {'notice': notice, 'rave_url': settings.rave_url},
+        changes is None,
+        settings.report_name)
+    drain(settings)
+    if not outbox.delivered(path):
+        raise SinkError('Rave notice kept in the outbox')
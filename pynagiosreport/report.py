@@ -0,0 +1,648 @@
+"""
+..  codeauthor:: Charles Blais
+
+Fetch the critical hosts/services and report them to the sinks
+
+The command line only sets the settings and selects the mode; the
+reports themselves are built here so they can run without click.
+"""
+import logging
+
+import time
+
+from functools import lru_cache
+
+from pathlib import Path
+
+from typing import TYPE_CHECKING, Callable, Dict, \
+    Iterator, List, Optional, Sequence, Set, TextIO, Tuple, Union
+
+from pynagiosreport.config import AppSettings, get_app_settings
+
+from pynagiosreport.exceptions import SinkError
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.nagios.record import Record, RecordFilter
+
+from pynagiosreport.nagios.objects import load_index, service_key
+
+from pynagiosreport.suppression import HostCollapse, Maintenance, Topology
+
+from pynagiosreport.formats import OutputFormat
+
+from pynagiosreport.models import CriticalCounts, \
+    HostStatus, HostStatusCore, ServiceStatus, ServiceStatusCore
+
+# The backends and sinks are only imported when selected, the CLI runs
+# every minute and most runs need few of them
+if TYPE_CHECKING:
+    from pynagiosreport.dispatch import Sink
+    from pynagiosreport.nagios.api import NagiosAPI
+    from pynagiosreport.nagios.logfile import CriticalState
+    from pynagiosreport.nagios.expression import Expression
+    from pynagiosreport.nagios.objects import ObjectsIndex
+    from pynagiosreport.nagios.shared import SharedSource
+    from pynagiosreport.routing import Routes
+    from pynagiosreport.snapshot import Snapshot, SnapshotDiff, SnapshotStore
+
+
+# any source of critical objects
+Source = Union['NagiosAPI', StatusFile, 'CriticalState', 'SharedSource']
+
+
+settings = get_app_settings()
+
+
+def drain_outbox() -> None:
+    """
+    Send again the notifications that failed and are due for an attempt,
+    each with the settings of its report
+    """
+    from pynagiosreport import email, rave
+    from pynagiosreport.outbox import get_outbox
+    outbox = get_outbox()
+    for name in sorted(outbox.reports('email'), key=str):
+        email.drain(get_report_settings(name))
+    for name in sorted(outbox.reports('rave'), key=str):
+        rave.drain(get_report_settings(name))
+
+
+def get_report_settings(name: Optional[str]) -> AppSettings:
+    """
+    Settings of a report of the reports file, those of the process
+    outside a report
+    """
+    if name is not None and settings.reports_file:
+        from pynagiosreport.reports import load_reports
+        for definition in load_reports(Path(settings.reports_file)):
+            if definition.name == name:
+                return settings.copy(update=definition.overrides)
+    if name is not None:
+        logging.warning(f'Report {name} not found, sending with defaults')
+    return settings.copy(update={'report_name': name})
+
+
+def get_source() -> Source:
+    """
+    Create api client if the API key is set, if not, use the status.dat
+    """
+    if settings.apikey:
+        from pynagiosreport.nagios.api import NagiosAPI
+        return NagiosAPI(settings.url_api, settings.apikey)
+    return StatusFile(settings.status_file)
+
+
+def open_source(follow_log: bool) -> Source:
+    """
+    Source of the long running modes, reusing what it can between the
+    reports
+
+    :param follow_log: maintain the critical state from nagios.log
+    """
+    if settings.apikey:
+        if follow_log:
+            raise ValueError('Following nagios.log requires the status file')
+        return get_source()
+    if follow_log:
+        from pynagiosreport.nagios.logfile import CriticalState
+        return CriticalState(
+            settings.status_file,
+            str(settings.nagios_log_file),
+            settings.log_checkpoint_file)
+    return StatusFile(settings.status_file, cache=True)
+
+
+def refresh_source(source: Source) -> None:
+    """
+    Read what was appended to nagios.log since the last report
+    """
+    from pynagiosreport.nagios.logfile import CriticalState
+    if isinstance(source, CriticalState):
+        source.update()
+
+
+def close_source(source: Source) -> None:
+    from pynagiosreport.nagios.logfile import CriticalState
+    if isinstance(source, CriticalState):
+        source.close()
+
+
+@lru_cache()
+def get_snapshot_store(filename: Path) -> 'SnapshotStore':
+    """
+    Last snapshot, read once per process
+    """
+    from pynagiosreport.snapshot import SnapshotStore
+    return SnapshotStore(filename)
+
+
+@lru_cache()
+def compile_expression(text: str) -> 'Expression':
+    """
+    Filter expression, parsed once
+    """
+    from pynagiosreport.nagios.expression import Expression
+    return Expression(text)
+
+
+def get_group_index(
+    source: Source,
+) -> 'ObjectsIndex':
+    """
+    Index of the group members, from objects.cache or queried from the
+    API when there is no status file
+    """
+    if settings.apikey:
+        from pynagiosreport.nagios.api import NagiosAPI
+        from pynagiosreport.nagios.shared import SharedSource
+        if isinstance(source, SharedSource):
+            source = source.source
+        assert isinstance(source, NagiosAPI)
+        return source.get_group_index(
+            settings.group_index_file, settings.group_index_ttl)
+    return load_index(
+        settings.objects_cache_file, settings.objects_index_file)
+
+
+def get_scope(
+    source: Source,
+) -> List[RecordFilter]:
+    """
+    Filters of the objects within the scope of the report
+    """
+    from pynagiosreport.filters import GroupMembership, load_ignore_list
+    scope: List[RecordFilter] = []
+    if settings.hostgroups or settings.servicegroups:
+        scope.append(GroupMembership(
+            get_group_index(source),
+            settings.hostgroups,
+            settings.servicegroups))
+    if settings.filter:
+        scope.append(compile_expression(settings.filter))
+    if settings.ignore_files:
+        scope.append(load_ignore_list(settings.ignore_files))
+    return scope
+
+
+def print_summary(
+    source: Source,
+) -> None:
+    """
+    Print the JSON summary of the critical hosts/services, silenced
+    included
+    """
+    from pynagiosreport.summary import summarize
+    index = (
+        get_group_index(source)
+        if settings.apikey or
+        settings.objects_cache_file.exists()
+        else None)
+    summary = summarize(
+        source.iter_host_records(unchecked=False),
+        source.iter_service_records(unchecked=False),
+        index,
+        get_scope(source))
+    print(summary.json())
+
+
+def write_report(
+    source: Source,
+    output_format: OutputFormat,
+    fp: TextIO,
+) -> None:
+    """
+    Write the critical hosts then services as they come out of the
+    source, with the same filters as the report
+    """
+    hosts_counts = CriticalCounts()
+    services_counts = CriticalCounts()
+    hosts_filters, filters = get_filters(
+        source, True, False, hosts_counts, services_counts)
+    host_names: Set[str] = set()
+
+    def records() -> Iterator[Record]:
+        for record in source.iter_host_records():
+            if all(accept(record) for accept in hosts_filters):
+                host_names.add(record.host_name)
+                yield record
+        if settings.collapse_host_services:
+            filters.append(HostCollapse(
+                host_names, hosts_counts.services_by_host))
+        for record in source.iter_service_records():
+            if all(accept(record) for accept in filters):
+                yield record
+
+    from pynagiosreport.formats import write_records
+    count = write_records(records(), output_format, fp)
+    logging.info(f'Wrote {count} critical objects as {output_format.value}')
+
+
+def get_topology(
+    source: Source,
+    unchecked: bool,
+    scope: Sequence[RecordFilter],
+    hosts_counts: CriticalCounts,
+    services_counts: CriticalCounts,
+) -> Tuple[Topology, Topology]:
+    """
+    Suppression of the hosts and services behind an upstream problem
+
+    An upstream object can come after the objects it explains, so the
+    names of the critical objects within the scope are collected first;
+    the pass is skipped when objects.cache defines no parents or
+    dependencies.
+    """
+    index = load_index(
+        settings.objects_cache_file, settings.objects_index_file)
+    host_names = (
+        {r.host_name for r in source.iter_host_records(unchecked)
+         if all(accept(r) for accept in scope)}
+        if index.parents else set())
+    service_keys = (
+        {service_key(r.host_name, r.service_description)
+         for r in source.iter_service_records(unchecked)
+         if all(accept(r) for accept in scope)}
+        if index.service_dependencies else set())
+    return (
+        Topology(index, host_names, service_keys, hosts_counts.suppressed),
+        Topology(
+            index, host_names, service_keys, services_counts.suppressed))
+
+
+def get_filters(
+    source: Source,
+    unchecked: bool,
+    snapshot: bool,
+    hosts_counts: CriticalCounts,
+    services_counts: CriticalCounts,
+) -> Tuple[List[RecordFilter], List[RecordFilter]]:
+    """
+    Filters of the hosts and of the services reported
+
+    :param snapshot: filters of the snapshot of the changes, which keeps
+        the objects behind an upstream problem
+    :param hosts_counts: filled with the number of hosts suppressed
+    :param services_counts: same for the services
+    """
+    # only the objects within the scope are reported
+    scope = get_scope(source)
+    hosts_filters: List[RecordFilter] = list(scope)
+    filters: List[RecordFilter] = list(scope)
+
+    # planned work of the external calendar
+    if settings.maintenance_file:
+        from pynagiosreport.maintenance import load_calendar
+        calendar = load_calendar(Path(settings.maintenance_file))
+        index = get_group_index(source) if calendar.hostgroups else None
+        hosts_filters.append(Maintenance(
+            calendar, index, hosts_counts.suppressed))
+        filters.append(Maintenance(
+            calendar, index, services_counts.suppressed))
+
+    # objects behind an upstream problem are suppressed
+    if (
+        settings.suppress_dependencies and
+        not snapshot and
+        settings.objects_cache_file.exists()
+    ):
+        topology = get_topology(
+            source, unchecked, scope, hosts_counts, services_counts)
+        hosts_filters.append(topology[0])
+        filters.append(topology[1])
+
+    return hosts_filters, filters
+
+
+def get_routes(
+    source: Source,
+) -> 'Routes':
+    """
+    Empty reports of the recipients of the routing rules and of the
+    contacts
+    """
+    from pynagiosreport.routing import Routes, Router, \
+        get_contacts_emails, get_contacts_router, get_rules_router, \
+        load_routing
+    emails: Set[str] = set()
+    routers: List[Router] = []
+    if settings.routing_file:
+        routing = load_routing(Path(settings.routing_file))
+        hostgroups = (
+            get_group_index(source).hostgroups if routing.hostgroups
+            else None)
+        emails.update(routing.emails)
+        routers.append(get_rules_router(routing, hostgroups))
+    if settings.route_to_contacts:
+        if not settings.objects_cache_file.exists():
+            raise ValueError('Routing to the contacts requires objects.cache')
+        index = load_index(
+            settings.objects_cache_file, settings.objects_index_file)
+        emails.update(get_contacts_emails(index))
+        routers.append(get_contacts_router(index))
+    return Routes(
+        emails, routers, settings.group_by, settings.report_order,
+        settings.max_report_hosts, settings.max_report_services)
+
+
+def send_routed(
+    source: Source,
+    routes: 'Routes',
+    services_by_host: Dict[str, int],
+    allow_empty_email: bool,
+    settings: AppSettings = settings,
+) -> None:
+    """
+    Email each routed recipient the critical objects they are
+    responsible for
+
+    The objects displayed to at least one recipient are read again from
+    the source, which must be the fetch the routes were built from.
+
+    :param settings: settings of the report
+    """
+    from pynagiosreport.email import build_message, deliver
+    from pynagiosreport.snapshot import get_key
+    reports = routes.get_reports(services_by_host)
+    displayed = {
+        (r.host_name, r.service_description)
+        for routed in reports.values()
+        for r in (*routed.hosts, *routed.services)}
+
+    def is_displayed(record: Record) -> bool:
+        return (record.host_name, record.service_description) in displayed
+
+    hosts = {
+        get_key(h): h
+        for h in source.get_critical_hosts(filters=[is_displayed])}
+    services = {
+        get_key(s): s
+        for s in source.get_critical_services(filters=[is_displayed])}
+    messages = []
+    for email, routed in reports.items():
+        total = routed.hosts_counts.total + routed.services_counts.total
+        if not allow_empty_email and total == 0:
+            logging.info(f'Empty email for {email}, do not send')
+            continue
+        messages.append((
+            build_message(
+                [hosts[(r.host_name, '')] for r in routed.hosts],
+                [services[(r.host_name, r.service_description)]
+                 for r in routed.services],
+                [email],
+                None,
+                routed.hosts_counts,
+                routed.services_counts,
+                settings),
+            [email]))
+    if messages:
+        deliver(messages, settings)
+
+
+def get_shared(source: Source) -> 'SharedSource':
+    """
+    Critical objects of the source fetched once, read by every pass
+    """
+    from pynagiosreport.nagios.shared import SharedSource
+    if isinstance(source, SharedSource):
+        return source
+    return SharedSource(source)
+
+
+def run_reports(
+    source: Source,
+    reports_file: Path,
+) -> None:
+    """
+    Fetch the critical objects once and run every report of the file on
+    them, a failing report does not stop the others
+    """
+    from pynagiosreport.reports import load_reports
+    definitions = load_reports(reports_file)
+    shared = get_shared(source)
+    for definition in definitions:
+        logging.info(f'Running report {definition.name}')
+        try:
+            with settings.override(definition.overrides):
+                report(
+                    shared,
+                    definition.emails,
+                    definition.allow_empty_email,
+                    definition.allow_empty_rave,
+                    definition.stdout,
+                    definition.changes_only)
+        except Exception:
+            logging.exception(f'Report {definition.name} failed')
+
+
+def report(
+    source: Source,
+    emails: List[str],
+    allow_empty_email: bool,
+    allow_empty_rave: bool,
+    stdout: bool,
+    changes_only: List[str],
+) -> None:
+    """
+    Get the critical hosts/services and send the report to the sinks
+    """
+    # defined the type of the hosts/services structure for typing
+    hosts: Sequence[Union[HostStatus, HostStatusCore]]
+    services: Sequence[Union[ServiceStatus, ServiceStatusCore]]
+
+    # the routed emails and the changes read the objects again in other
+    # passes, every pass reads the same fetch so an object can not change
+    # in between
+    routing = bool(settings.routing_file or settings.route_to_contacts)
+    if routing or changes_only:
+        source = get_shared(source)
+
+    # get the failed services/hosts, only those displayed are converted
+    hosts_counts = CriticalCounts(group_by=settings.group_by)
+    services_counts = CriticalCounts(group_by=settings.group_by)
+    hosts_filters, filters = get_filters(
+        source, True, False, hosts_counts, services_counts)
+
+    # fingerprint of the reported set, the same set is not notified again
+    # before the next reminder
+    fingerprint = None
+    if settings.renotify_interval is not None:
+        from pynagiosreport.fingerprint import Fingerprint
+        fingerprint = Fingerprint()
+        hosts_filters.append(fingerprint.add)
+
+    # the reports of the routed recipients are built in the same pass
+    routes = None
+    if routing:
+        routes = get_routes(source)
+        hosts_filters.append(routes.add_host)
+
+    hosts = source.get_critical_hosts(
+        True,
+        settings.max_report_hosts,
+        hosts_counts,
+        settings.report_order,
+        hosts_filters)
+
+    # services of the critical hosts are only counted on their host line
+    if settings.collapse_host_services:
+        filters.append(HostCollapse(
+            hosts_counts.by_host, hosts_counts.services_by_host))
+    if routes is not None:
+        filters.append(routes.add_service)
+    if fingerprint is not None:
+        filters.append(fingerprint.add)
+
+    services = source.get_critical_services(
+        True,
+        settings.max_report_services,
+        services_counts,
+        settings.report_order,
+        filters)
+
+    changes = None
+    if changes_only:
+        changes, snapshot = get_changes(source)
+        new_hosts = [
+            h for h in changes.new
+            if isinstance(h, (HostStatus, HostStatusCore))]
+        new_services = [
+            s for s in changes.new
+            if isinstance(s, (ServiceStatus, ServiceStatusCore))]
+
+    total_critical = hosts_counts.total + services_counts.total
+
+    # No send the reports based on the set parameters, the sinks run
+    # concurrently so a slow one does not delay the others.  A sink past
+    # its deadline keeps running after this report, so each sink is given
+    # a copy of the settings of this report instead of reading the
+    # settings of the process, overridden by the next report.
+    from functools import partial
+    from pynagiosreport.dispatch import dispatch
+    sink_settings = settings.copy()
+    sinks: List['Sink'] = []
+    if len(emails):
+        from pynagiosreport.email import send as send_email
+        logging.info(f'Preparing emailing to {emails}')
+        if 'email' in changes_only and changes is not None:
+            if not changes.changed:
+                logging.info('No changes since last run, do not email')
+            else:
+                logging.info('Sending email of changes')
+                sinks.append(get_sink('email', partial(
+                    send_email, new_hosts, new_services, emails, changes,
+                    settings=sink_settings)))
+        elif not allow_empty_email and total_critical == 0:
+            logging.info('Empty email, do not send')
+        else:
+            logging.info('Sending email')
+            sinks.append(get_sink('email', partial(
+                send_email, hosts, services, emails, None, hosts_counts,
+                services_counts, sink_settings)))
+
+    if routes is not None:
+        sinks.append(get_sink('routed email', partial(
+            send_routed, source, routes, hosts_counts.services_by_host,
+            allow_empty_email, sink_settings)))
+
+    if (
+        settings.rave_url and
+        settings.rave_username and
+        settings.rave_password
+    ):
+        from pynagiosreport.rave import send as send_rave
+        if 'rave' in changes_only and changes is not None:
+            if not changes.changed:
+                logging.info('No changes since last run, do not send rave')
+            else:
+                logging.info('Preparing sending changes by rave')
+                sinks.append(get_sink('rave', partial(
+                    send_rave, new_hosts, new_services, changes,
+                    settings=sink_settings)))
+        elif not allow_empty_rave and total_critical == 0:
+            logging.info('Empty rave, do not send')
+        else:
+            logging.info('Preparing sending by rave')
+            sinks.append(get_sink('rave', partial(
+                send_rave, hosts, services, None, hosts_counts,
+                services_counts, sink_settings)))
+
+    if stdout:
+        from pynagiosreport.rave import get_description
+        description = get_description(
+            hosts, services, None, hosts_counts, services_counts)
+        sinks.append(get_sink('stdout', partial(print, description)))
+
+    # sinks notifying the alerting set, not the changes
+    deduplicated = {
+        sink.name for sink in sinks
+        if sink.name in ('email', 'routed email', 'rave') and
+        sink.name not in changes_only}
+    # with nothing reported, the sinks not sending empty reports forget
+    # the set notified, so a set alerting again is notified at once
+    notified = None
+    if fingerprint is not None and (deduplicated or fingerprint.count == 0):
+        from pynagiosreport.fingerprint import NotifiedState
+        notified = NotifiedState.load(settings.notified_file)
+        now = time.time()
+        if fingerprint.count == 0:
+            for name in ('email', 'routed email', 'rave'):
+                if name not in deduplicated:
+                    notified.forget(name)
+        for name in list(deduplicated):
+            due = notified.next_notification(
+                name, fingerprint.value, settings.renotify_interval or 0,
+                settings.reminder_schedule)
+            if due is not None and now < due:
+                logging.info(
+                    f'Same critical set already notified by {name}, next '
+                    f'reminder in {due - now:.0f} seconds')
+                sinks = [sink for sink in sinks if sink.name != name]
+
+    results = dispatch(sinks)
+    if notified is not None and fingerprint is not None:
+        for result in results:
+            if result.ok and result.name in deduplicated:
+                notified.sent(result.name, fingerprint.value, now)
+        notified.save(settings.notified_file)
+
+    failed = [result.name for result in results if not result.ok]
+    if failed:
+        # the changes are reported again next time
+        raise SinkError(f'Failed sending to {", ".join(failed)}')
+
+    if changes_only:
+        get_snapshot_store(settings.snapshot_file).save(snapshot)
+
+
+def get_changes(
+    source: Source,
+) -> Tuple['SnapshotDiff', 'Snapshot']:
+    """
+    Changes of the critical objects since the last snapshot, and the new
+    snapshot
+
+    Silenced objects are included to know what was acknowledged since the
+    last run, and the objects behind an upstream problem are not
+    suppressed: the snapshot holds every critical object of the scope.
+    """
+    from pynagiosreport.snapshot import Snapshot, diff
+    hosts_filters, filters = get_filters(
+        source, False, True, CriticalCounts(), CriticalCounts())
+    objects = [
+        *source.get_critical_hosts(False, filters=hosts_filters),
+        *source.get_critical_services(False, filters=filters)]
+    store = get_snapshot_store(settings.snapshot_file)
+    return diff(store.load(), objects), Snapshot.from_objects(objects)
+
+
+def get_sink(
+    name: str,
+    send: Callable[[], None],
+) -> 'Sink':
+    """
+    Sink with its deadline from the settings
+    """
+    from pynagiosreport.dispatch import Sink
+    return Sink(
+        name, send, settings.sink_deadlines.get(name, settings.sink_deadline))
@@ -0,0 +1,88 @@
+'''
+..  codeauthor:: Charles Blais
+
+Reports run from a single fetch of the critical objects
+
+The reports file is a JSON list of report definitions::
+
+    [
+        {"name": "network", "emails": ["noc@example.com"],
+         "settings": {"hostgroups": ["routers"], "max_report_hosts": 50}},
+        {"name": "databases", "emails": ["dba@example.com"],
+         "changes_only": ["email"],
+         "settings": {"filter": "host_name ~ '^db'", "rave_url": null,
+                      "status_template": "databases.html.j2"}}
+    ]
+
+The settings of a report are any of pynagiosreport.config.AppSettings;
+they replace the global settings while the report runs.  Recipients and
+sinks are the options of the command line.
+'''
+import logging
+
+from pathlib import Path
+
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, parse_file_as, validator
+
+from .config import AppSettings
+
+from .storage import FileCache
+
+
+class ReportDefinition(BaseModel):
+    name: str
+    emails: List[str] = []
+    stdout: bool = False
+    allow_empty_email: bool = False
+    allow_empty_rave: bool = False
+    changes_only: List[str] = []
+    settings: Dict[str, Any] = {}
+
+    @validator('changes_only', each_item=True)
+    def check_sink(cls, value):
+        if value not in ('email', 'rave'):
+            raise ValueError(f'unknown sink {value}')
+        return value
+
+    @validator('settings')
+    def check_settings(cls, values):
+        '''
+        Convert the settings to their type in AppSettings
+        '''
+        converted = {}
+        for name, value in values.items():
+            field = AppSettings.__fields__.get(name)
+            if field is None:
+                raise ValueError(f'unknown setting {name}')
+            converted[name], errors = field.validate(value, {}, loc=name)
+            if errors:
+                raise ValueError(f'invalid setting {name}: {value!r}')
+        return converted
+
+    @property
+    def overrides(self) -> Dict[str, Any]:
+        '''
+        Settings changed while the report runs
+        '''
+        return {'report_name': self.name, **self.settings}
+
+
+# reports already loaded by this process
+_reports: FileCache[List[ReportDefinition]] = FileCache()
+
+
+def load_reports(filename: Path) -> List[ReportDefinition]:
+    '''
+    Load the report definitions, reused while the file does not change
+    '''
+    def load() -> List[ReportDefinition]:
+        reports = parse_file_as(List[ReportDefinition], filename)
+        names = [report.name for report in reports]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Duplicate report names in {filename}')
+        logging.info(f'Loaded {len(reports)} reports from {filename}')
+        return reports
+
+    return _reports.get([filename], load)
@@ -0,0 +1,307 @@
+'''
+..  codeauthor:: Charles Blais
+
+Route the critical objects to the recipients responsible for them
+
+The routing file is a JSON list of rules::
+
+    [
+        {"emails": ["dba@example.com"], "hosts": ["re:^db"],
+         "services": ["re:^MySQL"]},
+        {"emails": ["noc@example.com"], "hostgroups": ["routers"]}
+    ]
+
+A rule matches a host if one of its hosts (exact name or re:regex
+searched in the name) or hostgroups does; it matches a service if its
+host matches, or if one of its services matches the service
+description.  Each recipient gets the objects of every rule listing it.
+
+The objects can also be routed to the emails of their contacts in
+objects.cache, indexed with the other objects definitions.
+
+The rules are compiled into an index: exact names in a hash, the
+expressions combined into one alternation that rejects most names in a
+single search.  The recipients of each host and service description are
+memoized, so every record is routed once and added to the report of
+each of its recipients in the same pass.
+'''
+import logging
+
+import re
+
+from pathlib import Path
+
+from typing import \
+    Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, \
+    Tuple
+
+from pydantic import BaseModel, parse_file_as
+
+from .filters import combine_patterns, compile_pattern
+
+from .grouping import GroupBy
+
+from .models import CriticalCounts
+
+from .nagios.objects import ObjectsIndex, service_key
+
+from .nagios.record import Record
+
+from .nagios.selection import ReportOrder, Selection
+
+from .storage import FileCache
+
+
+class RoutingRule(BaseModel):
+    emails: List[str]
+    hosts: List[str] = []
+    hostgroups: List[str] = []
+    services: List[str] = []
+
+
+class NameIndex:
+    '''
+    Recipients of exact names and of re: expressions
+    '''
+    def __init__(self) -> None:
+        self.names: Dict[str, Set[str]] = {}
+        self.patterns: List[Tuple['re.Pattern[str]', FrozenSet[str]]] = []
+        self.search: Optional[Callable] = None
+
+    def add(self, name: str, emails: Iterable[str], origin: str) -> None:
+        '''
+        :param origin: rule defining the name, named in the errors
+        '''
+        if name.startswith('re:'):
+            self.patterns.append(
+                (compile_pattern(name[3:], origin), frozenset(emails)))
+        else:
+            self.names.setdefault(name, set()).update(emails)
+
+    def compile(self) -> None:
+        self.search = combine_patterns([p for p, _ in self.patterns])
+
+    def get(self, name: str) -> Set[str]:
+        emails = set(self.names.get(name, ()))
+        # only the names matching one of the expressions are searched
+        # by each of them
+        if self.search is not None and self.search(name):
+            for pattern, pattern_emails in self.patterns:
+                if pattern.search(name):
+                    emails.update(pattern_emails)
+        return emails
+
+
+class RoutingIndex:
+    '''
+    Compiled routing rules
+
+    :param origin: where the rules are defined, named in the errors
+    '''
+    def __init__(
+        self,
+        rules: Iterable[RoutingRule],
+        origin: str = 'routing rules',
+    ):
+        self.emails: Set[str] = set()
+        self.hosts = NameIndex()
+        self.services = NameIndex()
+        self.hostgroups: Dict[str, Set[str]] = {}
+        for number, rule in enumerate(rules, 1):
+            self.emails.update(rule.emails)
+            for name in rule.hosts:
+                self.hosts.add(name, rule.emails, f'{origin} rule {number}')
+            for name in rule.services:
+                self.services.add(
+                    name, rule.emails, f'{origin} rule {number}')
+            for name in rule.hostgroups:
+                self.hostgroups.setdefault(name, set()).update(rule.emails)
+        self.hosts.compile()
+        self.services.compile()
+
+    def get_host(
+        self,
+        host_name: str,
+        hostgroups: Iterable[str] = (),
+    ) -> FrozenSet[str]:
+        '''
+        Recipients of a host and of its services
+
+        :param hostgroups: hostgroups of the host
+        '''
+        emails = self.hosts.get(host_name)
+        for name in hostgroups:
+            emails.update(self.hostgroups.get(name, ()))
+        return frozenset(emails)
+
+    def get_service(self, service_description: str) -> FrozenSet[str]:
+        '''
+        Recipients of a service whatever its host
+        '''
+        return frozenset(self.services.get(service_description))
+
+
+# recipients of a record
+Router = Callable[[Record], FrozenSet[str]]
+
+
+def get_rules_router(
+    routing: RoutingIndex,
+    hostgroups: Optional[Dict[str, List[str]]] = None,
+) -> Router:
+    '''
+    Recipients of the records by the routing rules, memoized by host and
+    by service description
+
+    :param hostgroups: hostgroups of each host, needed by the hostgroup
+        rules
+    '''
+    hostgroups = hostgroups or {}
+    by_host: Dict[str, FrozenSet[str]] = {}
+    by_service: Dict[str, FrozenSet[str]] = {}
+
+    def get_recipients(record: Record) -> FrozenSet[str]:
+        emails = by_host.get(record.host_name)
+        if emails is None:
+            emails = by_host[record.host_name] = routing.get_host(
+                record.host_name, hostgroups.get(record.host_name, ()))
+        if not record.service_description:
+            return emails
+        service_emails = by_service.get(record.service_description)
+        if service_emails is None:
+            service_emails = by_service[record.service_description] = \
+                routing.get_service(record.service_description)
+        return emails | service_emails
+
+    return get_recipients
+
+
+def get_contacts_router(index: ObjectsIndex) -> Router:
+    '''
+    Recipients of the records by the contacts of the hosts and services
+    in objects.cache
+    '''
+    def get_recipients(record: Record) -> FrozenSet[str]:
+        key = (
+            service_key(record.host_name, record.service_description)
+            if record.service_description else record.host_name)
+        return frozenset(index.contacts.get(key, ()))
+
+    return get_recipients
+
+
+def get_contacts_emails(index: ObjectsIndex) -> Set[str]:
+    '''
+    Emails of every contact of a host or service
+    '''
+    return {email for emails in index.contacts.values() for email in emails}
+
+
+class RoutedReport(NamedTuple):
+    hosts: List[Record]
+    services: List[Record]
+    hosts_counts: CriticalCounts
+    services_counts: CriticalCounts
+
+
+class Routes:
+    '''
+    Reports of each recipient built while the source is filtered
+
+    The add_host and add_service methods are filters accepting every
+    record; put last, they see the records reported.
+
+    Only the records displayed to each recipient are kept, the first ones
+    in the report order; the others are counted.
+
+    :param emails: every recipient, those without objects get empty
+        reports
+    :param routers: recipients of a record, the union is used
+    :param group_by: grouping of the counts of each recipient
+    :param order: report order
+    :param max_hosts: hosts displayed to each recipient, None for all
+    :param max_services: services displayed to each recipient, None for
+        all
+    '''
+    def __init__(
+        self,
+        emails: Iterable[str],
+        routers: Iterable[Router],
+        group_by: Optional[GroupBy] = None,
+        order: ReportOrder = ReportOrder.oldest,
+        max_hosts: Optional[int] = None,
+        max_services: Optional[int] = None,
+    ):
+        self.emails = frozenset(emails)
+        self.routers = list(routers)
+        self.hosts: Dict[str, Selection[Record]] = {
+            email: Selection(order, max_hosts) for email in self.emails}
+        self.services: Dict[str, Selection[Record]] = {
+            email: Selection(order, max_services) for email in self.emails}
+        self.hosts_counts = {
+            email: CriticalCounts(group_by=group_by)
+            for email in self.emails}
+        self.services_counts = {
+            email: CriticalCounts(group_by=group_by)
+            for email in self.emails}
+
+    def get_recipients(self, record: Record) -> FrozenSet[str]:
+        if len(self.routers) == 1:
+            return self.routers[0](record)
+        return frozenset().union(*(
+            get_recipients(record) for get_recipients in self.routers))
+
+    def add_host(self, record: Record) -> bool:
+        for email in self.get_recipients(record):
+            self.hosts[email].add(record, record)
+            self.hosts_counts[email].add(record)
+        return True
+
+    def add_service(self, record: Record) -> bool:
+        for email in self.get_recipients(record):
+            self.services[email].add(record, record)
+            self.services_counts[email].add(record)
+        return True
+
+    def get_reports(
+        self,
+        services_by_host: Optional[Dict[str, int]] = None,
+    ) -> Dict[str, RoutedReport]:
+        '''
+        Records displayed to each recipient, the first ones in the report
+        order
+
+        :param services_by_host: services collapsed on the host lines
+        '''
+        reports: Dict[str, RoutedReport] = {}
+        for email in sorted(self.emails):
+            hosts_counts = self.hosts_counts[email]
+            if services_by_host:
+                hosts_counts.services_by_host = {
+                    name: count for name, count in services_by_host.items()
+                    if name in hosts_counts.by_host}
+            reports[email] = RoutedReport(
+                self.hosts[email].items,
+                self.services[email].items,
+                hosts_counts,
+                self.services_counts[email])
+        return reports
+
+
+# rules already compiled by this process
+_routings: FileCache[RoutingIndex] = FileCache()
+
+
+def load_routing(filename: Path) -> RoutingIndex:
+    '''
+    Compile the routing rules, reused while the file does not change
+    '''
+    def load() -> RoutingIndex:
+        rules = parse_file_as(List[RoutingRule], filename)
+        routing = RoutingIndex(rules, str(filename))
+        logging.info(
+            f'Compiled {len(rules)} routing rules to '
+            f'{len(routing.emails)} recipients')
+        return routing
+
+    return _routings.get([filename], load)
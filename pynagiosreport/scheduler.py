@@ -0,0 +1,94 @@
+'''
+..  codeauthor:: Charles Blais
+
+Scheduler of the jobs run by the daemon
+
+Jobs are kept in a heap by their next run time.  A job that fails is
+logged and run again at its next time; a job that takes longer than its
+interval is not run twice in a row to catch up.
+'''
+import heapq
+
+import logging
+
+import threading
+
+import time
+
+from typing import Callable, List, Optional, Tuple
+
+
+class Job:
+    '''
+    Function run every interval seconds
+
+    :param name: name of the job in the logs
+    :param interval: seconds between the start of two runs
+    :param func: function run
+    '''
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        func: Callable[[], None],
+    ):
+        if interval <= 0:
+            raise ValueError(f'Interval of {name} must be positive')
+        self.name = name
+        self.interval = interval
+        self.func = func
+
+    def run(self) -> None:
+        logging.info(f'Running {self.name}')
+        start = time.monotonic()
+        try:
+            self.func()
+        except Exception:
+            logging.exception(f'{self.name} failed, retrying next time')
+        logging.info(
+            f'{self.name} done in {time.monotonic() - start:.3f} seconds')
+
+
+class Scheduler:
+    '''
+    Run jobs on their interval until stopped
+    '''
+    def __init__(self) -> None:
+        # next run time, order added (ties), job
+        self.queue: List[Tuple[float, int, Job]] = []
+        self.stopped = threading.Event()
+
+    def add(
+        self,
+        job: Job,
+        start: Optional[float] = None,
+    ) -> None:
+        '''
+        Schedule a job
+
+        :param start: monotonic time of the first run, now by default
+        '''
+        heapq.heappush(self.queue, (
+            time.monotonic() if start is None else start,
+            len(self.queue),
+            job))
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def run(self) -> None:
+        '''
+        Run the jobs as they come due until stop is called
+        '''
+        while self.queue and not self.stopped.is_set():
+            due, order, job = self.queue[0]
+            if self.stopped.wait(max(0, due - time.monotonic())):
+                break
+            heapq.heappop(self.queue)
+            job.run()
+            # skip the runs missed while the job was running
+            now = time.monotonic()
+            due += job.interval
+            if due < now:
+                due += ((now - due) // job.interval + 1) * job.interval
+            heapq.heappush(self.queue, (due, order, job))
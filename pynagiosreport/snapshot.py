@@ -0,0 +1,199 @@
+'''
+..  codeauthor:: Charles Blais
+
+Keep a snapshot of the critical hosts/services between runs and compare
+consecutive snapshots so that only what changed is reported.
+
+Objects are keyed by (host_name, service_description), the service
+description being empty for hosts.  Both snapshots are indexed in a
+dictionary so the comparison is done in a single pass over each of them.
+'''
+import logging
+
+import datetime
+
+from pathlib import Path
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .models import StatusObject
+
+from .nagios.statusfile import StatusFile
+
+from .storage import write_atomic
+
+
+Key = Tuple[str, str]
+
+
+def get_key(obj: StatusObject) -> Key:
+    '''
+    Unique key of a host or service status object
+    '''
+    return (obj.host_name, getattr(obj, 'service_description', ''))
+
+
+def get_name(key: Key) -> str:
+    '''
+    Display name of a key, host or host/service
+    '''
+    host_name, service_description = key
+    if service_description:
+        return f'{host_name}/{service_description}'
+    return host_name
+
+
+class SnapshotEntry(BaseModel):
+    host_name: str
+    service_description: str = ''
+    current_state: int
+    acknowledged: bool = False
+
+    @property
+    def key(self) -> Key:
+        return (self.host_name, self.service_description)
+
+    @property
+    def name(self) -> str:
+        return get_name(self.key)
+
+
+class Snapshot(BaseModel):
+    created: datetime.datetime
+    entries: List[SnapshotEntry] = []
+
+    @classmethod
+    def from_objects(cls, objects: Iterable[StatusObject]) -> 'Snapshot':
+        '''
+        Create a snapshot of the critical objects
+
+        Objects that are silenced (acknowledged, in downtime or with
+        notifications disabled) are kept in the snapshot but flagged as
+        acknowledged.
+        '''
+        return cls(
+            created=datetime.datetime.utcnow(),
+            entries=[SnapshotEntry(
+                host_name=obj.host_name,
+                service_description=getattr(obj, 'service_description', ''),
+                current_state=obj.current_state,
+                acknowledged=not StatusFile.is_unchecked(obj),
+            ) for obj in objects])
+
+    @classmethod
+    def load(cls, filename: Path) -> Optional['Snapshot']:
+        '''
+        Load the snapshot saved by a previous run, None if there is none
+        '''
+        if not filename.exists():
+            logging.info(f'No previous snapshot found in {filename}')
+            return None
+        try:
+            return cls.parse_file(filename)
+        except ValueError as err:
+            logging.warning(f'Ignoring invalid snapshot {filename}: {err}')
+            return None
+
+    def save(self, filename: Path) -> None:
+        '''
+        Save the snapshot atomically for the next run
+        '''
+        write_atomic(filename, self.json())
+
+    def index(self) -> Dict[Key, SnapshotEntry]:
+        return {entry.key: entry for entry in self.entries}
+
+
+class SnapshotStore:
+    '''
+    Last snapshot of a file, kept in memory between the reports of a
+    long running process so it is only read once
+
+    :param filename: snapshot file
+    '''
+    def __init__(self, filename: Path):
+        self.filename = filename
+        self.snapshot: Optional[Snapshot] = None
+        self.loaded = False
+
+    def load(self) -> Optional[Snapshot]:
+        if not self.loaded:
+            self.snapshot = Snapshot.load(self.filename)
+            self.loaded = True
+        return self.snapshot
+
+    def save(self, snapshot: Snapshot) -> None:
+        snapshot.save(self.filename)
+        self.snapshot = snapshot
+        self.loaded = True
+
+
+class SnapshotDiff:
+    '''
+    Classification of the current critical objects against the previous
+    snapshot
+
+    - new: not alerting in the previous snapshot or its state changed
+    - still: alerting in both snapshots with the same state
+    - acknowledged: alerting previously, now silenced
+    - resolved: in the previous snapshot, no longer critical
+    '''
+    def __init__(self) -> None:
+        self.new: List[StatusObject] = []
+        self.still: List[StatusObject] = []
+        self.acknowledged: List[StatusObject] = []
+        self.resolved: List[SnapshotEntry] = []
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.new or self.acknowledged or self.resolved)
+
+    @property
+    def resolved_names(self) -> List[str]:
+        return [entry.name for entry in self.resolved]
+
+    @property
+    def acknowledged_names(self) -> List[str]:
+        return [get_name(get_key(obj)) for obj in self.acknowledged]
+
+
+def diff(
+    previous: Optional[Snapshot],
+    objects: Iterable[StatusObject],
+) -> SnapshotDiff:
+    '''
+    Compare the current critical objects (silenced included) with the
+    previous snapshot
+
+    When there is no previous snapshot, every alerting object is new.
+    '''
+    index = previous.index() if previous is not None else {}
+    result = SnapshotDiff()
+    seen = set()
+
+    for obj in objects:
+        key = get_key(obj)
+        seen.add(key)
+        before = index.get(key)
+        alerting = StatusFile.is_unchecked(obj)
+        if not alerting:
+            if before is not None and not before.acknowledged:
+                result.acknowledged.append(obj)
+        elif (
+            before is None or
+            before.acknowledged or
+            before.current_state != obj.current_state
+        ):
+            result.new.append(obj)
+        else:
+            result.still.append(obj)
+
+    result.resolved = [
+        entry for key, entry in index.items() if key not in seen]
+    logging.info(
+        f'Snapshot diff: {len(result.new)} new, {len(result.still)} still, '
+        f'{len(result.acknowledged)} acknowledged, '
+        f'{len(result.resolved)} resolved')
+    return result
@@ -0,0 +1,69 @@
+'''
+..  codeauthor:: Charles Blais
+
+Files read and written between the runs
+
+Configuration files (ignore lists, calendars, reports, routing rules,
+objects.cache) are loaded once per process and reused while they keep
+the same identity: path, modification time and size.  State files
+(snapshots, checkpoints, indexes) are written to a temporary file then
+renamed, so a reader sees either the previous or the new content.
+'''
+import os
+
+from pathlib import Path
+
+from typing import Callable, Dict, Generic, Sequence, Tuple, TypeVar, Union
+
+
+T = TypeVar('T')
+
+Filename = Union[str, Path]
+
+
+def get_identity(filenames: Sequence[Filename]) -> Tuple[int, ...]:
+    '''
+    Modification time and size of every file
+    '''
+    identity: Tuple[int, ...] = ()
+    for filename in filenames:
+        stat = os.stat(filename)
+        identity += (stat.st_mtime_ns, stat.st_size)
+    return identity
+
+
+class FileCache(Generic[T]):
+    '''
+    Objects loaded from files, each reused while its files do not change
+    '''
+    def __init__(self) -> None:
+        # paths -> identity of the files when loaded and the object
+        self.loaded: Dict[Tuple[str, ...], Tuple[Tuple[int, ...], T]] = {}
+
+    def get(self, filenames: Sequence[Filename], load: Callable[[], T]) -> T:
+        '''
+        Object of the files, loaded again if one of them changed
+
+        :param load: loads the object from the files
+        '''
+        paths = tuple(str(filename) for filename in filenames)
+        identity = get_identity(filenames)
+        loaded = self.loaded.get(paths)
+        if loaded is not None and loaded[0] == identity:
+            return loaded[1]
+        value = load()
+        self.loaded[paths] = (identity, value)
+        return value
+
+    def clear(self) -> None:
+        self.loaded.clear()
+
+
+def write_atomic(filename: Path, text: str) -> None:
+    '''
+    Replace the content of a file in a single rename
+    '''
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    tmp = filename.with_name(f'.{filename.name}.{os.getpid()}.tmp')
+    tmp.write_text(text)
+    tmp.replace(filename)
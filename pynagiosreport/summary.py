@@ -0,0 +1,114 @@
+'''
+..  codeauthor:: Charles Blais
+
+Summary of the critical objects for dashboards
+
+The records of the sources are streamed into running counters, no
+status object is converted, so the summary stays cheap on large
+installations.
+'''
+import datetime
+
+from typing import Dict, Iterable, Optional
+
+from pydantic import BaseModel
+
+from .nagios.objects import ObjectsIndex
+
+from .nagios.record import Record, RecordFilter
+
+
+HOST_STATES = {1: 'DOWN', 2: 'UNREACHABLE'}
+SERVICE_STATES = {2: 'CRITICAL', 3: 'UNKNOWN'}
+
+
+class SummaryCount(BaseModel):
+    count: int = 0
+    # seconds since the oldest problem changed state
+    oldest_age: int = 0
+
+    def add(self, age: int) -> None:
+        self.count += 1
+        self.oldest_age = max(self.oldest_age, age)
+
+
+def add_to(counts: Dict[str, SummaryCount], key: str, age: int) -> None:
+    count = counts.get(key)
+    if count is None:
+        count = counts[key] = SummaryCount()
+    count.add(age)
+
+
+class KindSummary(BaseModel):
+    total: SummaryCount = SummaryCount()
+    by_state: Dict[str, SummaryCount] = {}
+    # unchecked, acknowledged or downtime
+    by_status: Dict[str, SummaryCount] = {}
+    by_host: Dict[str, SummaryCount] = {}
+    by_hostgroup: Dict[str, SummaryCount] = {}
+    by_check_command: Dict[str, SummaryCount] = {}
+
+    def add(
+        self,
+        record: Record,
+        age: int,
+        hostgroups: Iterable[str] = (),
+    ) -> None:
+        self.total.add(age)
+        states = SERVICE_STATES if record.service_description else HOST_STATES
+        add_to(
+            self.by_state,
+            states.get(record.current_state, str(record.current_state)),
+            age)
+        if record.downtime:
+            add_to(self.by_status, 'downtime', age)
+        elif record.acknowledged:
+            add_to(self.by_status, 'acknowledged', age)
+        else:
+            add_to(self.by_status, 'unchecked', age)
+        add_to(self.by_host, record.host_name, age)
+        for hostgroup in hostgroups:
+            add_to(self.by_hostgroup, hostgroup, age)
+        # arguments are separated by !
+        add_to(self.by_check_command, record.check_command.split('!', 1)[0],
+               age)
+
+
+class Summary(BaseModel):
+    created: datetime.datetime
+    hosts: KindSummary = KindSummary()
+    services: KindSummary = KindSummary()
+
+
+def summarize(
+    hosts: Iterable[Record],
+    services: Iterable[Record],
+    index: Optional[ObjectsIndex] = None,
+    filters: Iterable[RecordFilter] = (),
+    now: Optional[datetime.datetime] = None,
+) -> Summary:
+    '''
+    Count the critical hosts and services
+
+    :param hosts: records of the critical hosts, silenced included
+    :param services: records of the critical services, silenced included
+    :param index: index of the hostgroup members, no count by hostgroup
+        without it
+    :param filters: only the records accepted by every filter are counted
+    '''
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    summary = Summary(created=now)
+    epoch = int(now.timestamp())
+    filters = list(filters)
+    for records, counts in (
+        (hosts, summary.hosts),
+        (services, summary.services),
+    ):
+        for record in records:
+            if not all(accept(record) for accept in filters):
+                continue
+            counts.add(
+                record,
+                max(0, epoch - record.last_state_change),
+                index.hostgroups.get(record.host_name, ()) if index else ())
+    return summary
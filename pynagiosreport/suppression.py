@@ -0,0 +1,190 @@
+'''
+..  codeauthor:: Charles Blais
+
+Suppression stages applied to the critical records before they are
+counted and reported
+'''
+import time
+
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set
+
+from .nagios.objects import ObjectsIndex, service_key
+
+from .nagios.record import Record
+
+if TYPE_CHECKING:
+    from .maintenance import MaintenanceCalendar
+
+
+# what the objects in a maintenance window are suppressed behind
+MAINTENANCE = 'maintenance windows'
+
+
+class HostCollapse:
+    '''
+    Fold the services of critical hosts into a count on their host line
+
+    The names of the critical hosts are indexed in a set so each service
+    is checked in constant time, O(hosts + services) overall.
+
+    :param host_names: critical hosts, as reported
+    :param services_by_host: filled with the number of services folded
+        per host
+    '''
+    def __init__(
+        self,
+        host_names: Iterable[str],
+        services_by_host: Dict[str, int],
+    ):
+        self.host_names = set(host_names)
+        self.services_by_host = services_by_host
+
+    def __call__(self, record: Record) -> bool:
+        if record.host_name not in self.host_names:
+            return True
+        self.services_by_host[record.host_name] = (
+            self.services_by_host.get(record.host_name, 0) + 1)
+        return False
+
+
+class Topology:
+    '''
+    Suppress the objects behind an upstream problem already reported
+
+    UNREACHABLE hosts with a critical ancestor (host parents), the
+    services of those hosts and the services depending on a critical
+    service (servicedependency) are not reported.  The ancestors and
+    masters are found by walking the adjacency lists of the objects.cache
+    index; the walk from each object is done once per report.  An object
+    is suppressed behind its topmost critical ancestor or master, the one
+    reported, not behind another suppressed object.
+
+    :param index: index of objects.cache
+    :param host_names: critical hosts, as reported
+    :param service_keys: critical services, as reported, see
+        :func:`pynagiosreport.nagios.objects.service_key`
+    :param suppressed: filled with the number of objects suppressed per
+        upstream object
+    '''
+    def __init__(
+        self,
+        index: ObjectsIndex,
+        host_names: Iterable[str],
+        service_keys: Iterable[str],
+        suppressed: Dict[str, int],
+    ):
+        self.index = index
+        self.host_names = set(host_names)
+        self.service_keys = set(service_keys)
+        self.suppressed = suppressed
+        self._upstream: Dict[str, Optional[str]] = {}
+
+    @staticmethod
+    def _find(
+        start: str,
+        adjacency: Dict[str, List[str]],
+        critical: Set[str],
+    ) -> Optional[str]:
+        '''
+        First critical object reachable from start, start excluded
+        '''
+        seen = {start}
+        stack = list(adjacency.get(start, ()))
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            if node in critical:
+                return node
+            seen.add(node)
+            stack.extend(adjacency.get(node, ()))
+        return None
+
+    @staticmethod
+    def _find_top(
+        start: str,
+        adjacency: Dict[str, List[str]],
+        critical: Set[str],
+    ) -> Optional[str]:
+        '''
+        Topmost critical object reachable from start through critical
+        objects, start excluded
+        '''
+        top = None
+        seen = {start}
+        node = Topology._find(start, adjacency, critical)
+        while node is not None and node not in seen:
+            top = node
+            seen.add(node)
+            node = Topology._find(node, adjacency, critical)
+        return top
+
+    def _upstream_host(self, host_name: str) -> Optional[str]:
+        if host_name not in self._upstream:
+            self._upstream[host_name] = Topology._find_top(
+                host_name, self.index.parents, self.host_names)
+        return self._upstream[host_name]
+
+    def get_upstream(self, record: Record) -> Optional[str]:
+        '''
+        Name of the upstream problem explaining the record, if any
+        '''
+        if not record.service_description:
+            if record.current_state != 2:
+                return None
+            return self._upstream_host(record.host_name)
+
+        if record.host_name in self.host_names:
+            upstream = self._upstream_host(record.host_name)
+            if upstream is not None:
+                return upstream
+        master = Topology._find_top(
+            service_key(record.host_name, record.service_description),
+            self.index.service_dependencies, self.service_keys)
+        return master.replace(';', '/', 1) if master is not None else None
+
+    def __call__(self, record: Record) -> bool:
+        upstream = self.get_upstream(record)
+        if upstream is None:
+            return True
+        self.suppressed[upstream] = self.suppressed.get(upstream, 0) + 1
+        return False
+
+
+class Maintenance:
+    '''
+    Suppress the hosts, and their services, in a maintenance window of
+    the external calendar
+
+    The windows are checked at the time of the report, once per host.
+
+    :param calendar: maintenance windows
+    :param index: index of the hostgroup members, needed for the windows
+        of hostgroups
+    :param suppressed: filled with the number of objects suppressed
+    :param now: time of the report, epoch
+    '''
+    def __init__(
+        self,
+        calendar: 'MaintenanceCalendar',
+        index: Optional[ObjectsIndex],
+        suppressed: Dict[str, int],
+        now: Optional[float] = None,
+    ):
+        self.calendar = calendar
+        self.index = index
+        self.suppressed = suppressed
+        self.now = time.time() if now is None else now
+        self._active: Dict[str, bool] = {}
+
+    def __call__(self, record: Record) -> bool:
+        active = self._active.get(record.host_name)
+        if active is None:
+            active = self._active[record.host_name] = self.calendar.is_active(
+                self.now, record.host_name,
+                self.index.hostgroups.get(record.host_name, ())
+                if self.index else ())
+        if not active:
+            return True
+        self.suppressed[MAINTENANCE] = self.suppressed.get(MAINTENANCE, 0) + 1
+        return False
@@ -0,0 +1,175 @@
+'''
+..  codeauthor:: Charles Blais
+
+Watch the status.dat file for rewrites
+
+Nagios writes the status to a temporary file and atomically renames it
+over status.dat.  The directory holding the file is watched with inotify
+for that rename (or a close after write for in-place writers), bursts of
+events are debounced and a rewrite is only reported when a different
+file actually landed.
+
+When inotify is not available (non Linux hosts), the file is polled.
+'''
+import logging
+
+import os
+
+import select
+
+import struct
+
+import time
+
+import ctypes
+
+import ctypes.util
+
+from pathlib import Path
+
+from typing import Iterator, Optional, Tuple
+
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('iIII')
+
+FileIdentity = Tuple[int, int, int]
+
+
+def get_identity(filename: Path) -> Optional[FileIdentity]:
+    '''
+    Identity of the file on disk (inode, mtime, size), None if missing
+    '''
+    try:
+        stat = filename.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class StatusFileWatcher:
+    '''
+    Wait for new versions of status.dat to land
+
+    :param filename: status.dat file to watch
+    :param debounce: seconds without event before considering the file
+        written
+    :param poll_interval: seconds between checks if inotify is not
+        available
+    '''
+    def __init__(
+        self,
+        filename: str,
+        debounce: float = 1.0,
+        poll_interval: float = 10.0,
+    ):
+        self.filename = Path(filename)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.identity = get_identity(self.filename)
+        self.fd: Optional[int] = self._init_inotify()
+
+    def _init_inotify(self) -> Optional[int]:
+        libname = ctypes.util.find_library('c')
+        try:
+            libc = ctypes.CDLL(libname, use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError):
+            logging.info('inotify not available, polling status file')
+            return None
+
+        fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logging.warning(
+                f'inotify_init failed: {os.strerror(ctypes.get_errno())}')
+            return None
+        directory = str(self.filename.parent).encode()
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if inotify_add_watch(fd, directory, mask) < 0:
+            logging.warning(
+                f'inotify_add_watch failed on {self.filename.parent}: '
+                f'{os.strerror(ctypes.get_errno())}')
+            os.close(fd)
+            return None
+        logging.info(f'Watching {self.filename.parent} with inotify')
+        return fd
+
+    def _read_events(self, timeout: Optional[float]) -> bool:
+        '''
+        Read pending inotify events, True if one touched the status file
+        '''
+        assert self.fd is not None
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        touched = False
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode()
+            offset += length
+            if mask & IN_Q_OVERFLOW or name == self.filename.name:
+                touched = True
+        return touched
+
+    def _changed(self) -> bool:
+        '''
+        Check if a different file landed since the last call
+        '''
+        identity = get_identity(self.filename)
+        if identity is None or identity == self.identity:
+            return False
+        self.identity = identity
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        '''
+        Wait for a new status file to land
+
+        :param timeout: maximum seconds to wait, None waits forever
+        :returns: True if a new file landed, False on timeout
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = (
+                None if deadline is None
+                else max(0.0, deadline - time.monotonic()))
+            if self.fd is None:
+                time.sleep(
+                    self.poll_interval if remaining is None
+                    else min(self.poll_interval, remaining))
+                if self._changed():
+                    return True
+            elif self._read_events(remaining):
+                # wait for the burst of events to settle
+                while self._read_events(self.debounce):
+                    pass
+                if self._changed():
+                    return True
+                logging.debug('status file events without a new file')
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def __iter__(self) -> Iterator[Path]:
+        while True:
+            if self.wait():
+                yield self.filename
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,124 @@
+"""
+..  codeauthor:: Charles Blais
+
+Shared fixtures generating a small status.dat
+"""
+from pathlib import Path
+
+from typing import Dict
+
+import pytest
+
+
+HOST_DEFAULTS: Dict[str, str] = {
+    'modified_attributes': '0',
+    'check_command': 'check-host-alive',
+    'check_period': '24x7',
+    'notification_period': '24x7',
+    'importance': '0',
+    'check_interval': '5.000000',
+    'retry_interval': '1.000000',
+    'event_handler': '',
+    'has_been_checked': '1',
+    'should_be_scheduled': '1',
+    'check_execution_time': '0.011',
+    'check_latency': '0.002',
+    'check_type': '0',
+    'current_state': '0',
+    'last_hard_state': '0',
+    'last_event_id': '0',
+    'current_event_id': '0',
+    'current_problem_id': '0',
+    'last_problem_id': '0',
+    'plugin_output': 'PING OK',
+    'long_plugin_output': '',
+    'performance_data': '',
+    'last_check': '1650000000',
+    'next_check': '1650000300',
+    'check_options': '0',
+    'current_attempt': '1',
+    'max_attempts': '3',
+    'state_type': '1',
+    'last_state_change': '1640000000',
+    'last_hard_state_change': '1640000000',
+    'last_time_up': '1650000000',
+    'last_time_down': '0',
+    'last_time_unreachable': '0',
+    'last_notification': '0',
+    'next_notification': '0',
+    'no_more_notifications': '0',
+    'current_notification_number': '0',
+    'current_notification_id': '0',
+    'notifications_enabled': '1',
+    'problem_has_been_acknowledged': '0',
+    'acknowledgement_type': '0',
+    'active_checks_enabled': '1',
+    'passive_checks_enabled': '1',
+    'event_handler_enabled': '1',
+    'flap_detection_enabled': '1',
+    'process_performance_data': '1',
+    'obsess': '1',
+    'last_update': '1650000000',
+    'is_flapping': '0',
+    'percent_state_change': '0.00',
+    'scheduled_downtime_depth': '0',
+}
+
+SERVICE_DEFAULTS: Dict[str, str] = {
+    **{
+        key: value for key, value in HOST_DEFAULTS.items()
+        if not key.startswith('last_time_')
+    },
+    'check_command': 'check_ping',
+    'last_time_ok': '1650000000',
+    'last_time_warning': '0',
+    'last_time_unknown': '0',
+    'last_time_critical': '0',
+}
+
+
+def block(kind: str, **attributes: str) -> str:
+    '''
+    Generate a status.dat block using the default attributes
+    '''
+    defaults = HOST_DEFAULTS if kind == 'hoststatus' else SERVICE_DEFAULTS
+    values = {**defaults, **attributes}
+    lines = [f'\t{key}={value}' for key, value in values.items()]
+    return f'{kind} {{\n' + '\n'.join(lines) + '\n\t}\n\n'
+
+
+def write_status(path: Path, *blocks: str) -> Path:
+    path.write_text(
+        '# NAGIOS STATE RETENTION FILE\n\n'
+        'info {\n\tcreated=1650000000\n\tversion=4.4.6\n\t}\n\n' +
+        ''.join(blocks))
+    return path
+
+
+@pytest.fixture
+def status_dat(tmp_path: Path) -> Path:
+    return write_status(
+        tmp_path.joinpath('status.dat'),
+        block('hoststatus', host_name='web1'),
+        block(
+            'hoststatus', host_name='db1', current_state='1',
+            current_attempt='3', plugin_output='PING CRITICAL',
+            last_state_change='1649990000'),
+        block(
+            'servicestatus', host_name='web1', service_description='HTTP',
+            current_state='2', current_attempt='3',
+            plugin_output='HTTP CRITICAL - 500 after 12 seconds',
+            last_state_change='1649995000'),
+        block(
+            'servicestatus', host_name='web1', service_description='Disk',
+            current_state='3', current_attempt='3',
+            plugin_output='UNKNOWN - disk', last_state_change='1649999000'),
+        block(
+            'servicestatus', host_name='db1', service_description='MySQL',
+            current_state='2', current_attempt='3',
+            problem_has_been_acknowledged='1',
+            plugin_output='MySQL CRITICAL'),
+        block(
+            'servicestatus', host_name='db1', service_description='Load',
+            current_state='0'),
+    )
@@ -0,0 +1,13 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from pathlib import Path
+
+from pynagiosreport.config import AppSettings
+
+
+def test_templates_env(tmp_path: Path):
+    settings = AppSettings(state_dir=str(tmp_path))
+    assert settings.j2_templates_env is settings.j2_templates_env
+    assert settings.j2_status_template is settings.j2_status_template
+    assert list(settings.template_cache_dir.iterdir())
@@ -0,0 +1,118 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import smtplib
+
+import threading
+
+from email.mime.text import MIMEText
+
+from typing import List, Tuple
+
+import pytest
+
+from pynagiosreport import email
+
+from pynagiosreport.delivery import Delivery, SMTPPool, chunk
+
+
+class FakeSMTP:
+    '''
+    SMTP connection recording what it sends
+    '''
+    connections: List['FakeSMTP'] = []
+    sent: List[Tuple[str, List[str]]] = []
+    lock = threading.Lock()
+
+    def __init__(self, host: str, port: int = 0, timeout: float = 0):
+        self.timeout = timeout
+        self.tls = False
+        self.closed = False
+        with self.lock:
+            FakeSMTP.connections.append(self)
+
+    def starttls(self):
+        self.tls = True
+
+    def sendmail(self, sender: str, recipients: List[str], msg: str):
+        if 'bounce@example.com' in recipients:
+            raise smtplib.SMTPRecipientsRefused({})
+        with self.lock:
+            FakeSMTP.sent.append((sender, recipients))
+
+    def noop(self):
+        return (250, b'OK')
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch: pytest.MonkeyPatch):
+    FakeSMTP.connections = []
+    FakeSMTP.sent = []
+    monkeypatch.setattr(smtplib, 'SMTP', FakeSMTP)
+
+
+def message() -> MIMEText:
+    msg = MIMEText('report')
+    msg['From'] = 'nagios@example.com'
+    return msg
+
+
+def test_chunk():
+    assert chunk(['a', 'b', 'c'], 2) == [['a', 'b'], ['c']]
+    assert chunk(['a', 'b', 'c'], 0) == [['a', 'b', 'c']]
+
+
+def test_delivery(fake_smtp):
+    pool = SMTPPool('mailhost', size=2, timeout=5, starttls=True)
+    delivery = Delivery(pool, concurrency=2, max_recipients=2)
+    sent = delivery.send([
+        (message(), [f'user{i}@example.com' for i in range(5)]),
+        (message(), ['noc@example.com']),
+    ])
+    assert sent == 2
+    assert sorted(len(recipients) for _, recipients in FakeSMTP.sent) == [
+        1, 1, 2, 2]
+    assert 1 <= len(FakeSMTP.connections) <= 2
+    assert all(smtp.tls and smtp.timeout == 5
+               for smtp in FakeSMTP.connections)
+
+    # the connections are reused by the next messages
+    delivery.send([(message(), ['noc@example.com'])])
+    assert len(FakeSMTP.connections) <= 2
+    pool.close()
+    assert all(smtp.closed for smtp in FakeSMTP.connections)
+
+
+def test_delivery_failure(fake_smtp):
+    delivery = Delivery(SMTPPool('mailhost', size=1))
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        delivery.send([
+            (message(), ['bounce@example.com']),
+            (message(), ['noc@example.com']),
+        ])
+    # the other message was still sent, the failed connection dropped
+    assert FakeSMTP.sent == [('nagios@example.com', ['noc@example.com'])]
+    assert FakeSMTP.connections[0].closed
+
+
+def test_get_delivery(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(email, '_deliveries', {})
+    barrier = threading.Barrier(8)
+    deliveries = []
+
+    def get():
+        barrier.wait()
+        deliveries.append(email.get_delivery())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(delivery) for delivery in deliveries}) == 1
@@ -0,0 +1,30 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import threading
+
+from pynagiosreport.dispatch import Sink, dispatch
+
+
+def test_dispatch():
+    release = threading.Event()
+    sent = []
+
+    def fail():
+        raise ConnectionError('SMTP down')
+
+    results = dispatch([
+        Sink('email', lambda: release.wait(5), 0.2),
+        Sink('smtp', fail, 1),
+        Sink('rave', lambda: sent.append('rave'), 1),
+    ])
+    release.set()
+
+    assert [r.name for r in results] == ['email', 'smtp', 'rave']
+    email, smtp, rave = results
+    assert not email.ok and 'deadline' in (email.error or '')
+    assert email.latency >= 0.2
+    assert not smtp.ok and 'SMTP down' in (smtp.error or '')
+    assert rave.ok and rave.latency < 0.2
+    assert sent == ['rave']
+    assert dispatch([]) == []
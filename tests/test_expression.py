@@ -0,0 +1,89 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import time
+
+from pathlib import Path
+
+import pytest
+
+from pynagiosreport.exceptions import FilterSyntaxError
+
+from pynagiosreport.nagios.expression import Expression
+
+from pynagiosreport.nagios.record import Record
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+
+def record(**fields) -> Record:
+    values = dict(
+        host_name='db1', service_description='MySQL', current_state=2,
+        last_state_change=int(time.time()) - 3600, check_command='check',
+        output='CRITICAL', acknowledged=False, downtime=False)
+    values.update(fields)
+    return Record(**values)
+
+
+def test_expression():
+    expression = Expression(
+        "host_name ~ '^db' and current_state == 2 and "
+        "last_state_change < now-15m")
+    assert expression(record())
+    assert not expression(record(host_name='web1'))
+    assert not expression(record(current_state=3))
+    assert not expression(record(last_state_change=int(time.time())))
+
+    expression = Expression(
+        "not (acknowledged == true or downtime == true) and "
+        "output !~ 'timed out'")
+    assert expression(record())
+    assert not expression(record(downtime=True))
+    assert not expression(record(output='CRITICAL - timed out'))
+
+
+@pytest.mark.parametrize('text', [
+    "host_name == 2",
+    "state == 2",
+    "current_state ~ '2'",
+    "(current_state == 2",
+    "current_state == 2 current_state == 3",
+])
+def test_syntax_error(text: str):
+    with pytest.raises(FilterSyntaxError):
+        Expression(text)
+
+
+def test_params():
+    expression = Expression(
+        "host_name ~ '^db' and current_state != 3 and acknowledged == false")
+    assert expression.get_params(
+        'servicestatus', {'current_state': 'in:2,3'}
+    ) == {
+        'current_state': 'in:2',
+        'host_name': 'lk:db',
+        'problem_acknowledged': '0',
+    }
+    # only the top level conjunction is translated
+    expression = Expression("host_name == 'db1' or current_state == 2")
+    assert expression.get_params(
+        'servicestatus', {'current_state': 'in:2,3'}
+    ) == {'current_state': 'in:2,3'}
+
+
+def test_params_hoststatus():
+    # hosts have no service column, the clause is only applied locally
+    expression = Expression(
+        "host_name == 'db1' and service_description != 'HTTP'")
+    assert expression.get_params(
+        'hoststatus', {'current_state': 'in:1,2'}
+    ) == {'current_state': 'in:1,2', 'host_name': 'db1'}
+    assert expression.get_params('servicestatus', {}) == {
+        'host_name': 'db1', 'service_description': 'ne:HTTP'}
+
+
+def test_status_file(status_dat: Path):
+    status = StatusFile(status_dat)
+    services = status.get_critical_services(
+        filters=[Expression("output ~ 'HTTP'")])
+    assert [s.service_description for s in services] == ['HTTP']
@@ -0,0 +1,85 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from pathlib import Path
+
+import pytest
+
+from pynagiosreport.filters import GroupMembership, load_ignore_list
+
+from pynagiosreport.nagios.objects import load_index
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+
+OBJECTS_CACHE = '''
+define hostgroup {
+\thostgroup_name\tdatabases
+\tmembers\tdb1
+\t}
+
+define servicegroup {
+\tservicegroup_name\tweb
+\tmembers\tweb1,HTTP,db1,MySQL
+\t}
+
+define servicegroup {
+\tservicegroup_name\tfrontend
+\tmembers\tweb1,HTTP
+\t}
+'''
+
+
+def test_group_membership(status_dat: Path, tmp_path: Path):
+    objects_cache = tmp_path / 'objects.cache'
+    objects_cache.write_text(OBJECTS_CACHE)
+    index = load_index(objects_cache)
+    assert index.hostgroups == {'db1': ['databases']}
+    assert index.servicegroups == {
+        'web1;HTTP': ['web', 'frontend'], 'db1;MySQL': ['web']}
+    status = StatusFile(status_dat)
+
+    databases = [GroupMembership(index, hostgroups=['databases'])]
+    assert [h.host_name for h in status.get_critical_hosts(
+        filters=databases)] == ['db1']
+    assert status.get_critical_services(filters=databases) == []
+    assert [s.service_description for s in status.get_critical_services(
+        unchecked=False, filters=databases)] == ['MySQL']
+
+    web = [GroupMembership(index, servicegroups=['web'])]
+    assert [s.service_description for s in status.get_critical_services(
+        filters=web)] == ['HTTP']
+    assert [h.host_name for h in status.get_critical_hosts(
+        filters=web)] == ['db1']
+
+    # only the hosts of the services in the servicegroups
+    frontend = [GroupMembership(index, servicegroups=['frontend'])]
+    assert status.get_critical_hosts(filters=frontend) == []
+    both = [GroupMembership(index, ['databases'], ['frontend'])]
+    assert [h.host_name for h in status.get_critical_hosts(
+        filters=both)] == ['db1']
+
+
+def test_ignore_list(status_dat: Path, tmp_path: Path):
+    ignore_file = tmp_path / 'ignore.txt'
+    ignore_file.write_text('# maintenance\ndb1\nre:/Dis[k]$\n')
+    ignore_list = load_ignore_list([str(ignore_file)])
+    assert load_ignore_list([str(ignore_file)]) is ignore_list
+    status = StatusFile(status_dat)
+
+    assert status.get_critical_hosts(filters=[ignore_list]) == []
+    assert [s.service_description for s in status.get_critical_services(
+        unchecked=False, filters=[ignore_list])] == ['HTTP']
+
+
+def test_ignore_list_flags(status_dat: Path, tmp_path: Path):
+    ignore_file = tmp_path / 'ignore.txt'
+    ignore_file.write_text('re:(?i)^DB\nre:HTTP$\n')
+    ignore_list = load_ignore_list([str(ignore_file)])
+    status = StatusFile(status_dat)
+    assert [s.service_description for s in status.get_critical_services(
+        unchecked=False, filters=[ignore_list])] == ['Disk']
+
+    ignore_file.write_text('web1\n# typo\nre:^(db\n')
+    with pytest.raises(ValueError, match='ignore.txt:3'):
+        load_ignore_list([str(ignore_file)])
@@ -0,0 +1,87 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from pathlib import Path
+
+import pytest
+
+from pynagiosreport import email
+
+from pynagiosreport.fingerprint import Fingerprint, NotifiedState
+
+from pynagiosreport.nagios.record import Record
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.report import report, settings
+
+from .conftest import block, write_status
+
+
+RECORDS = [
+    Record('db1', '', 1, 0, 'check-host-alive', 'down', False, False),
+    Record('web1', 'HTTP', 2, 0, 'check_http', '500', False, False),
+    Record('web1', 'Disk', 3, 0, 'check_disk', '?', False, False),
+]
+
+
+def get_fingerprint(records) -> str:
+    fingerprint = Fingerprint()
+    assert all(fingerprint.add(record) for record in records)
+    return fingerprint.value
+
+
+def test_fingerprint():
+    value = get_fingerprint(RECORDS)
+    assert get_fingerprint(reversed(RECORDS)) == value
+    # the output does not matter, the state does
+    assert get_fingerprint(
+        [RECORDS[0]._replace(output='timeout'), *RECORDS[1:]]) == value
+    assert get_fingerprint(
+        [RECORDS[0]._replace(current_state=2), *RECORDS[1:]]) != value
+    assert get_fingerprint(RECORDS[1:]) != value
+
+
+def test_notified_state(tmp_path: Path):
+    filename = tmp_path / 'notified.json'
+    state = NotifiedState.load(filename)
+    assert state.next_notification('rave', 'a', 3600) is None
+
+    state.sent('rave', 'a', 1000)
+    state.save(filename)
+    state = NotifiedState.load(filename)
+    assert state.next_notification('rave', 'b', 3600) is None
+    assert state.next_notification('rave', 'a', 3600) == 4600
+    # reminders after the first notification, then the interval
+    assert state.next_notification('rave', 'a', 3600, [600, 1800]) == 1600
+    state.sent('rave', 'a', 1600)
+    assert state.next_notification('rave', 'a', 3600, [600, 1800]) == 2800
+    state.sent('rave', 'a', 2800)
+    assert state.next_notification('rave', 'a', 3600, [600, 1800]) == 6400
+    assert state.sinks['rave'].first_sent == 1000
+
+
+def test_recurrence(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    status_dat = tmp_path / 'status.dat'
+    host = block('hoststatus', host_name='web1')
+    critical = block(
+        'servicestatus', host_name='web1', service_description='HTTP',
+        current_state='2', current_attempt='3')
+    recovered = block(
+        'servicestatus', host_name='web1', service_description='HTTP')
+    sent = []
+    monkeypatch.setattr(
+        email, 'send',
+        lambda hosts, services, *args, **kwargs: sent.append(len(services)))
+
+    with settings.override({
+        'state_dir': str(tmp_path),
+        'renotify_interval': 3600,
+    }):
+        # notified once, then again when the problem comes back
+        for service in (critical, critical, recovered, critical):
+            write_status(status_dat, host, service)
+            report(
+                StatusFile(status_dat), ['noc@example.com'], False, False,
+                False, [])
+    assert sent == [1, 1]
@@ -0,0 +1,57 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import csv
+
+import io
+
+import json
+
+from pathlib import Path
+
+import pytest
+
+from pynagiosreport.formats import OutputFormat, RecordWriter, write_records
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+
+def test_json(status_dat: Path):
+    status = StatusFile(status_dat)
+    fp = io.StringIO()
+    assert write_records(
+        status.iter_service_records(), OutputFormat.json, fp) == 2
+    records = json.loads(fp.getvalue())
+    assert [r['service_description'] for r in records] == ['HTTP', 'Disk']
+
+
+def test_ndjson(status_dat: Path):
+    status = StatusFile(status_dat)
+    fp = io.StringIO()
+    write_records(status.iter_service_records(), OutputFormat.ndjson, fp)
+    lines = fp.getvalue().splitlines()
+    assert json.loads(lines[1])['output'] == 'UNKNOWN - disk'
+
+
+def test_csv(status_dat: Path):
+    status = StatusFile(status_dat)
+    fp = io.StringIO()
+    write_records(status.iter_host_records(), OutputFormat.csv, fp)
+    rows = list(csv.DictReader(io.StringIO(fp.getvalue())))
+    assert rows[0]['host_name'] == 'db1'
+
+
+@pytest.mark.parametrize('output_format', list(OutputFormat))
+def test_empty(output_format: OutputFormat):
+    fp = io.StringIO()
+    assert write_records([], output_format, fp) == 0
+    if output_format == OutputFormat.json:
+        assert json.loads(fp.getvalue()) == []
+
+
+def test_incomplete_writer():
+    class NoWrite(RecordWriter):
+        pass
+
+    with pytest.raises(TypeError):
+        NoWrite(io.StringIO())  # type: ignore
@@ -0,0 +1,49 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from pathlib import Path
+
+from pynagiosreport.grouping import GroupBy, normalize_output
+
+from pynagiosreport.models import CriticalCounts
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from .conftest import block, write_status
+
+
+def test_normalize_output():
+    assert normalize_output(
+        'CRITICAL - 10.0.0.1: rta 2000.5ms, lost 100%'
+    ) == 'CRITICAL - #: rta #ms, lost #%'
+
+
+def test_storm(tmp_path: Path):
+    status_dat = write_status(tmp_path.joinpath('status.dat'), *[
+        block(
+            'servicestatus', host_name=f'host{i}', service_description='PING',
+            current_state='2', current_attempt='3',
+            check_command=f'check_ping!{i}',
+            plugin_output=f'PING CRITICAL - Packet loss = {50 + i % 50}%')
+        for i in range(150)
+    ], block(
+        'servicestatus', host_name='db1', service_description='MySQL',
+        current_state='2', current_attempt='3', check_command='check_mysql',
+        plugin_output='Connection refused'))
+
+    counts = CriticalCounts(group_by=GroupBy.output)
+    services = StatusFile(status_dat).get_critical_services(
+        limit=20, counts=counts)
+    assert len(services) == 20
+    assert counts.total == 151
+    assert counts.get_groups(1000) == []
+    groups = counts.get_groups(100)
+    assert [(g.key, g.count) for g in groups] == [
+        ('PING CRITICAL - Packet loss = #%', 150),
+        ('Connection refused', 1),
+    ]
+    assert groups[1].example == 'db1/MySQL'
+
+    counts = CriticalCounts(group_by=GroupBy.check_command)
+    StatusFile(status_dat).get_critical_services(limit=0, counts=counts)
+    assert counts.by_group['check_ping'].count == 150
@@ -0,0 +1,40 @@
+"""
+..  codeauthor:: Charles Blais
+
+Startup cost of the CLI, measured with python -X importtime
+"""
+import subprocess
+
+import sys
+
+from typing import Dict
+
+
+# only imported when the backend or sink is selected
+LAZY_MODULES = ('requests', 'jinja2', 'pyravealert', 'smtplib', 'ctypes')
+
+
+def get_import_times(module: str) -> Dict[str, int]:
+    '''
+    Cumulative import time in microseconds of every module imported
+    '''
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True)
+    times: Dict[str, int] = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_imports():
+    times = get_import_times('pynagiosreport.bin.nagios_report')
+    print(
+        'pynagiosreport.bin.nagios_report imported in '
+        f'{times["pynagiosreport.bin.nagios_report"] / 1000:.1f} ms')
+    assert not [
+        name for name in times
+        if name.split('.')[0] in LAZY_MODULES]
@@ -0,0 +1,55 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import json
+
+from pathlib import Path
+
+from pynagiosreport.maintenance import MaintenanceCalendar, \
+    MaintenanceWindow, load_calendar
+
+from pynagiosreport.models import CriticalCounts
+
+from pynagiosreport.nagios.objects import ObjectsIndex
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.suppression import MAINTENANCE, Maintenance
+
+
+def window(start: int, end: int, **target) -> MaintenanceWindow:
+    return MaintenanceWindow(start=start, end=end, **target)
+
+
+def test_calendar():
+    calendar = MaintenanceCalendar([
+        window(100, 200, host_name='db1'),
+        window(150, 300, host_name='db1'),
+        window(500, 600, host_name='db1'),
+        window(100, 200, hostgroup_name='routers'),
+    ])
+    assert calendar.hosts['db1'].starts == [100, 500]
+    assert calendar.is_active(250, 'db1')
+    assert not calendar.is_active(300, 'db1')
+    assert not calendar.is_active(50, 'db1')
+    assert calendar.is_active(550, 'db1')
+    assert not calendar.is_active(150, 'web1')
+    assert calendar.is_active(150, 'web1', ['routers'])
+
+
+def test_maintenance(status_dat: Path, tmp_path: Path):
+    maintenance_file = tmp_path / 'maintenance.json'
+    maintenance_file.write_text(json.dumps([
+        {'hostgroup_name': 'databases', 'start': 1650000000,
+         'end': 1650003600},
+    ]))
+    calendar = load_calendar(maintenance_file)
+    index = ObjectsIndex(hostgroups={'db1': ['databases']})
+    status = StatusFile(status_dat)
+    counts = CriticalCounts()
+
+    hosts = status.get_critical_hosts(
+        counts=counts,
+        filters=[Maintenance(calendar, index, counts.suppressed, 1650000060)])
+    assert hosts == []
+    assert counts.suppressed == {MAINTENANCE: 1}
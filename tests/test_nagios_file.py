@@ -4,6 +4,8 @@
 
 import pytest
 
+from pynagiosreport.models import CriticalCounts
+
 from pynagiosreport.nagios.statusfile import StatusFile
 
 
@@ -22,3 +24,45 @@ def test_services(status: StatusFile):
     response = status.get_critical_services()
     print(response)
     assert len(response) != 0
+
+
+def test_block_cache(status_dat):
+    status = StatusFile(status_dat, cache=True)
+    first = status.get_critical_services()
+    assert len(first) == 2
+
+    # nothing changed, the objects are reused
+    second = status.get_critical_services()
+    assert [id(s) for s in second] == [id(s) for s in first]
+
+    # only volatile attributes changed, they are refreshed
+    status_dat.write_text(
+        status_dat.read_text().replace('last_update=1650000000',
+                                       'last_update=1650000600'))
+    second = status.get_critical_services()
+    assert [s.plugin_output for s in second] == [
+        s.plugin_output for s in first]
+    assert all(
+        int(s.last_update.timestamp()) == 1650000600 for s in second)
+    assert [
+        raw['last_update'] for raw in status.iter_blocks('servicestatus')
+    ] == ['1650000600'] * 4
+    first = second
+
+    status_dat.write_text(
+        status_dat.read_text().replace('UNKNOWN - disk', 'UNKNOWN - gone'))
+    third = status.get_critical_services()
+    assert third[0] is first[0]
+    assert third[1] is not first[1]
+    assert third[1].plugin_output == 'UNKNOWN - gone'
+
+
+def test_limit(status_dat):
+    counts = CriticalCounts()
+    response = StatusFile(status_dat).get_critical_services(
+        limit=1, counts=counts)
+    # oldest problem first
+    assert [s.service_description for s in response] == ['HTTP']
+    assert counts.total == 2
+    assert counts.by_state == {2: 1, 3: 1}
+    assert counts.by_host == {'web1': 2}
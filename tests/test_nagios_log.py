@@ -0,0 +1,132 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import os
+
+from pathlib import Path
+
+import pytest
+
+from pynagiosreport.nagios.logfile import CriticalState
+
+
+@pytest.fixture
+def log_file(tmp_path: Path) -> Path:
+    filename = tmp_path.joinpath('nagios.log')
+    filename.write_text(
+        '[1640000000] SERVICE ALERT: web1;HTTP;CRITICAL;HARD;3;old line\n')
+    return filename
+
+
+def append(filename: Path, *lines: str):
+    with open(filename, 'a') as fp:
+        fp.write(''.join(line + '\n' for line in lines))
+
+
+def test_bootstrap(status_dat: Path, log_file: Path):
+    state = CriticalState(str(status_dat), str(log_file))
+    assert [h.host_name for h in state.get_critical_hosts()] == ['db1']
+    assert len(state.get_critical_services()) == 2
+    assert len(state.get_critical_services(unchecked=False)) == 3
+
+
+def test_update(status_dat: Path, log_file: Path, tmp_path: Path):
+    checkpoint = tmp_path.joinpath('checkpoint')
+    state = CriticalState(str(status_dat), str(log_file), checkpoint)
+    append(
+        log_file,
+        '[1650000010] SERVICE ALERT: web1;HTTP;OK;HARD;3;HTTP OK',
+        '[1650000011] SERVICE ALERT: web1;Disk;CRITICAL;SOFT;1;DISK 99%',
+        '[1650000012] SERVICE ALERT: web1;Disk;CRITICAL;HARD;3;DISK 99%',
+        '[1650000013] SERVICE ALERT: db1;Load;CRITICAL;HARD;3;LOAD 40',
+        '[1650000014] EXTERNAL COMMAND: ACKNOWLEDGE_HOST_PROBLEM;db1;1;1;1;'
+        'admin;working on it',
+        '[1650000015] HOST DOWNTIME ALERT: web1;STARTED; Host has entered',
+    )
+    assert state.update() == 5
+    services = {
+        s.service_description: s for s in state.get_critical_services()}
+    assert sorted(services) == ['Disk', 'Load']
+    assert services['Disk'].current_state == 2
+    assert services['Disk'].plugin_output == 'DISK 99%'
+    assert services['Load'].current_state == 2
+    assert state.get_critical_hosts() == []
+    assert state.downtimes == {('web1', ''): 1}
+    state.close()
+    assert checkpoint.exists()
+
+
+def test_restart(status_dat: Path, log_file: Path, tmp_path: Path):
+    checkpoint = tmp_path.joinpath('checkpoint')
+    state = CriticalState(str(status_dat), str(log_file), checkpoint)
+    state.close()
+    # the checkpoint is before status.dat was written, resume from it
+    assert state._load_checkpoint(1650000000) == log_file.stat().st_size
+
+    # recovery logged after status.dat, then the process restarts
+    state = CriticalState(str(status_dat), str(log_file), checkpoint)
+    append(
+        log_file, '[1650000010] SERVICE ALERT: web1;HTTP;OK;HARD;3;HTTP OK')
+    assert state.update() == 1
+    state.close()
+    state = CriticalState(str(status_dat), str(log_file), checkpoint)
+    assert 'HTTP' not in {
+        s.service_description
+        for s in state.get_critical_services(unchecked=False)}
+
+
+def test_rotation(status_dat: Path, log_file: Path):
+    state = CriticalState(str(status_dat), str(log_file))
+    append(log_file, '[1650000010] HOST ALERT: db1;UP;HARD;1;PING OK')
+    os.rename(log_file, log_file.with_name('nagios-archive.log'))
+    append(
+        log_file,
+        '[1650000020] SERVICE ALERT: web1;HTTP;OK;HARD;3;HTTP OK')
+    assert state.update() == 2
+    assert state.get_critical_hosts(unchecked=False) == []
+    assert [
+        s.service_description for s in state.get_critical_services()
+    ] == ['Disk']
+
+
+def test_acknowledgements(status_dat: Path, log_file: Path):
+    state = CriticalState(str(status_dat), str(log_file))
+    append(
+        log_file,
+        '[1650000010] EXTERNAL COMMAND: ACKNOWLEDGE_SVC_PROBLEM;web1;HTTP;2;'
+        '1;1;admin;sticky',
+        '[1650000011] EXTERNAL COMMAND: ACKNOWLEDGE_SVC_PROBLEM;web1;Disk;1;'
+        '1;1;admin;normal',
+    )
+    state.update()
+
+    def acknowledged():
+        return {
+            s.service_description: s.acknowledgement_type
+            for s in state.get_critical_services(unchecked=False)
+            if s.problem_has_been_acknowledged}
+
+    assert acknowledged() == {'HTTP': 2, 'Disk': 1, 'MySQL': 0}
+
+    # a state change only keeps the sticky acknowledgements
+    append(
+        log_file,
+        '[1650000020] SERVICE ALERT: web1;HTTP;UNKNOWN;HARD;3;timeout',
+        '[1650000021] SERVICE ALERT: web1;Disk;CRITICAL;HARD;3;DISK 99%',
+        '[1650000022] SERVICE ALERT: db1;MySQL;CRITICAL;HARD;3;MySQL down',
+    )
+    state.update()
+    assert acknowledged() == {'HTTP': 2, 'MySQL': 0}
+
+    # a recovery removes every acknowledgement, even if the object is read
+    # again from a status.dat written before the recovery
+    append(
+        log_file,
+        '[1650000030] SERVICE ALERT: web1;HTTP;OK;HARD;3;HTTP OK',
+        '[1650000031] SERVICE ALERT: web1;HTTP;CRITICAL;HARD;3;HTTP 500',
+        '[1650000032] SERVICE ALERT: db1;MySQL;OK;HARD;3;MySQL OK',
+        '[1650000033] SERVICE ALERT: db1;MySQL;CRITICAL;HARD;3;MySQL down',
+    )
+    state.update()
+    assert acknowledged() == {}
+    assert len(state.get_critical_services()) == 3
@@ -0,0 +1,99 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from pathlib import Path
+
+from typing import List, Optional
+
+import pytest
+
+from pynagiosreport import email, rave
+
+from pynagiosreport.config import get_app_settings
+
+from pynagiosreport.exceptions import SinkError
+
+from pynagiosreport.outbox import Outbox, OutboxEntry, get_outbox
+
+from pynagiosreport.snapshot import SnapshotDiff
+
+
+def test_dedup(tmp_path: Path):
+    outbox = Outbox(tmp_path / 'outbox')
+    outbox.put('rave', 'rave:noc', {'headline': 'first'})
+    outbox.put('rave', 'rave:dba', {'headline': 'dba'})
+    outbox.put('rave', 'rave:noc', {'headline': 'second'})
+    outbox.put('email', 'email:noc', {'message': ''})
+
+    entries = [entry for _, entry in outbox.entries('rave')]
+    assert [e.payload['headline'] for e in entries] == ['dba', 'second']
+    assert not list(outbox.tmp_dir.iterdir())
+
+    outbox.put('rave', 'rave:noc', {'headline': 'third'}, replace=False)
+    entries = [entry for _, entry in outbox.entries('rave')]
+    assert [e.payload['headline'] for e in entries] == [
+        'dba', 'second', 'third']
+
+
+def test_drain(tmp_path: Path):
+    outbox = Outbox(tmp_path / 'outbox', max_attempts=2, batch=2)
+    for index in range(3):
+        outbox.put('email', f'email:{index}', {'index': index})
+    batches: List[List[int]] = []
+
+    def send(entries: List[OutboxEntry]) -> List[Optional[Exception]]:
+        batches.append([e.payload['index'] for e in entries])
+        return [
+            ConnectionError('refused') if e.payload['index'] == 1 else None
+            for e in entries]
+
+    assert outbox.drain('email', send) == 2
+    assert batches == [[0, 1], [2]]
+    (path, entry), = outbox.entries('email')
+    assert entry.attempts == 1 and entry.next_attempt > entry.created
+
+    # not due yet
+    assert outbox.drain('email', send) == 0
+    assert len(batches) == 2
+
+    entry.next_attempt = 0
+    outbox.write(path, entry)
+    assert outbox.drain('email', send) == 0
+    assert outbox.entries('email') == []
+    assert [p.name for p in outbox.failed_dir.iterdir()] == [path.name]
+    assert not outbox.delivered(path)
+
+
+def test_drain_report(tmp_path: Path):
+    outbox = Outbox(tmp_path / 'outbox')
+    network = outbox.put(
+        'email', 'email:network:noc', {'index': 0}, report='network')
+    default = outbox.put('email', 'email::noc', {'index': 1})
+    assert outbox.reports('email') == {'network', None}
+
+    # only the notifications of the report are sent with its settings
+    assert outbox.drain(
+        'email', lambda entries: [None] * len(entries), 'network') == 1
+    assert outbox.delivered(network) and not outbox.delivered(default)
+    assert outbox.reports('email') == {None}
+
+
+def test_spooled_changes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    settings = get_app_settings()
+    monkeypatch.setattr(email, 'drain', lambda settings: 0)
+    monkeypatch.setattr(rave, 'drain', lambda settings: 0)
+    with settings.override({
+        'state_dir': str(tmp_path),
+        'outbox': True,
+        'rave_url': 'https://rave.example.com',
+    }):
+        # every delta of the changes is kept, only the latest summary;
+        # the sink fails while its notification is kept for a retry
+        for changes in (SnapshotDiff(), SnapshotDiff(), None, None):
+            with pytest.raises(SinkError):
+                email.send([], [], ['noc@example.com'], changes)
+            with pytest.raises(SinkError):
+                rave.send([], [], changes)
+        outbox = get_outbox()
+        assert len(outbox.entries('email')) == 3
+        assert len(outbox.entries('rave')) == 3
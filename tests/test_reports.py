@@ -0,0 +1,139 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import json
+
+import threading
+
+from pathlib import Path
+
+import pytest
+
+from pydantic import ValidationError
+
+from pynagiosreport import email
+
+from pynagiosreport.nagios.selection import ReportOrder
+
+from pynagiosreport.nagios.shared import SharedSource
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.outbox import get_outbox
+
+from pynagiosreport.report import drain_outbox, run_reports, settings
+
+from pynagiosreport.reports import ReportDefinition, load_reports
+
+
+def test_definition():
+    definition = ReportDefinition.parse_obj({
+        'name': 'network',
+        'emails': ['noc@example.com'],
+        'settings': {'max_report_hosts': '5', 'report_order': 'newest'},
+    })
+    assert definition.overrides == {
+        'report_name': 'network',
+        'max_report_hosts': 5,
+        'report_order': ReportOrder.newest,
+    }
+    with pytest.raises(ValidationError):
+        ReportDefinition.parse_obj({'name': 'a', 'settings': {'bogus': 1}})
+    with pytest.raises(ValidationError):
+        ReportDefinition.parse_obj({'name': 'a', 'changes_only': ['fax']})
+
+
+def test_shared_source(status_dat: Path):
+    status = StatusFile(status_dat)
+    shared = SharedSource(status)
+    # only the objects selected are converted
+    assert shared.converted == {}
+    assert len(shared.get_critical_services(unchecked=False, limit=1)) == 1
+    assert list(shared.converted) == [('db1', 'MySQL')]
+    assert shared.get_critical_hosts() == status.get_critical_hosts()
+    assert shared.get_critical_services(unchecked=False) == \
+        status.get_critical_services(unchecked=False)
+    assert list(shared.iter_service_records()) == \
+        list(status.iter_service_records())
+
+
+def test_run_reports(
+    status_dat: Path,
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture,
+):
+    reports_file = tmp_path / 'reports.json'
+    reports_file.write_text(json.dumps([
+        {'name': 'all', 'stdout': True},
+        {'name': 'databases', 'stdout': True,
+         'settings': {'filter': "host_name ~ '^db'"}},
+    ]))
+    assert [r.name for r in load_reports(reports_file)] == [
+        'all', 'databases']
+    assert load_reports(reports_file) is load_reports(reports_file)
+
+    run_reports(StatusFile(status_dat), reports_file)
+    all_report, databases_report = capsys.readouterr().out.split(
+        'The following hosts', 2)[1:]
+    assert 'web1' in all_report
+    assert 'web1' not in databases_report
+    assert settings.filter is None
+    assert settings.report_name is None
+
+
+def test_late_sink(
+    status_dat: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    reports_file = tmp_path / 'reports.json'
+    reports_file.write_text(json.dumps([{
+        'name': 'network',
+        'emails': ['noc@example.com'],
+        'settings': {'email_subject': 'Network', 'sink_deadline': 0.1},
+    }]))
+    release = threading.Event()
+    subjects = []
+
+    def deliver(messages, report_settings, replace):
+        subjects.extend(msg['Subject'] for msg, _ in messages)
+        release.wait(5)
+        subjects.append(report_settings.email_subject)
+
+    monkeypatch.setattr(email, 'deliver', deliver)
+    threads = set(threading.enumerate())
+    run_reports(StatusFile(status_dat), reports_file)
+    assert settings.report_name is None
+    # the late email is sent with the settings of its report
+    release.set()
+    for thread in set(threading.enumerate()) - threads:
+        thread.join(5)
+    assert subjects == ['Network', 'Network']
+
+
+def test_drain_outbox(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    reports_file = tmp_path / 'reports.json'
+    reports_file.write_text(json.dumps([{
+        'name': 'network',
+        'settings': {'smtp_server': 'smtp.network.example.com'},
+    }]))
+    servers = []
+
+    def send_spooled(entries, report_settings):
+        servers.extend(
+            (e.report, report_settings.smtp_server) for e in entries)
+        return [None] * len(entries)
+
+    monkeypatch.setattr(email, 'send_spooled', send_spooled)
+    with settings.override({
+        'state_dir': str(tmp_path),
+        'reports_file': str(reports_file),
+        'smtp_server': 'smtp.example.com',
+    }):
+        outbox = get_outbox()
+        outbox.put('email', 'email:noc', {}, report='network')
+        outbox.put('email', 'email:all', {})
+        drain_outbox()
+    assert sorted(servers, key=str) == [
+        ('network', 'smtp.network.example.com'), (None, 'smtp.example.com')]
+    assert outbox.entries('email') == []
@@ -0,0 +1,179 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from pathlib import Path
+
+import pytest
+
+from pynagiosreport import email
+
+from pynagiosreport.models import CriticalCounts
+
+from pynagiosreport.nagios.objects import load_index
+
+from pynagiosreport.nagios.record import Record
+
+from pynagiosreport.nagios.selection import ReportOrder
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.report import report, settings
+
+from pynagiosreport.routing import \
+    Routes, RoutingIndex, RoutingRule, get_contacts_emails, \
+    get_contacts_router, get_rules_router, load_routing
+
+
+RULES = [
+    RoutingRule(emails=['dba@example.com'], hosts=['re:^db']),
+    RoutingRule(emails=['web@example.com'], hosts=['web1'],
+                services=['re:^MySQL$']),
+    RoutingRule(emails=['noc@example.com'], hostgroups=['routers']),
+]
+
+
+def test_routing_index():
+    routing = RoutingIndex(RULES)
+    assert routing.emails == {
+        'dba@example.com', 'web@example.com', 'noc@example.com'}
+    assert routing.get_host('db2') == {'dba@example.com'}
+    assert routing.get_host('web1') == {'web@example.com'}
+    assert routing.get_host('rtr1', ['routers']) == {'noc@example.com'}
+    assert routing.get_host('mail1') == set()
+    assert routing.get_service('MySQL') == {'web@example.com'}
+    assert routing.get_service('MySQL slave') == set()
+
+
+def test_routing_flags():
+    routing = RoutingIndex([
+        RoutingRule(emails=['dba@example.com'], hosts=['re:(?i)^DB']),
+        RoutingRule(emails=['web@example.com'], hosts=['re:^web']),
+    ])
+    assert routing.get_host('db1') == {'dba@example.com'}
+    assert routing.get_host('web1') == {'web@example.com'}
+
+    with pytest.raises(ValueError, match='rule 2'):
+        RoutingIndex([
+            RoutingRule(emails=['dba@example.com'], hosts=['re:^db']),
+            RoutingRule(emails=['web@example.com'], services=['re:(']),
+        ])
+
+
+def test_routes(status_dat: Path):
+    status = StatusFile(status_dat)
+    routing = RoutingIndex(RULES)
+    routes = Routes(
+        routing.emails, [get_rules_router(routing)], None,
+        ReportOrder.oldest, 20, 1)
+    hosts_counts = CriticalCounts()
+    status.get_critical_hosts(
+        counts=hosts_counts, filters=[routes.add_host])
+    status.get_critical_services(
+        unchecked=False, filters=[routes.add_service])
+
+    reports = routes.get_reports({'db1': 2})
+    assert [r.name for r in reports['dba@example.com'].hosts] == ['db1']
+    assert [r.name for r in reports['dba@example.com'].services] == [
+        'db1/MySQL']
+    assert reports['dba@example.com'].hosts_counts.services_by_host == {
+        'db1': 2}
+    # the oldest of web1/HTTP, web1/Disk and db1/MySQL within the limit,
+    # only it is kept
+    assert [r.name for r in reports['web@example.com'].services] == [
+        'db1/MySQL']
+    assert len(routes.services['web@example.com'].heap) == 1
+    assert reports['web@example.com'].services_counts.total == 3
+    assert reports['noc@example.com'].hosts == []
+
+
+def test_load_routing(tmp_path: Path):
+    routing_file = tmp_path / 'routing.json'
+    routing_file.write_text(
+        '[{"emails": ["noc@example.com"], "hosts": ["re:."]}]')
+    routing = load_routing(routing_file)
+    assert load_routing(routing_file) is routing
+    assert routing.get_host('any') == {'noc@example.com'}
+
+
+OBJECTS_CACHE = '''
+define host {
+\thost_name\tdb1
+\tcontacts\tdba
+\tcontact_groups\tadmins
+\t}
+
+define service {
+\thost_name\tdb1
+\tservice_description\tMySQL
+\tcontacts\tdba
+\t}
+
+define contact {
+\tcontact_name\tdba
+\temail\tdba@example.com
+\t}
+
+define contact {
+\tcontact_name\toncall
+\temail\toncall@example.com
+\t}
+
+define contactgroup {
+\tcontactgroup_name\tadmins
+\tcontactgroup_members\toncall-group
+\t}
+
+define contactgroup {
+\tcontactgroup_name\toncall-group
+\tmembers\toncall
+\t}
+'''
+
+
+def test_contacts(tmp_path: Path):
+    objects_cache = tmp_path / 'objects.cache'
+    objects_cache.write_text(OBJECTS_CACHE)
+    index = load_index(objects_cache, tmp_path / 'objects.index.json')
+    assert index.contacts == {
+        'db1': ['dba@example.com', 'oncall@example.com'],
+        'db1;MySQL': ['dba@example.com'],
+    }
+    assert get_contacts_emails(index) == {
+        'dba@example.com', 'oncall@example.com'}
+
+    get_recipients = get_contacts_router(index)
+    host = Record('db1', '', 1, 0, 'check-host-alive', '', False, False)
+    assert get_recipients(host) == {'dba@example.com', 'oncall@example.com'}
+    assert get_recipients(host._replace(service_description='MySQL')) == {
+        'dba@example.com'}
+    assert get_recipients(host._replace(host_name='web1')) == set()
+
+
+class RewrittenStatusFile(StatusFile):
+    '''
+    status.dat rewritten by Nagios after the critical hosts were read
+    '''
+    def get_critical_hosts(self, *args, **kwargs):
+        hosts = super().get_critical_hosts(*args, **kwargs)
+        self.filename.write_text(self.filename.read_text().replace(
+            "current_state=1", "current_state=0"))
+        return hosts
+
+
+def test_routed_report(
+    status_dat: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    routing_file = tmp_path / 'routing.json'
+    routing_file.write_text('[{"emails": ["dba@example.com"], '
+                            '"hosts": ["re:^db"]}]')
+    messages = []
+    monkeypatch.setattr(
+        email, 'deliver', lambda sent, settings: messages.extend(sent))
+
+    with settings.override({'routing_file': str(routing_file)}):
+        report(RewrittenStatusFile(status_dat), [], False, False, False, [])
+    (message, recipients), = messages
+    assert recipients == ['dba@example.com']
+    assert 'db1' in message.as_string()
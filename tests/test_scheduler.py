@@ -0,0 +1,28 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from typing import List
+
+from pynagiosreport.scheduler import Job, Scheduler
+
+
+def test_scheduler():
+    scheduler = Scheduler()
+    runs: List[str] = []
+
+    def fast() -> None:
+        runs.append('fast')
+        if len(runs) >= 5:
+            scheduler.stop()
+
+    def failing() -> None:
+        runs.append('failing')
+        raise RuntimeError('failed')
+
+    scheduler.add(Job('fast', 0.01, fast))
+    scheduler.add(Job('failing', 0.025, failing))
+    scheduler.run()
+
+    assert runs.count('fast') >= 3
+    # failures do not stop the scheduler
+    assert runs.count('failing') >= 1
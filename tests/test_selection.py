@@ -0,0 +1,77 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import random
+
+from pynagiosreport.models import CriticalCounts
+
+from pynagiosreport.nagios.record import Record
+
+from pynagiosreport.nagios.selection import \
+    ReportOrder, Selection, select, select_reported
+
+
+def record(since: int, state: int, host: str, service: str) -> Record:
+    return Record(
+        host_name=host,
+        service_description=service,
+        current_state=state,
+        last_state_change=since,
+        check_command='',
+        output='',
+        acknowledged=False,
+        downtime=False,
+    )
+
+
+RECORDS = [
+    record(1650000000 + i * 7 % 1000, 2 + i % 2, f'host{i % 50}', f'svc{i}')
+    for i in range(1000)
+]
+
+
+def test_top_k_matches_sort():
+    records = [(r, r) for r in RECORDS]
+    random.shuffle(records)
+    for order in ReportOrder:
+        expected = select(records, order)[:20]
+        assert select(iter(records), order, 20) == expected
+
+
+def test_selection():
+    records = list(RECORDS)
+    random.shuffle(records)
+    for order in ReportOrder:
+        selection: Selection[Record] = Selection(order, 20)
+        for r in records:
+            selection.add(r, r)
+        assert len(selection.heap) == 20
+        assert selection.items == select(((r, r) for r in records), order, 20)
+    empty: Selection[Record] = Selection(limit=0)
+    empty.add(RECORDS[0], RECORDS[0])
+    assert empty.items == []
+
+
+def test_orders():
+    records = [
+        (record(10, 3, 'b', 'unknown'), 'unknown'),
+        (record(30, 2, 'a', 'new'), 'new'),
+        (record(20, 2, 'c', 'old'), 'old'),
+    ]
+    names = {
+        order: select(records, order, 2)
+        for order in ReportOrder
+    }
+    assert names[ReportOrder.oldest] == ['unknown', 'old']
+    assert names[ReportOrder.newest] == ['new', 'old']
+    assert names[ReportOrder.state] == ['old', 'new']
+    assert names[ReportOrder.name] == ['new', 'unknown']
+
+
+def test_select_reported():
+    counts = CriticalCounts()
+    selected = select_reported(
+        ((r, r.service_description) for r in RECORDS),
+        filters=[lambda r: r.current_state == 2], counts=counts, limit=3)
+    assert counts.total == 500
+    assert selected == ['svc0', 'svc286', 'svc572']
@@ -0,0 +1,111 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import datetime
+
+from pathlib import Path
+
+import pytest
+
+from pynagiosreport import email
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.report import report, settings
+
+from pynagiosreport.snapshot import \
+    Snapshot, SnapshotEntry, SnapshotStore, diff
+
+from .conftest import block, write_status
+
+
+def test_first_run(status_dat: Path):
+    stat = StatusFile(status_dat)
+    objects = [
+        *stat.get_critical_hosts(False), *stat.get_critical_services(False)]
+    changes = diff(None, objects)
+    assert len(changes.new) == 3
+    assert changes.acknowledged == []
+    assert changes.changed
+
+
+def test_diff(status_dat: Path, tmp_path: Path):
+    stat = StatusFile(status_dat)
+    objects = [
+        *stat.get_critical_hosts(False), *stat.get_critical_services(False)]
+    previous = Snapshot.from_objects([])
+    previous.entries = [
+        SnapshotEntry(host_name='db1', current_state=1),
+        SnapshotEntry(
+            host_name='web1', service_description='HTTP', current_state=2),
+        SnapshotEntry(
+            host_name='db1', service_description='MySQL', current_state=2),
+        SnapshotEntry(
+            host_name='web1', service_description='Ping', current_state=2),
+    ]
+    filename = tmp_path.joinpath('state', 'snapshot.json')
+    previous.save(filename)
+
+    changes = diff(Snapshot.load(filename), objects)
+    assert [obj.host_name for obj in changes.new] == ['web1']
+    assert len(changes.still) == 2
+    assert changes.acknowledged_names == ['db1/MySQL']
+    assert changes.resolved_names == ['web1/Ping']
+
+
+def test_unchanged(status_dat: Path):
+    stat = StatusFile(status_dat)
+    objects = [
+        *stat.get_critical_hosts(False), *stat.get_critical_services(False)]
+    changes = diff(Snapshot.from_objects(objects), objects)
+    assert not changes.changed
+    assert len(changes.still) == 3
+
+
+def test_store(tmp_path: Path):
+    filename = tmp_path / 'snapshot.json'
+    store = SnapshotStore(filename)
+    assert store.load() is None
+    snapshot = Snapshot(created=datetime.datetime(2022, 4, 15))
+    store.save(snapshot)
+    filename.unlink()
+    # kept in memory, the file is only read once
+    assert store.load() is snapshot
+    assert SnapshotStore(filename).load() is None
+
+
+def test_changes_only_report(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture,
+):
+    status_dat = write_status(
+        tmp_path / 'status.dat',
+        block(
+            'hoststatus', host_name='db1', current_state='1',
+            current_attempt='3'),
+        block(
+            'servicestatus', host_name='db1', service_description='MySQL',
+            current_state='2', current_attempt='3'),
+        block(
+            'servicestatus', host_name='web1', service_description='HTTP',
+            current_state='2', current_attempt='3'))
+    sent = []
+    monkeypatch.setattr(
+        email, 'send',
+        lambda hosts, services, *args, **kwargs: sent.append(services))
+
+    with settings.override({'state_dir': str(tmp_path)}):
+        report(
+            StatusFile(status_dat), ['noc@example.com'], False, False, True,
+            ['email'])
+        assert settings.snapshot_file.exists()
+
+    # the changes hold every new object, stdout still folds the services
+    # of the critical hosts into their host line
+    services, = sent
+    assert [s.service_description for s in services] == ['MySQL', 'HTTP']
+    output = capsys.readouterr().out
+    assert '(1 services)' in output
+    assert 'MySQL' not in output
+    assert 'HTTP' in output
@@ -0,0 +1,32 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import os
+
+from pathlib import Path
+
+from pynagiosreport.storage import FileCache, write_atomic
+
+
+def test_file_cache(tmp_path: Path):
+    filename = tmp_path / 'rules.json'
+    write_atomic(filename, '[1]')
+    assert [p.name for p in tmp_path.iterdir()] == ['rules.json']
+
+    cache: FileCache[str] = FileCache()
+    loaded = []
+
+    def load() -> str:
+        loaded.append(filename.read_text())
+        return loaded[-1]
+
+    assert cache.get([filename], load) == '[1]'
+    assert cache.get([str(filename)], load) == '[1]'
+    assert len(loaded) == 1
+
+    # same size, only the modification time changed
+    write_atomic(filename, '[2]')
+    stat = filename.stat()
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.get([filename], load) == '[2]'
+    assert len(loaded) == 2
@@ -0,0 +1,36 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import datetime
+
+from pathlib import Path
+
+from pynagiosreport.nagios.objects import ObjectsIndex
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.summary import summarize
+
+
+def test_summary(status_dat: Path):
+    status = StatusFile(status_dat)
+    now = datetime.datetime.fromtimestamp(
+        1650000000, datetime.timezone.utc)
+
+    summary = summarize(
+        status.iter_host_records(unchecked=False),
+        status.iter_service_records(unchecked=False),
+        ObjectsIndex(hostgroups={'web1': ['web']}),
+        now=now)
+
+    assert summary.hosts.total.count == 1
+    assert summary.hosts.by_state['DOWN'].oldest_age == 10000
+    assert summary.services.total.count == 3
+    assert summary.services.total.oldest_age == 10000000
+    assert {
+        key: count.count for key, count in summary.services.by_state.items()
+    } == {'CRITICAL': 2, 'UNKNOWN': 1}
+    assert summary.services.by_status['acknowledged'].count == 1
+    assert summary.services.by_hostgroup['web'].count == 2
+    assert summary.services.by_hostgroup['web'].oldest_age == 5000
+    assert summary.services.by_check_command['check_ping'].count == 3
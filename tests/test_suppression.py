@@ -0,0 +1,148 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+from pathlib import Path
+
+from pynagiosreport.models import CriticalCounts
+
+from pynagiosreport.nagios.statusfile import StatusFile
+
+from pynagiosreport.nagios.objects import load_index, service_key
+
+from pynagiosreport.suppression import HostCollapse, Topology
+
+from .conftest import block, write_status
+
+
+def test_host_collapse(status_dat: Path):
+    with open(status_dat, 'a') as fp:
+        fp.write(block(
+            'servicestatus', host_name='db1', service_description='SSH',
+            current_state='2', current_attempt='3'))
+    status = StatusFile(status_dat)
+    hosts_counts = CriticalCounts()
+    services_counts = CriticalCounts()
+
+    hosts = status.get_critical_hosts(counts=hosts_counts)
+    services = status.get_critical_services(
+        counts=services_counts,
+        filters=[HostCollapse(
+            hosts_counts.by_host, hosts_counts.services_by_host)])
+
+    assert [h.host_name for h in hosts] == ['db1']
+    assert {s.host_name for s in services} == {'web1'}
+    assert services_counts.total == 2
+    assert hosts_counts.services_by_host == {'db1': 1}
+
+
+OBJECTS_CACHE = '''
+define host {
+\thost_name\trouter1
+\t}
+
+define host {
+\thost_name\tdb1
+\tparents\trouter1
+\t}
+
+define host {
+\thost_name\tweb1
+\tparents\tdb1
+\t}
+
+define servicedependency {
+\thost_name\tweb1
+\tservice_description\tHTTP
+\tdependent_host_name\tweb1
+\tdependent_service_description\tDisk
+\t}
+'''
+
+
+def test_objects_index(tmp_path: Path):
+    objects_cache = tmp_path / 'objects.cache'
+    objects_cache.write_text(OBJECTS_CACHE)
+    cache_file = tmp_path / 'objects.index.json'
+
+    index = load_index(objects_cache, cache_file)
+    assert index.parents == {'db1': ['router1'], 'web1': ['db1']}
+    assert index.service_dependencies == {'web1;Disk': ['web1;HTTP']}
+    assert cache_file.exists()
+    assert load_index(objects_cache, cache_file) is index
+
+    objects_cache.write_text(OBJECTS_CACHE.replace('\tparents\tdb1\n', ''))
+    assert load_index(objects_cache, cache_file).parents == {
+        'db1': ['router1']}
+
+
+def test_topology(tmp_path: Path):
+    status_dat = write_status(
+        tmp_path / 'status.dat',
+        block(
+            'hoststatus', host_name='router1', current_state='1',
+            current_attempt='3'),
+        # db1 is behind router1
+        block(
+            'hoststatus', host_name='db1', current_state='2',
+            current_attempt='3'),
+        block(
+            'servicestatus', host_name='web1', service_description='HTTP',
+            current_state='2', current_attempt='3'),
+        # Disk depends on HTTP
+        block(
+            'servicestatus', host_name='web1', service_description='Disk',
+            current_state='2', current_attempt='3'),
+    )
+    objects_cache = tmp_path / 'objects.cache'
+    objects_cache.write_text(OBJECTS_CACHE)
+    index = load_index(objects_cache)
+    status = StatusFile(status_dat)
+    host_names = {r.host_name for r in status.iter_host_records()}
+    service_keys = {
+        service_key(r.host_name, r.service_description)
+        for r in status.iter_service_records()}
+    hosts_counts = CriticalCounts()
+    services_counts = CriticalCounts()
+
+    hosts = status.get_critical_hosts(
+        counts=hosts_counts,
+        filters=[Topology(
+            index, host_names, service_keys, hosts_counts.suppressed)])
+    services = status.get_critical_services(
+        counts=services_counts,
+        filters=[Topology(
+            index, host_names, service_keys, services_counts.suppressed)])
+
+    assert [h.host_name for h in hosts] == ['router1']
+    assert hosts_counts.suppressed == {'router1': 1}
+    assert [s.service_description for s in services] == ['HTTP']
+    assert services_counts.suppressed == {'web1/HTTP': 1}
+
+
+def test_topology_chain(tmp_path: Path):
+    # router1 is DOWN, db1 behind it and web1 behind db1 are UNREACHABLE
+    status_dat = write_status(
+        tmp_path / 'status.dat',
+        block(
+            'hoststatus', host_name='router1', current_state='1',
+            current_attempt='3'),
+        block(
+            'hoststatus', host_name='db1', current_state='2',
+            current_attempt='3'),
+        block(
+            'hoststatus', host_name='web1', current_state='2',
+            current_attempt='3'),
+    )
+    objects_cache = tmp_path / 'objects.cache'
+    objects_cache.write_text(OBJECTS_CACHE)
+    index = load_index(objects_cache)
+    status = StatusFile(status_dat)
+    host_names = {r.host_name for r in status.iter_host_records()}
+    hosts_counts = CriticalCounts()
+
+    hosts = status.get_critical_hosts(
+        counts=hosts_counts,
+        filters=[Topology(index, host_names, (), hosts_counts.suppressed)])
+
+    assert [h.host_name for h in hosts] == ['router1']
+    assert hosts_counts.suppressed == {'router1': 2}
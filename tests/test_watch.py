@@ -0,0 +1,40 @@
+"""
+..  codeauthor:: Charles Blais
+"""
+import os
+
+import threading
+
+from pathlib import Path
+
+from pynagiosreport.watch import StatusFileWatcher
+
+
+def test_rename(tmp_path: Path):
+    filename = tmp_path.joinpath('status.dat')
+    filename.write_text('old')
+    watcher = StatusFileWatcher(str(filename), debounce=0.1)
+    try:
+        assert not watcher.wait(timeout=0.2)
+
+        def rewrite():
+            tmp = tmp_path.joinpath('nagios.tmp')
+            tmp.write_text('new status')
+            os.replace(tmp, filename)
+
+        threading.Timer(0.1, rewrite).start()
+        assert watcher.wait(timeout=5)
+        # nothing landed since
+        assert not watcher.wait(timeout=0.2)
+    finally:
+        watcher.close()
+
+
+def test_polling(tmp_path: Path):
+    filename = tmp_path.joinpath('status.dat')
+    filename.write_text('old')
+    watcher = StatusFileWatcher(str(filename), poll_interval=0.05)
+    watcher.close()
+    assert not watcher.wait(timeout=0.1)
+    filename.write_text('a different status')
+    assert watcher.wait(timeout=1)